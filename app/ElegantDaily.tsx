@@ -197,12 +197,19 @@ type Entry = {
   url?: string;            // 相对路径 md 文件，如 "game/2025/09/08.md"
   content?: string;        // 也可直接内联 md
   _md?: string;            // 运行期解析后的 md 文本
+  _html?: string;          // 发布端预渲染的正文（DD.html），存在时桌面端直接插入
+  _cards?: MobileCards;    // DD.html 末尾附带的移动端分节卡片，存在时移动端不再解析 md
   _meta?: {
     category?: string;
     sources?: { label: string; href: string }[];
   };
   _toc?: { id: string; text: string }[];
 };
+type SourceLink = { label: string; href: string };
+type MobileCards = {
+  sections: { title: string; category?: string; sources: SourceLink[]; insight?: string; bullets: string[] }[];
+  related: SourceLink[];
+};
 type Manifest = {
   site: {
     title: string;
@@ -263,6 +270,89 @@ function withBuildTag(u: string): string {
     return u;
   }
 }
+// 全文检索分词：与 dify_publisher.search_tokens 保持一致（NFKC + 小写；ASCII 连续串为词，中日韩连续字符切二元组，孤立单字成词）
+const SEARCH_TOKEN_RE = /[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+/g;
+function searchTokens(text: string): string[] {
+  const out = new Set<string>();
+  for (const run of String(text || '').normalize('NFKC').toLowerCase().match(SEARCH_TOKEN_RE) || []) {
+    if (run.charCodeAt(0) < 0x80) {
+      if (run.length > 1 && run.length <= 32) out.add(run);
+    } else if (run.length === 1) {
+      out.add(run);
+    } else {
+      for (let i = 0; i < run.length - 1; i++) out.add(run.slice(i, i + 2));
+    }
+  }
+  return Array.from(out);
+}
+// 检索分片：词 -> 日号位图（bit d 表示当月 d 号）
+type SearchShard = { docs: { d: string; t: string; u: string }[]; postings: Map<string, number> };
+function parseSearchShard(data: any): SearchShard {
+  const postings = new Map<string, number>();
+  for (const g of (data && data.groups) || []) {
+    let day = 0;
+    let mask = 0;
+    for (const delta of g.p || []) {
+      day += delta;
+      mask |= 2 ** day;
+    }
+    for (const term of String(g.t || '').split(' ')) if (term) postings.set(term, mask);
+  }
+  return { docs: (data && data.docs) || [], postings };
+}
+// 查询词按 AND 求交；索引里没有的词（正在输入的英文前缀、单个汉字）退化为扫描词表做前缀/包含匹配
+function searchShard(shard: SearchShard, terms: string[]): Set<string> {
+  let hit = -1;
+  for (const term of terms) {
+    let mask = shard.postings.get(term);
+    if (mask === undefined) {
+      mask = 0;
+      const ascii = term.charCodeAt(0) < 0x80;
+      shard.postings.forEach((m, k) => {
+        if (ascii ? k.startsWith(term) : k.includes(term)) mask = (mask as number) | m;
+      });
+    }
+    hit &= mask;
+    if (!hit) break;
+  }
+  const dates = new Set<string>();
+  for (const doc of shard.docs) if (hit & (2 ** Number(doc.d.slice(8, 10)))) dates.add(doc.d);
+  return dates;
+}
+// 预渲染正文：首行注释记录源 .md 的 SHA-256，与本次拉到的 .md 不一致（片段过期）时返回 undefined，退回前端渲染
+const PRERENDERED_HEADER_RE = /^<!-- dify-html v\d+ sha256=([0-9a-f]{64}) -->\n/;
+async function fetchPrerendered(mdUrl: string): Promise<string> {
+  try {
+    const res = await fetch(asset('/' + mdUrl.replace(/^\//, '').replace(/\.md$/, '.html')), { cache: "no-store" });
+    return res.ok ? await res.text() : "";
+  } catch {
+    return "";
+  }
+}
+async function matchPrerendered(html: string, md: string): Promise<string | undefined> {
+  const m = PRERENDERED_HEADER_RE.exec(html);
+  if (!m) return undefined;
+  try {
+    if (typeof crypto !== 'undefined' && crypto.subtle) {
+      const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(md));
+      const hex = Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+      if (hex !== m[1]) return undefined;
+    }
+  } catch {
+    return undefined;
+  }
+  return html.slice(m[0].length);
+}
+const MOBILE_CARDS_RE = /<script type="application\/json" data-mobile-cards>([\s\S]*?)<\/script>\n?$/;
+function splitMobileCards(html: string | undefined): { html?: string; cards?: MobileCards } {
+  const m = html ? MOBILE_CARDS_RE.exec(html) : null;
+  if (!html || !m) return { html };
+  try {
+    return { html: html.slice(0, m.index), cards: JSON.parse(m[1]) };
+  } catch {
+    return { html: html.slice(0, m.index) };
+  }
+}
 function makeExcerpt(md: string): string {
   const lines = md.split('\n');
   for (const raw of lines) {
@@ -399,6 +489,12 @@ export default function ElegantDaily() {
   const [tocOpen, setTocOpen] = useState(false);
   // 仅用于首次根据 URL 参数打开详情，避免重复触发
   const didOpenFromUrlRef = useRef(false);
+  // 分片 manifest：index.json 只含月份列表，月份条目按需拉取 manifest/<cat>/<YYYY-MM>.json
+  const shardedRef = useRef(false);
+  const loadedShardsRef = useRef<Set<string>>(new Set());
+  // 全文检索：按 分类/月份 缓存检索分片，只拉当前分类当前月份那一片；命中的日期集合，null 表示未启用
+  const searchShardsRef = useRef<Map<string, Promise<SearchShard | null>>>(new Map());
+  const [searchHits, setSearchHits] = useState<Set<string> | null>(null);
 
   // 今日日期（本地时区）
   const todayIso = useMemo(() => {
@@ -462,10 +558,69 @@ export default function ElegantDaily() {
       el.removeEventListener('scroll', onScroll as any);
     };
   }, [detail]);
-  // 拉取 manifest（优先根目录 ./manifest.json）
+  // 拉取单个月份分片并合并进 manifest（已拉取/拉取中的分片直接跳过）
+  async function ensureShard(c: string, m: string) {
+    if (!shardedRef.current || !c || !m) return;
+    const key = `${c}/${m}`;
+    if (loadedShardsRef.current.has(key)) return;
+    loadedShardsRef.current.add(key);
+    try {
+      const res = await fetch(withBuildTag(asset(`/manifest/${key}.json`)), { cache: 'no-store' });
+      if (!res.ok) throw new Error(String(res.status));
+      const list = (await res.json()) as Entry[];
+      setManifest((prev) => ({
+        ...prev,
+        months: { ...prev.months, [c]: { ...(prev.months[c] || {}), [m]: Array.isArray(list) ? list : [] } },
+      }));
+    } catch {
+      loadedShardsRef.current.delete(key);
+    }
+  }
+  // 拉取检索分片（失败时返回 null，页面退回到标题/摘要过滤；失败的请求不缓存，下次再试）
+  function loadSearchShard(c: string, m: string): Promise<SearchShard | null> {
+    const key = `${c}/${m}`;
+    let p = searchShardsRef.current.get(key);
+    if (!p) {
+      p = fetch(withBuildTag(asset(`/search/${key}.json`)), { cache: 'no-store' })
+        .then((res) => (res.ok ? res.json() : Promise.reject(res.status)))
+        .then(parseSearchShard)
+        .catch(() => {
+          searchShardsRef.current.delete(key);
+          return null;
+        });
+      searchShardsRef.current.set(key, p);
+    }
+    return p;
+  }
+  // 拉取 manifest（优先分片索引 manifest/index.json，缺失时回退整份 ./manifest.json）
   useEffect(() => {
     async function load() {
       try {
+        const idxRes = await fetch(withBuildTag(asset('/manifest/index.json')), { cache: 'no-store' }).catch(() => null);
+        if (idxRes && idxRes.ok) {
+          const idx = (await idxRes.json()) as any;
+          // 先用空数组占位月份，条目在选中该月份时再拉取
+          const months: Manifest["months"] = {};
+          for (const [c, mm] of Object.entries((idx.shards || {}) as Record<string, Record<string, number>>)) {
+            months[c] = {};
+            for (const m of Object.keys(mm || {})) months[c][m] = [];
+          }
+          shardedRef.current = true;
+          setManifest({
+            site: {
+              title: idx.site?.title ?? "每日精选",
+              description: idx.site?.description ?? "",
+              baseUrl: idx.site?.baseUrl ?? "",
+            },
+            categories: idx.categories || {},
+            months,
+          });
+          const cats = Object.keys(months);
+          const pickCat = cats.find((c) => Object.keys(months[c] || {}).length > 0) || (cats[0] as any) || "game";
+          setCat(pickCat);
+          setMonth(Object.keys(months[pickCat] || {}).sort().reverse()[0] || "");
+          return;
+        }
         let res = await fetch(withBuildTag(asset('/manifest.json')), { cache: 'no-store', signal: AbortController && new AbortController().signal });
         if (!res.ok) {
           try { res = await fetch(withBuildTag('./manifest.json'), { cache: 'no-store' }); } catch {}
@@ -548,6 +703,12 @@ export default function ElegantDaily() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [manifest]);
 
+  // 当前分类/月份变化时按需拉取对应分片
+  useEffect(() => {
+    ensureShard(String(cat), month);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [cat, month]);
+
   // 根据 URL 参数（如 ?date=2025-09-10&cat=game）在加载完 manifest 后自动打开详情
   useEffect(() => {
     if (didOpenFromUrlRef.current) return;
@@ -564,6 +725,15 @@ export default function ElegantDaily() {
       // 在所有分类与月份中查找匹配项
       const cats = Object.keys(manifest.months) as (keyof Manifest['months'])[];
       const searchCats = catParam && cats.includes(catParam as any) ? [catParam as any] : cats;
+      // 分片模式：先拉取日期所在月份的分片，拉取完成后 manifest 变化会再次触发本 effect
+      if (shardedRef.current && dateParam) {
+        const mk = dateParam.slice(0, 7);
+        const pending = searchCats.filter((c) => manifest.months[c]?.[mk] && !loadedShardsRef.current.has(`${c}/${mk}`));
+        if (pending.length) {
+          pending.forEach((c) => ensureShard(String(c), mk));
+          return;
+        }
+      }
       for (const c of searchCats) {
         const monthsMap = manifest.months[c] || {};
         for (const m of Object.keys(monthsMap)) {
@@ -590,16 +760,35 @@ export default function ElegantDaily() {
     const mm = Object.keys(manifest.months?.[cat] || {});
     return mm.sort().reverse();
   }, [manifest, cat]);
-  // 当前月份的条目（倒序，支持搜索）
+  // 输入停顿 250ms 后查全文检索分片
+  useEffect(() => {
+    const terms = searchTokens(query);
+    if (!terms.length || !month) {
+      setSearchHits(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      const shard = await loadSearchShard(String(cat), month);
+      if (!cancelled) setSearchHits(shard ? searchShard(shard, terms) : null);
+    }, 250);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [query, cat, month]);
+  // 当前月份的条目（倒序，支持搜索：标题/标签/摘要包含，或正文全文命中）
   const entries = useMemo(() => {
     const list = (manifest.months?.[cat]?.[month] || []).slice();
     list.sort((a, b) => String(b.date).localeCompare(String(a.date)));
     const q = (query || "").toLowerCase();
     if (!q) return list;
     return list.filter((p) =>
-      [p.title, p.summary, (p.tags || []).join(" ")].join(" ").toLowerCase().includes(q)
+      [p.title, p.summary, (p.tags || []).join(" ")].join(" ").toLowerCase().includes(q) ||
+      Boolean(searchHits && searchHits.has(p.date))
     );
-  }, [manifest, cat, month, query]);
+  }, [manifest, cat, month, query, searchHits]);
   // 懒加载摘要：若清单中缺失 summary，则抓取对应 Markdown 提取首段
   useEffect(() => {
     let aborted = false;
@@ -635,6 +824,8 @@ export default function ElegantDaily() {
   }
   async function openDetail(p: Entry) {
     let md = p.content || "";
+    // 与 .md 并行拉取预渲染正文
+    const prerendered = !md && p.url ? fetchPrerendered(String(p.url)) : Promise.resolve("");
     if (!md && p.url) {
       try {
         // p.url已经是相对路径 'ai/2024/01/01.md'，浏览器会自动处理
@@ -652,7 +843,8 @@ export default function ElegantDaily() {
     const cleaned = stripLeadingTocAndIntro(stripFirstHeading(md, p.title));
     const normalized = normalizeMarkdown(stripFrontmatter(cleaned));
     const { md: finalMd, meta, toc } = parseMetaAndToc(normalized);
-    setDetail({ ...p, _md: finalMd, _meta: meta, _toc: toc });
+    const { html, cards } = splitMobileCards(await matchPrerendered(await prerendered, md));
+    setDetail({ ...p, _md: finalMd, _html: html, _cards: cards, _meta: meta, _toc: toc });
     setTocOpen(false);
   }
 
@@ -892,8 +1084,7 @@ export default function ElegantDaily() {
       </article>
     );
   }
-  function MobileRelatedSection({ body }: { body: string }) {
-    const links = extractLinks(body);
+  function MobileRelatedSection({ links }: { links: SourceLink[] }) {
     if (!links.length) return null;
     return (
       <section className="mt-6 rounded-2xl bg-white p-4 shadow-[0_2px_8px_rgba(0,0,0,0.08)] dark:bg-[#2E2E2E] dark:shadow-[0_2px_8px_rgba(0,0,0,0.30)]">
@@ -912,32 +1103,37 @@ export default function ElegantDaily() {
       </section>
     );
   }
-  function MobileNewsSectionList({ rawMd }: { rawMd: string; md: string }) {
-    const rawSections = useMemo(() => splitByH2(rawMd || ''), [rawMd]);
-    const docMeta = useMemo(() => parseDocMeta(rawMd || ''), [rawMd]);
+  // 发布端 mobile_cards() 按同一套规则生成 DD.html 末尾的卡片数据，改动这里时同步修改
+  function parseMobileCards(rawMd: string): MobileCards | null {
+    const rawSections = splitByH2(rawMd);
     if (!rawSections.length) return null;
+    const docMeta = parseDocMeta(rawMd);
     const relatedIndex = rawSections.findIndex(s => /^其他相关资讯/.test(String(s.title).trim()));
     const newsSections = relatedIndex >= 0 ? rawSections.filter((_, idx) => idx !== relatedIndex) : rawSections;
-    const relatedBody = relatedIndex >= 0 ? rawSections[relatedIndex].body : '';
+    const sections = newsSections.map((s) => {
+      const meta = parseSectionMeta(s.title + '\\n' + s.body);
+      if (!meta.category && docMeta.category) meta.category = docMeta.category;
+      if ((!meta.sources || meta.sources.length === 0) && docMeta.sources?.length) meta.sources = docMeta.sources;
+      return { title: s.title, category: meta.category, sources: meta.sources, ...parseSectionBody(s.body) };
+    });
+    return { sections, related: relatedIndex >= 0 ? extractLinks(rawSections[relatedIndex].body) : [] };
+  }
+  function MobileNewsSectionList({ rawMd, cards }: { rawMd: string; md: string; cards?: MobileCards }) {
+    const parsed = useMemo(() => cards || parseMobileCards(rawMd || ''), [rawMd, cards]);
+    if (!parsed) return null;
     return (
       <div className="news-container space-y-4 px-0 py-3">
-        {newsSections.map((s, i) => {
-          const meta = parseSectionMeta(s.title + '\\n' + s.body);
-          if (!meta.category && docMeta.category) meta.category = docMeta.category;
-          if ((!meta.sources || meta.sources.length === 0) && docMeta.sources?.length) meta.sources = docMeta.sources;
-          const parsed = parseSectionBody(s.body);
-          return (
-            <MobileNewsCard
-              key={`${i}-${s.title}`}
-              title={s.title}
-              category={meta.category}
-              sources={meta.sources}
-              insight={parsed.insight}
-              bullets={parsed.bullets}
-            />
-          );
-        })}
-        {relatedIndex >= 0 && <MobileRelatedSection body={relatedBody} />}
+        {parsed.sections.map((s, i) => (
+          <MobileNewsCard
+            key={`${i}-${s.title}`}
+            title={s.title}
+            category={s.category}
+            sources={s.sources}
+            insight={s.insight}
+            bullets={s.bullets}
+          />
+        ))}
+        <MobileRelatedSection links={parsed.related} />
       </div>
     );
   }
@@ -1032,7 +1228,7 @@ export default function ElegantDaily() {
             <input
               value={query}
               onChange={(e) => setQuery(e.target.value)}
-                placeholder="搜索标题/标签/摘要…"
+                placeholder="搜索标题/标签/正文…"
                 className="w-full rounded-2xl border border-slate-200 bg-white/80 py-2 pl-9 pr-3 text-sm text-slate-900 placeholder:text-slate-500 shadow-inner outline-none ring-1 ring-transparent focus:border-slate-300 focus:ring-slate-200 dark:border-white/10 dark:bg-slate-950/40 dark:text-slate-100 dark:placeholder:text-slate-400 dark:focus:border-white/20 dark:focus:ring-white/10"
                 aria-label="搜索文章"
                 role="searchbox"
@@ -1202,15 +1398,19 @@ export default function ElegantDaily() {
                 {/* Mobile section cards */}
                 <div className="block sm:hidden">
                   {detail._md ? (
-                    <MobileNewsSectionList rawMd={rawMd} md={detail._md || ''} />
+                    <MobileNewsSectionList rawMd={rawMd} md={detail._md || ''} cards={detail._cards} />
                   ) : null}
                 </div>
                 <article className="prose prose-slate dark:prose-invert max-w-none hidden sm:block markdown-body">
-                  <div className="px-2 sm:px-6 py-4">
-                    <ReactMarkdown remarkPlugins={[remarkGfm, remarkBreaks]} components={mdComponents}>
-                      {detail._md || "（暂无内容）"}
-                    </ReactMarkdown>
-                  </div>
+                  {detail._html ? (
+                    <div className="px-2 sm:px-6 py-4" dangerouslySetInnerHTML={{ __html: detail._html }} />
+                  ) : (
+                    <div className="px-2 sm:px-6 py-4">
+                      <ReactMarkdown remarkPlugins={[remarkGfm, remarkBreaks]} components={mdComponents}>
+                        {detail._md || "（暂无内容）"}
+                      </ReactMarkdown>
+                    </div>
+                  )}
                 </article>
                 {/* footer actions (removed copy button as requested) */}
               </div>
@@ -1270,7 +1470,7 @@ export default function ElegantDaily() {
                   </span>
                 </div>
                 {detail._md ? (
-                  <MobileNewsSectionList rawMd={rawMd} md={detail._md || ''} />
+                  <MobileNewsSectionList rawMd={rawMd} md={detail._md || ''} cards={detail._cards} />
                 ) : (
                   <p className="text-slate-500 dark:text-slate-400">暂无内容</p>
                 )}
@@ -1304,7 +1504,7 @@ export default function ElegantDaily() {
         <div className="mx-auto max-w-6xl">
           <p>
             本示例：<strong>React + Tailwind + Framer Motion</strong>（零后端）。
-            数据来自 <code>manifest.json</code> 或内置种子；条目可用 <code>url</code> 指向独立 Markdown 文件。
+            数据来自 <code>manifest/index.json</code>（按月分片）或 <code>manifest.json</code>；条目可用 <code>url</code> 指向独立 Markdown 文件。
           </p>
         </div>
       </footer>
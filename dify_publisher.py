@@ -1,10 +1,11 @@
 # dify_publisher.py (v16 - 修复 pythonw 兼容性 + 内容校验)
-# 本地 HTTP 服务：接收 Dify Webhook，自动修正排版，归档到 GitHub Pages 仓库，并更新 manifest.json 后 push
+# 本地 HTTP 服务：接收 Dify Webhook，自动修正排版，归档到 GitHub Pages 仓库，并更新 manifest 分片后 push
 
 import http.server
 import socketserver
 import json
 import os
+import copy
 import subprocess
 from datetime import datetime, timezone, timedelta
 import tempfile
@@ -12,6 +13,27 @@ import shutil
 import re
 import sys
 import logging
+import queue
+import threading
+import socket
+import base64
+import uuid
+import time
+import argparse
+import difflib
+import zlib
+import hashlib
+import gzip
+import html
+import urllib.parse
+import urllib.request
+import io
+import email.utils
+from xml.sax.saxutils import escape as xml_escape, quoteattr as xml_quoteattr
+import unicodedata
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Optional
 
 # ===== pythonw 兼容性修复 =====
@@ -57,6 +79,47 @@ GITHUB_REPO_PATH = r"C:\Users\arashiduan\daily-site"  # 本地仓库绝对路径
 PORT = 19600                                          # 监听端口
 PUBLIC_DIR = "public"                                 # public 目录名
 WRITE_TO_ROOT = True                                  # True: 同时写入仓库根目录与 public/
+MANIFEST_DIR = "manifest"                             # 分片 manifest 目录：index.json + <分类>/<YYYY-MM>.json
+WRITE_LEGACY_MANIFEST = False                         # True: 额外维护整份 manifest.json（旧版前端/外部脚本使用）
+SEARCH_INDEX = True                                   # True: 发布时同步更新全文检索分片 search/<分类>/<YYYY-MM>.json
+SEARCH_DIR = "search"                                 # 检索分片目录（与 manifest 一样写入 public/，WRITE_TO_ROOT 时也写根目录）
+RENDER_HTML = True                                    # True: 发布时在 DD.md 旁生成预渲染正文 DD.html（需 pip install markdown；代码高亮需 pygments）
+FEEDS = True                                          # True: 发布时增量维护订阅源 <分类>/feed.json|feed.xml|atom.xml 及全站合并的根目录 feed.*
+FEED_MAX_ITEMS = 30                                   # 每个订阅源保留的最近条目数
+SITE_URL = "https://moxxiran.github.io/daily-site"   # 站点绝对地址，订阅源中的链接以此为前缀
+ASSETS = True                                         # True: 发布时把正文内嵌图片（base64 data URI、本地图片路径）提取到 public/assets/<sha256>.<ext>，相同图片只存一份
+ASSETS_DIR = "assets"                                 # 图片资源目录（写入 public/，WRITE_TO_ROOT 时也写根目录；文件一经写入不再改写）
+IMAGE_LOCAL_DIRS = [os.path.join(SCRIPT_DIR, ".codebuddy", ".ignored_image")]  # 正文引用本地图片时只在这些目录内查找，其他路径保持原样
+IMAGE_WIDTHS = (640, 1280)                            # 需 pip install pillow：另存这些宽度的 WebP（只缩小不放大），正文显示其中最大的一档并链接原图
+IMAGE_WEBP_QUALITY = 80                               # WebP 质量（0-100）
+IMAGE_WORKERS = 4                                     # 生成 WebP 的线程数
+IMAGE_MAX_BYTES = 8 * 1024 * 1024                     # 单张图片上限，超出的引用保持原样
+PRECOMPRESS = True                                    # True: 为 DD.html / manifest / 检索分片额外写 .gz（装了 brotli 时再写 .br），供 gzip_static/brotli_static 直出
+GIT_BACKEND = "worktree"                              # "plumbing": 不写工作区，经常驻 fast-import/cat-file 直接在对象库生成提交（建议配合独立的 bare 克隆）
+LOG_FORMAT = "text"                                   # "json": 每行一个 JSON 对象，附带各阶段/git 耗时字段，便于 grep/jq
+TARGETS_CONFIG = os.path.join(SCRIPT_DIR, "dify_targets.json")  # 多站点配置：每个目标独立的仓库/分支/路由/manifest（格式见“发布目标”一节）；不存在时按本节单站点配置运行
+
+# ===== 发布队列 =====
+QUEUE_DIR = os.path.join(SCRIPT_DIR, ".publish_queue")  # 任务持久化目录（崩溃重启后重放未完成任务）
+JOB_RETENTION_SECONDS = 7 * 24 * 3600                  # 已完成/失败任务状态的保留时长
+GIT_BATCH_WINDOW = 3.0                                 # 批量提交防抖窗口（秒）：窗口内到达的报告合并为一次 commit/push；0 关闭批量
+GIT_BATCH_MAX = 20                                     # 单批最多合并的报告数
+MAX_QUEUE_DEPTH = 200                                  # 发布队列积压上限，超出时 /webhook 返回 503
+HASH_INDEX_PATH = os.path.join(SCRIPT_DIR, ".publish_hashes.json")  # (分类, 日期) → 已发布内容 SHA-256，用于跳过重复提交
+
+# ===== HTTP 并发 =====
+HTTP_WORKERS = 8                                       # 并行处理请求的线程数；0 = 旧版单线程模式
+HTTP_MAX_PENDING = 32                                  # 等待空闲线程的连接上限，超出直接返回 503
+HTTP_REQUEST_TIMEOUT = 60                              # 单个连接读写超时（秒），防止慢连接占住线程
+MAX_BODY_BYTES = 8 * 1024 * 1024                       # 请求体上限（解压前后都校验），超出返回 413
+DRAIN_TIMEOUT = 300                                    # 平滑重启（serve --handoff）时等待在途请求与发布队列清空的最长秒数
+
+# ===== 后台推送 =====
+BACKGROUND_PUSH = True                                 # True: 提交后由后台线程推送（失败指数退避重试，被拒时 fetch + rebase）；False: 提交后同步 push
+PUSH_BACKOFF_BASE = 5                                  # 推送失败后的首次重试等待（秒），之后逐次翻倍
+PUSH_BACKOFF_MAX = 600                                 # 重试等待上限（秒）
+PUSH_MAX_DEFERRALS = 12                                # 仓库忙（有未提交的批次）时连续推迟 rebase 的上限，超出后按失败计数、退避并记录 last_error
+PUSH_TIMEOUT = 120                                     # 单次 git push / fetch 超时（秒）
 
 # ===== 时区：优先 ZoneInfo("Asia/Shanghai")；失败兜底 UTC+08:00 =====
 try:
@@ -71,6 +134,160 @@ except Exception:
     CN_TZ = timezone(timedelta(hours=8), name="Asia/Shanghai")
     TZ_LABEL = "FixedOffset(+08:00)"
 
+# ===== 可选依赖：缺失时对应功能自动关闭 =====
+try:
+    import markdown as _markdown
+except ImportError:
+    _markdown = None
+try:
+    from pygments.lexers import get_lexer_by_name as _get_lexer_by_name
+    from pygments.token import string_to_tokentype as _tokentype
+    from pygments.util import ClassNotFound as _ClassNotFound
+except ImportError:
+    _get_lexer_by_name = None
+try:
+    import brotli as _brotli
+except ImportError:
+    _brotli = None
+try:
+    from PIL import Image as _PILImage
+except ImportError:
+    _PILImage = None
+
+# ===== 运行指标（GET /metrics，Prometheus 文本格式）与结构化日志 =====
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 8388608, 16777216)
+
+
+class Metrics:
+    """进程内指标注册表（线程安全）：counter / histogram / 回调式 gauge，render() 输出 Prometheus 文本格式。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}    # name -> (type, help, buckets 或 gauge 回调)
+        self._values = {}  # name -> {labels: 计数 | [各桶计数, sum, count]}
+
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text, None)
+        self._values.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str, buckets=_LATENCY_BUCKETS):
+        self._meta[name] = ("histogram", help_text, tuple(buckets))
+        self._values.setdefault(name, {})
+
+    def gauge(self, name: str, help_text: str, fn):
+        self._meta[name] = ("gauge", help_text, fn)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self._meta[name][2]
+        with self._lock:
+            h = self._values[name].get(key)
+            if h is None:
+                h = self._values[name][key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[0][i] += 1
+                    break
+            h[1] += value
+            h[2] += 1
+
+    @staticmethod
+    def _labels(pairs) -> str:
+        if not pairs:
+            return ""
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        out = []
+        with self._lock:
+            snapshot = {name: {k: copy.deepcopy(v) for k, v in series.items()} for name, series in self._values.items()}
+        for name, (kind, help_text, extra) in self._meta.items():
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            if kind == "gauge":
+                try:
+                    out.append(f"{name} {extra()}")
+                except Exception as e:
+                    log.warning(f"指标 {name} 取值失败：{e}")
+                continue
+            for key, value in sorted(snapshot.get(name, {}).items()):
+                if kind == "counter":
+                    out.append(f"{name}{self._labels(key)} {value}")
+                    continue
+                counts, total, n = value
+                cumulative = 0
+                for bound, c in zip(extra, counts):
+                    cumulative += c
+                    out.append(f"{name}_bucket{self._labels(key + (('le', repr(float(bound))),))} {cumulative}")
+                out.append(f"{name}_bucket{self._labels(key + (('le', '+Inf'),))} {n}")
+                out.append(f"{name}_sum{self._labels(key)} {total:.6f}")
+                out.append(f"{name}_count{self._labels(key)} {n}")
+        return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+METRICS.histogram("dify_publish_stage_seconds", "Latency of each publish pipeline stage")
+METRICS.counter("dify_publish_total", "Reports handled, by outcome (published/skipped/unchanged/error) and category")
+METRICS.histogram("dify_request_body_bytes", "Webhook request body size after decoding", _SIZE_BUCKETS)
+METRICS.histogram("dify_git_command_seconds", "Duration of git subprocesses, by subcommand")
+METRICS.histogram("dify_atomic_write_seconds", "Duration of atomic_write (temp file + replace)")
+
+
+class _JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+_JSON_LOGS = False
+
+
+def configure_log_format(fmt: str):
+    """切换日志格式：text（默认）或 json。json 模式下额外输出 stage / git 耗时事件。"""
+    global _JSON_LOGS
+    _JSON_LOGS = fmt == "json"
+    formatter = _JsonLogFormatter() if _JSON_LOGS else logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S")
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(formatter)
+
+
+def log_event(event: str, **fields):
+    # 耗时类事件只在 JSON 日志模式下输出，文本日志保持原样
+    if _JSON_LOGS:
+        log.info(event, extra={"fields": dict(fields, event=event)})
+
+
+@contextmanager
+def timed(stage: str, **fields):
+    """记录一个发布阶段的耗时：写入 dify_publish_stage_seconds，JSON 日志模式下同时输出一行 stage 事件。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe("dify_publish_stage_seconds", elapsed, stage=stage)
+        log_event("stage", stage=stage, seconds=round(elapsed, 6), **fields)
+
+
+def count_outcome(outcome: str, category: Optional[str] = None):
+    METRICS.inc("dify_publish_total", outcome=outcome, category=category or "unknown")
+
+
 # ===== manifest 默认模板 =====
 DEFAULT_MANIFEST = {
   "site": { "title": "AI / 游戏 日报", "description": "每天 10 分钟，跟上 AI 与游戏进展", "baseUrl": "" },
@@ -79,109 +296,121 @@ DEFAULT_MANIFEST = {
 }
 
 # ===== 核心改动：v15 强化版 Markdown 格式化函数 =====
+# 行类型判定：预编译、每行只匹配一次（互斥分支，命中的分组名即类型）
+_MD_FENCE_RE = re.compile(r'\s*(`{3}|~{3})')
+_MD_LINE_KIND_RE = re.compile(r'''\s*(?:
+      (?P<fence>`{3}|~{3})
+    | (?P<heading>\#{1,6}\s)
+    | (?P<quote>>)
+    | (?P<list>[-*+]\s|\d+\s*[.)、]\s)
+    | (?P<hr>(?:-{3,}|\*{3,}|_{3,})\s*$)
+)''', re.X)
+_MD_BLOCK_KINDS = frozenset(("heading", "quote", "list", "hr"))
+
+
+def _md_line_kind(line: str) -> Optional[str]:
+    m = _MD_LINE_KIND_RE.match(line)
+    return m.lastgroup if m else None
+
+
 def format_markdown_spacing(md: str) -> str:
     """
     强化 Markdown 规范化（兼容 GitHub/GFM 与 react-markdown）：
     - 统一换行，去零宽/BOM
-    - 不在```代码块```内部做任何改动
+    - 不在```代码块```（含 ~~~ 与缩进围栏）内部做任何改动
     - 块级元素（# 标题、> 引用、列表项、水平线）后，若下一行是紧贴的正文，则自动补一空行
     - 列表“开始前”若上一行是正文，也自动补一空行（含有序列表 1. / 1) / 1、）
+    单遍扫描：每行只判定一次类型，“下一行”的判定结果留给下一轮复用。
     """
     if not md:
         return ""
 
     md = md.replace("\r\n", "\n").replace("\ufeff", "")
     lines = md.split("\n")
+    last = len(lines) - 1
 
     out = []
-    in_code = False
-
-    def is_unordered_list(s: str) -> bool:
-        return bool(re.match(r'^\s*[-*+]\s+', s))
-
-    def is_ordered_list(s: str) -> bool:
-        return bool(re.match(r'^\s*\d+\s*[.)、]\s+', s))
-
-    def is_list(s: str) -> bool:
-        return is_unordered_list(s) or is_ordered_list(s)
-
-    def is_heading(s: str) -> bool:
-        return bool(re.match(r'^\s*#{1,6}\s+', s))
-
-    def is_blockquote(s: str) -> bool:
-        return bool(re.match(r'^\s*>', s))
-
-    def is_hr(s: str) -> bool:
-        return bool(re.match(r'^\s*(?:-{3,}|\*{3,}|_{3,})\s*$', s))
-
-    i = 0
-    prev_line_out = ""  # out 中上一行（已写入的）
+    append = out.append
+    fence = None          # 当前代码块的围栏字符（"`" / "~"），None 表示不在代码块内
+    prev_kind = None      # out 中上一行（已写入的）的类型
+    prev_blank = True     # out 中上一行是否为空白
+    next_kind = None      # 上一轮已判定的 lines[i] 类型
+    next_known = False
+
+    for i, line in enumerate(lines):
+        # 代码块内部：只找同种字符的结束围栏，不改内容
+        if fence is not None:
+            m = _MD_FENCE_RE.match(line)
+            if m and m.group(1)[0] == fence:
+                fence = None
+            append(line)
+            prev_kind, prev_blank, next_known = "fence", not line.strip(), False
+            continue
 
-    while i < len(lines):
-        line = lines[i]
+        kind = next_kind if next_known else _md_line_kind(line)
+        next_known = False
 
         # 代码围栏：只切状态，不改内容
-        if re.match(r'^\s*```', line):
-            in_code = not in_code
-            out.append(line)
-            prev_line_out = line
-            i += 1
-            continue
-
-        if in_code:
-            out.append(line)
-            prev_line_out = line
-            i += 1
+        if kind == "fence":
+            fence = line.lstrip()[0]
+            append(line)
+            prev_kind, prev_blank = kind, False
             continue
 
         # 1) 列表开始前的空行（上一行是正文/非块级）
-        if is_list(line) and prev_line_out.strip() and not (
-            is_list(prev_line_out) or is_blockquote(prev_line_out) or
-            is_heading(prev_line_out) or is_hr(prev_line_out)
-        ):
-            out.append("")  # 在列表前补空行
+        if kind == "list" and not prev_blank and prev_kind not in _MD_BLOCK_KINDS:
+            append("")  # 在列表前补空行
 
-        out.append(line)
+        append(line)
+        prev_kind, prev_blank = kind, not line.strip()
 
         # 2) 块级元素“之后”的空行：下一行若是紧贴的正文，则补空行
-        if i < len(lines) - 1:
+        if kind in _MD_BLOCK_KINDS and i < last:
             nxt = lines[i + 1]
-            if (is_heading(line) or is_blockquote(line) or is_list(line) or is_hr(line)):
-                # 同类连续块（连续 > 引用、连续列表项）不补空行
-                same_block_continuation = (
-                    (is_blockquote(line) and is_blockquote(nxt)) or
-                    (is_list(line) and is_list(nxt))
-                )
-                if nxt.strip() and not same_block_continuation:
-                    out.append("")
-
-        prev_line_out = out[-1] if out else ""
-        i += 1
+            next_kind, next_known = _md_line_kind(nxt), True
+            # 同类连续块（连续 > 引用、连续列表项）不补空行
+            same_block_continuation = (kind == next_kind and kind in ("quote", "list"))
+            if nxt.strip() and not same_block_continuation:
+                append("")
+                prev_kind, prev_blank = None, True
 
     # 末尾统一补一个换行（可选，方便 git diff）
     if out and out[-1] != "":
-        out.append("")
+        append("")
     return "\n".join(out)
 
 # ===== 分类规则 =====
+# 分类规则：按顺序命中任一关键词即归入该分类，都不命中归入 DEFAULT_CATEGORY（多站点时每个目标可单独配置）
+CLASSIFY_RULES = {"game": ["🎮", "游戏行业速递"]}
+DEFAULT_CATEGORY = "ai"
+
+
 def classify(content: str) -> str:
-    return "game" if ("🎮" in content or "游戏行业速递" in content) else "ai"
+    return current_target().classify(content)
 
 
 # ===== 提取标题/摘要 =====
 def extract_title_summary(md: str) -> Tuple[str, str]:
-    m = re.search(r'^\s*#\s+(.+)$', md, flags=re.M)
-    title = m.group(1).strip() if m else (next((ln.strip() for ln in md.splitlines() if ln.strip()), "日报"))
-    plain = re.sub(r'`{1,3}.*?`{1,3}', '', md, flags=re.S)
-    plain = re.sub(r'!\[[^\]]*\]\([^)]+\)', '', plain)
-    plain = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', plain)
-    plain = re.sub(r'[#>*_`~\-]+', ' ', plain)
-    plain = re.sub(r'\s+', ' ', plain).strip()
-    short = (plain[:120] + '...') if len(plain) > 120 else plain
-    return title, short
+    meta = analyze_report(md)
+    return meta.title, meta.summary
 
 
 # ===== 从 H1 标题解析日期（优先使用） =====
+_DATE_DASHED_RE = re.compile(r'(20\d{2})[./-](\d{1,2})[./-](\d{1,2})')
+_DATE_CN_RE = re.compile(r'(20\d{2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日?')
+_FM_DATE_DASHED_RE = re.compile(r'^(20\d{2})[./-](\d{1,2})[./-](\d{1,2})$')
+_FM_DATE_CN_RE = re.compile(r'^(20\d{2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日?$')
+
+
+def _ymd(m) -> Tuple[str, str, str]:
+    return m.group(1), f"{int(m.group(2)):02d}", f"{int(m.group(3)):02d}"
+
+
+def _date_in(text: str) -> Optional[Tuple[str, str, str]]:
+    m = _DATE_DASHED_RE.search(text) or _DATE_CN_RE.search(text)
+    return _ymd(m) if m else None
+
+
 def parse_date_from_h1(md: str) -> Optional[Tuple[str, str, str]]:
     """
     从第一行 H1（# 标题）中提取日期，支持以下格式：
@@ -191,21 +420,8 @@ def parse_date_from_h1(md: str) -> Optional[Tuple[str, str, str]]:
     """
     if not md:
         return None
-    m = re.search(r'^\s*#\s+(.+)$', md, flags=re.M)
-    if not m:
-        return None
-    h1 = m.group(1)
-    # yyyy-mm-dd / yyyy/mm/dd / yyyy.mm.dd
-    m1 = re.search(r'(20\d{2})[./-](\d{1,2})[./-](\d{1,2})', h1)
-    if m1:
-        y, mm, dd = m1.group(1), m1.group(2), m1.group(3)
-        return y, f"{int(mm):02d}", f"{int(dd):02d}"
-    # yyyy年mm月dd日（dd 的“日”可选）
-    m2 = re.search(r'(20\d{2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日?', h1)
-    if m2:
-        y, mm, dd = m2.group(1), m2.group(2), m2.group(3)
-        return y, f"{int(mm):02d}", f"{int(dd):02d}"
-    return None
+    m = _H1_RE.search(md)
+    return _date_in(m.group(1)) if m else None
 
 
 def parse_date_any(md: str) -> Optional[Tuple[str, str, str]]:
@@ -215,45 +431,136 @@ def parse_date_any(md: str) -> Optional[Tuple[str, str, str]]:
     2) H1 标题中
     3) 全文首次出现的日期（同样的格式）
     """
-    if not md:
-        return None
+    return analyze_report(md).date if md else None
+
+
+# ===== 单遍报告分析：标题/摘要/日期/分类/纯文本长度/是否有 H2 =====
+# 逐行判定用的正则与原先整篇 re.search 时完全相同，只是改为在候选行的行首 match
+_H1_RE = re.compile(r'^\s*#\s+(.+)$', re.M)
+_H2_RE = re.compile(r'^\s*##\s+', re.M)
+_FM_DATE_RE = re.compile(r'^\s*date\s*:\s*([^\n\r]+)$', re.M | re.I)
+# 候选行：首个非空白字符是 # 或 d/D 的行（空白行不可能是 ^\s*X 的首个匹配起点之外的新结果）
+_CANDIDATE_LINE_RE = re.compile(r'^[^\S\n]*[#dD]', re.M)
+# 摘要：与旧版 extract_title_summary 相同的五步替换
+_SUM_CODE_RE = re.compile(r'`{1,3}.*?`{1,3}', re.S)
+_SUM_IMAGE_RE = re.compile(r'!\[[^\]]*\]\([^)]+\)')
+_SUM_LINK_RE = re.compile(r'\[([^\]]+)\]\([^)]+\)')
+_SUM_MARK_RE = re.compile(r'[#>*_`~\-]+')
+_SUM_SPACE_RE = re.compile(r'\s+')
+_PLAIN_DROP_RE = re.compile(r'[#>*_`~\-\[\]()!\s]+')  # validate_content 的“纯文本”：去掉标记与全部空白
+SUMMARY_CHARS = 120
+_SUMMARY_PREFIX = 512  # 摘要先在前 512 字符（取整到行尾）上计算，不够再倍增
+
+
+class ReportMeta:
+    """analyze_report 的结果：一篇报告发布所需的全部元数据。"""
+    __slots__ = ("title", "summary", "date", "category", "plain_length", "has_h2")
+
+    def __init__(self, title: str, summary: str, date: Optional[Tuple[str, str, str]],
+                 category: str, plain_length: int, has_h2: bool):
+        self.title = title
+        self.summary = summary
+        self.date = date
+        self.category = category
+        self.plain_length = plain_length
+        self.has_h2 = has_h2
+
+    def __repr__(self):
+        return "ReportMeta(" + ", ".join(f"{k}={getattr(self, k)!r}" for k in self.__slots__) + ")"
+
+
+def _link_may_continue(text: str) -> bool:
+    # 前缀末尾有未闭合的 [..] 或 ](..：整篇替换时这个链接/图片会跨过截断点
+    if text.rfind('[') > text.rfind(']'):
+        return True
+    i = text.rfind('](')
+    return i >= 0 and text.find(')', i + 2) < 0
+
+
+def _strip_code_spans(text: str) -> Tuple[str, bool]:
+    """_SUM_CODE_RE.sub('', text)，并返回最后一个匹配是否全由反引号组成（开头的 ``/``` 找不到配对、回退成自我闭合）。"""
+    parts, pos, last = [], 0, None
+    for last in _SUM_CODE_RE.finditer(text):
+        parts.append(text[pos:last.start()])
+        pos = last.end()
+    parts.append(text[pos:])
+    return "".join(parts), last is not None and not last.group().strip("`")
+
+
+def _summary_plain(md: str) -> str:
+    """
+    摘要用纯文本：只处理足够长的前缀（在行尾截断，逐次倍增），
+    截断点不会落在代码片段或链接/图片中间时，前缀结果的前 SUMMARY_CHARS+1 个字符与整篇处理一致；否则退化为整篇。
+    """
+    size = _SUMMARY_PREFIX
+    while True:
+        cut = md.find("\n", size) + 1 if size < len(md) else 0
+        whole = cut == 0
+        plain, self_closed = _strip_code_spans(md if whole else md[:cut])
+        # 截断前缀里还剩反引号、或最后一段是自我闭合的 ``：整篇时它可能与截断点之后的反引号配对
+        if whole or not (self_closed or '`' in plain or _link_may_continue(plain)):
+            plain = _SUM_IMAGE_RE.sub('', plain)
+            if whole or not _link_may_continue(plain):
+                plain = _SUM_LINK_RE.sub(r'\1', plain)
+                plain = _SUM_MARK_RE.sub(' ', plain)
+                plain = _SUM_SPACE_RE.sub(' ', plain).strip()
+                if whole or len(plain) > SUMMARY_CHARS:
+                    return plain
+        size *= 2
+
+
+def analyze_report(md: str) -> ReportMeta:
+    """
+    一次扫描得到 classify / extract_title_summary / parse_date_any / validate_content 所需的全部信息：
+    用一个多行正则在 C 层找出候选行，只在这些行首跑原有的 H1 / H2 / frontmatter 正则，三者齐了就停；
+    摘要只处理开头一段；全文日期搜索只在 frontmatter 与 H1 都没有日期时才做。结果与旧版各函数逐篇一致。
+    """
+    h1 = fm = None
+    has_h2 = False
+    h2_end = len(md.rstrip())  # validate_content 在 strip() 后的文本上找 H2
+    for cand in _CANDIDATE_LINE_RE.finditer(md):
+        pos = cand.start()
+        if cand.group()[-1] == "#":
+            if h1 is None:
+                h1 = _H1_RE.match(md, pos)
+            if not has_h2:
+                has_h2 = _H2_RE.match(md, pos, h2_end) is not None
+        elif fm is None:
+            fm = _FM_DATE_RE.match(md, pos)
+        if h1 is not None and fm is not None and has_h2:
+            break
+
+    if h1 is not None:
+        title = h1.group(1).strip()
+    else:
+        title = next((ln.strip() for ln in md.splitlines() if ln.strip()), "日报")
 
-    # 1) frontmatter
-    mfm = re.search(r'^\s*date\s*:\s*([^\n\r]+)$', md, flags=re.M | re.I)
-    if mfm:
-        s = mfm.group(1).strip().strip('"\'')
-        m1 = re.search(r'^(20\d{2})[./-](\d{1,2})[./-](\d{1,2})$', s)
-        if m1:
-            y, mm, dd = m1.group(1), m1.group(2), m1.group(3)
-            return y, f"{int(mm):02d}", f"{int(dd):02d}"
-        m2 = re.search(r'^(20\d{2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日?$', s)
-        if m2:
-            y, mm, dd = m2.group(1), m2.group(2), m2.group(3)
-            return y, f"{int(mm):02d}", f"{int(dd):02d}"
-
-    # 2) H1
-    h1d = parse_date_from_h1(md)
-    if h1d:
-        return h1d
-
-    # 3) 全文首次出现
-    m3 = re.search(r'(20\d{2})[./-](\d{1,2})[./-](\d{1,2})', md)
-    if m3:
-        y, mm, dd = m3.group(1), m3.group(2), m3.group(3)
-        return y, f"{int(mm):02d}", f"{int(dd):02d}"
-    m4 = re.search(r'(20\d{2})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日?', md)
-    if m4:
-        y, mm, dd = m4.group(1), m4.group(2), m4.group(3)
-        return y, f"{int(mm):02d}", f"{int(dd):02d}"
+    plain = _summary_plain(md)
+    summary = (plain[:SUMMARY_CHARS] + '...') if len(plain) > SUMMARY_CHARS else plain
 
-    return None
+    date = None
+    if fm is not None:
+        value = fm.group(1).strip().strip('"\'')
+        m = _FM_DATE_DASHED_RE.search(value) or _FM_DATE_CN_RE.search(value)
+        date = _ymd(m) if m else None
+    if date is None and h1 is not None:
+        date = _date_in(h1.group(1))
+    if date is None:
+        date = _date_in(md)
+
+    return ReportMeta(title, summary, date, classify(md), len(_PLAIN_DROP_RE.sub('', md)), has_h2)
 
 
 # ===== 原子写文件 =====
-def atomic_write(path: str, data: str):
+def atomic_write(path: str, data):
+    start = time.perf_counter()
     dirpath = os.path.dirname(path) or "."
     if dirpath and dirpath != ".": os.makedirs(dirpath, exist_ok=True)
-    with tempfile.NamedTemporaryFile('w', delete=False, encoding='utf-8', newline='\n', dir=dirpath) as tmp:
+    if isinstance(data, bytes):
+        tmp = tempfile.NamedTemporaryFile('wb', delete=False, dir=dirpath)
+    else:
+        tmp = tempfile.NamedTemporaryFile('w', delete=False, encoding='utf-8', newline='\n', dir=dirpath)
+    with tmp:
         tmp.write(data)
         tmp_path = tmp.name
     try:
@@ -261,48 +568,1153 @@ def atomic_write(path: str, data: str):
         os.replace(tmp_path, path)
     except Exception:
         shutil.move(tmp_path, path)
+    METRICS.observe("dify_atomic_write_seconds", time.perf_counter() - start)
+
+
+# ===== manifest 进程内缓存 =====
+class ManifestCache:
+    """
+    进程级 manifest 缓存：按绝对路径缓存解析结果，以 (mtime_ns, size, inode) 校验。
+    本进程写盘后用 remember() 登记新的文件戳，下次读取直接命中；
+    git pull / 手工编辑等外部改动会使文件戳变化，自动重新解析。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # abs path -> (stamp, value)
+
+    @staticmethod
+    def _stamp(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def load(self, path: str, parse, default=None):
+        """返回 parse(文件 JSON) 的缓存结果；文件不存在时返回 default()。返回值可原地修改，写盘后须 remember()。"""
+        key = os.path.abspath(path)
+        stamp = self._stamp(key)
+        with self._lock:
+            if stamp is None:
+                self._entries.pop(key, None)
+                return default() if default else None
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        value = parse(_read_json(key, None))
+        with self._lock:
+            self._entries[key] = (stamp, value)
+        return value
+
+    def remember(self, path: str, value):
+        key = os.path.abspath(path)
+        stamp = self._stamp(key)
+        with self._lock:
+            if stamp is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = (stamp, value)
+
+    def invalidate(self, path: Optional[str] = None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+
+MANIFEST_CACHE = ManifestCache()
 
 
 # ===== manifest 初始化 & 覆盖逻辑 =====
+def _parse_manifest(data) -> dict:
+    if not isinstance(data, dict):
+        raise ValueError("manifest.json 不是 JSON 对象")
+    target = current_target()
+    data.setdefault("site", copy.deepcopy(target.site))
+    data.setdefault("categories", dict(target.categories))
+    data.setdefault("months", {})
+    for cat in target.categories:
+        data["months"].setdefault(cat, {})
+    return data
+
+
 def load_or_init_manifest(manifest_path: str) -> dict:
+    target = current_target()
     if not os.path.exists(manifest_path):
         log.info(f"manifest.json 不存在于 {manifest_path}，将使用默认模板创建。")
-        return DEFAULT_MANIFEST.copy()
+        return target.default_manifest()
     try:
-        with open(manifest_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        data.setdefault("site", DEFAULT_MANIFEST["site"])
-        data.setdefault("categories", DEFAULT_MANIFEST["categories"])
-        data.setdefault("months", {"ai": {}, "game": {}})
-        data["months"].setdefault("ai", {})
-        data["months"].setdefault("game", {})
-        return data
+        return MANIFEST_CACHE.load(manifest_path, _parse_manifest, target.default_manifest)
     except Exception as e:
+        MANIFEST_CACHE.invalidate(manifest_path)
         log.warning(f"读取 manifest.json 失败 ({e})，将使用默认模板。")
-        return DEFAULT_MANIFEST.copy()
+        return target.default_manifest()
+
+
+def make_manifest_entry(category: str, yyyy: str, mm: str, dd: str, title: str, summary: str) -> dict:
+    date_str = f"{yyyy}-{mm}-{dd}"
+    url_path = f"{category}/{yyyy}/{mm}/{dd}.md"
+    return { "date": date_str, "title": title, "summary": summary, "tags": [category.capitalize(), "Daily"], "url": url_path }
+
+
+def upsert_entries(entries: list, new_entry: dict) -> list:
+    entries = [e for e in entries if e.get("date") != new_entry["date"]]
+    entries.insert(0, new_entry)
+    return entries
 
 
 def upsert_manifest(manifest: dict, category: str, yyyy: str, mm: str, dd: str, title: str, summary: str):
     month_key = f"{yyyy}-{mm}"
     manifest["months"].setdefault(category, {})
     manifest["months"][category].setdefault(month_key, [])
-    date_str = f"{yyyy}-{mm}-{dd}"
-    url_path = f"{category}/{yyyy}/{mm}/{dd}.md"
-    new_entry = { "date": date_str, "title": title, "summary": summary, "tags": [category.capitalize(), "Daily"], "url": url_path }
-    entries = [e for e in manifest["months"][category][month_key] if e.get("date") != date_str]
-    entries.insert(0, new_entry)
-    manifest["months"][category][month_key] = entries
+    new_entry = make_manifest_entry(category, yyyy, mm, dd, title, summary)
+    manifest["months"][category][month_key] = upsert_entries(manifest["months"][category][month_key], new_entry)
     return manifest
 
 
+# ===== 分片 manifest：index.json + 每个分类/月份一个文件 =====
+def manifest_index_rel() -> str:
+    return os.path.join(current_target().manifest_dir, "index.json")
+
+
+def manifest_shard_rel(category: str, month_key: str) -> str:
+    return os.path.join(current_target().manifest_dir, category, f"{month_key}.json")
+
+
+def build_manifest_index(manifest: dict) -> dict:
+    """index.json 只保留站点信息与 分类 → 月份 → 条目数，前端据此按需拉取分片。"""
+    return {
+        "site": manifest["site"],
+        "categories": manifest["categories"],
+        "shards": {
+            cat: {mk: len(entries) for mk, entries in sorted(months.items(), reverse=True)}
+            for cat, months in manifest["months"].items()
+        },
+    }
+
+
+def _read_json(path: str, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        log.warning(f"读取 {path} 失败 ({e})，按空内容处理。")
+        return default
+
+
+# 超过此大小的文件降低压缩级别：brotli q11 压 1.5 MB 的检索分片要 ~4 s，q9 只需 0.3 s，体积仅大约 15%
+_PRECOMPRESS_FAST_BYTES = 256 * 1024
+
+
+def compressed_variants(data) -> list:
+    """返回 [(".gz", bytes), (".br", bytes)]（未安装 brotli 时只有 .gz）。gzip mtime 固定为 0，内容不变则产物不变。"""
+    raw = data if isinstance(data, bytes) else data.encode("utf-8")
+    large = len(raw) > _PRECOMPRESS_FAST_BYTES
+    with timed("precompress", bytes=len(raw)):
+        variants = [(".gz", gzip.compress(raw, compresslevel=6 if large else 9, mtime=0))]
+        if _brotli is not None:
+            variants.append((".br", _brotli.compress(raw, quality=9 if large else 11)))
+    return variants
+
+
+def write_site_file(rel: str, data) -> list:
+    """写入 public/<rel>（WRITE_TO_ROOT 时同时写仓库根目录），返回写入的路径（相对仓库根目录）。调用方须持有目标的仓库锁。"""
+    target = current_target()
+    paths = [os.path.join(target.public_dir, rel)] + ([rel] if target.write_to_root else [])
+    for path in paths:
+        atomic_write(os.path.join(target.repo, path), data)
+    return paths
+
+
+def _site_read_path(rel: str) -> str:
+    # 工作区中的读取来源：WRITE_TO_ROOT 且根目录副本存在时优先根目录，否则 public/
+    target = current_target()
+    root = os.path.join(target.repo, rel)
+    return root if (target.write_to_root and os.path.exists(root)) else os.path.join(target.repo, target.public_dir, rel)
+
+
+def _parse_shard(data) -> dict:
+    # 分片在内存中是 date -> entry 的 dict，按“倒序”保存：最新 upsert 的条目在末尾，
+    # 这样 upsert 只需 pop + 赋值，序列化时再反转为文件中的顺序
+    entries = data if isinstance(data, list) else []
+    return {e.get("date"): e for e in reversed(entries) if isinstance(e, dict)}
+
+
+def _dump_shard(shard: dict) -> str:
+    return json.dumps(list(reversed(shard.values())), ensure_ascii=False, indent=2)
+
+
+def _parse_index(data):
+    return data if isinstance(data, dict) and isinstance(data.get("shards"), dict) else None
+
+
+# 站点文件读写入口：worktree 后端落盘到工作区并走 MANIFEST_CACHE，plumbing 后端读写 GitObjectStore
+def _store_read_path(store, rel: str) -> str:
+    target = current_target()
+    root = _repo_path(rel)
+    return root if (target.write_to_root and store.exists(root)) else _repo_path(target.public_dir, rel)
+
+
+def site_load(rel: str, parse, default=None):
+    """读取站点 JSON 文件（WRITE_TO_ROOT 且根目录存在时优先根目录）并返回 parse 后的缓存对象。"""
+    if current_target().backend == "plumbing":
+        store = git_store()
+        return store.load(_store_read_path(store, rel), parse, default)
+    return MANIFEST_CACHE.load(_site_read_path(rel), parse, default)
+
+
+def site_write(rel: str, data, value=None, precompress: bool = False) -> list:
+    """
+    写入 public/<rel>（及根目录副本），value 非 None 时登记为该文件的解析结果。返回待提交路径。
+    precompress=True 且开启 PRECOMPRESS 时一并写入 <rel>.gz / <rel>.br。
+    """
+    target = current_target()
+    if target.backend == "plumbing":
+        store = git_store()
+        paths = [_repo_path(target.public_dir, rel)] + ([_repo_path(rel)] if target.write_to_root else [])
+        for path in paths:
+            store.write(path, data, value)
+    else:
+        paths = write_site_file(rel, data)
+        if value is not None:
+            for path in paths:
+                MANIFEST_CACHE.remember(os.path.join(target.repo, path), value)
+    if precompress and PRECOMPRESS:
+        for suffix, blob in compressed_variants(data):
+            paths += site_write(rel + suffix, blob)
+    return paths
+
+
+def site_read_text(rel: str) -> Optional[str]:
+    """读取站点文本文件（与 site_load 同样的根目录优先规则），不存在时返回 None。"""
+    if current_target().backend == "plumbing":
+        store = git_store()
+        data = store.read(_store_read_path(store, rel))
+        return None if data is None else data.decode("utf-8", errors="replace")
+    try:
+        with open(_site_read_path(rel), "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def site_exists(rel: str) -> bool:
+    """public/<rel> 是否已存在（plumbing 后端含未提交的 overlay）。调用方须持有目标的仓库锁。"""
+    target = current_target()
+    if target.backend == "plumbing":
+        return git_store().exists(_repo_path(target.public_dir, rel))
+    return os.path.exists(os.path.join(target.repo, target.public_dir, rel))
+
+
+def site_list(rel_dir: str) -> list:
+    """列出站点目录 rel_dir 下的全部文件（相对 rel_dir，/ 分隔；public/ 与根目录副本合并）。"""
+    target = current_target()
+    bases = [target.public_dir] + ([""] if target.write_to_root else [])
+    found = set()
+    for base in bases:
+        if target.backend == "plumbing":
+            prefix = _repo_path(base, rel_dir) if base else _repo_path(rel_dir)
+            found.update(path[len(prefix) + 1:] for path in git_store().list_files(prefix))
+        else:
+            top = os.path.join(target.repo, base, rel_dir)
+            for dirpath, _, filenames in os.walk(top):
+                for name in filenames:
+                    found.add(os.path.relpath(os.path.join(dirpath, name), top).replace(os.sep, "/"))
+    return sorted(found)
+
+
+def invalidate_site_cache():
+    MANIFEST_CACHE.invalidate()
+    store = current_target().loaded_store()
+    if store is not None:
+        store.invalidate()
+
+
+def load_site_manifest() -> dict:
+    try:
+        return site_load("manifest.json", _parse_manifest, current_target().default_manifest)
+    except Exception as e:
+        invalidate_site_cache()
+        log.warning(f"读取 manifest.json 失败 ({e})，将使用默认模板。")
+        return current_target().default_manifest()
+
+
+_SHARD_FILE_RE = re.compile(r'^([^/]+)/(\d{4}-\d{2})\.json$')
+
+
+def existing_manifest_shards() -> list:
+    """已有的分片文件 [(分类, YYYY-MM)]。"""
+    found = []
+    for rel in site_list(current_target().manifest_dir):
+        m = _SHARD_FILE_RE.match(rel)
+        if m:
+            found.append(m.groups())
+    return found
+
+
+def rebuild_manifest_index(shards) -> dict:
+    """index.json 缺失或损坏但分片仍在时，按分片文件重新统计条目数（站点信息取 manifest.json 或默认模板）。"""
+    meta = load_site_manifest()
+    months = {cat: {} for cat in meta["categories"]}
+    for cat, mk in shards:
+        months.setdefault(cat, {})[mk] = site_load(manifest_shard_rel(cat, mk), _parse_shard, dict)
+    return build_manifest_index({"site": meta["site"], "categories": meta["categories"], "months": months})
+
+
+def update_sharded_manifest(category: str, yyyy: str, mm: str, dd: str, title: str, summary: str) -> list:
+    """
+    只改动受影响的月份分片与 index.json，返回写入的路径。
+    首次运行（尚无任何分片）时从旧版 manifest.json 迁移出全部分片；
+    已有分片而 index.json 缺失/损坏时只按分片重建 index，不用 manifest.json 覆盖分片。
+    """
+    files = []
+    index = site_load(manifest_index_rel(), _parse_index)
+    if index is None:
+        shards = existing_manifest_shards()
+        if shards:
+            index = rebuild_manifest_index(shards)
+            log.warning(f"index.json 缺失或无法解析，已按 {len(shards)} 个现有分片重建。")
+        else:
+            legacy = load_site_manifest()
+            index = build_manifest_index(legacy)
+            for cat, months in legacy["months"].items():
+                for mk, entries in months.items():
+                    files += site_write(manifest_shard_rel(cat, mk), json.dumps(entries, ensure_ascii=False, indent=2),
+                                        _parse_shard(entries), precompress=True)
+            log.info(f"已从 manifest.json 迁移出 {len(files)} 个分片文件。")
+
+    month_key = f"{yyyy}-{mm}"
+    shard_rel = manifest_shard_rel(category, month_key)
+    try:
+        shard = site_load(shard_rel, _parse_shard, dict)
+        entry = make_manifest_entry(category, yyyy, mm, dd, title, summary)
+        shard.pop(entry["date"], None)
+        shard[entry["date"]] = entry
+        shards = index["shards"].setdefault(category, {})
+        if month_key not in shards:
+            shards[month_key] = 0
+            index["shards"][category] = dict(sorted(shards.items(), reverse=True))
+        index["shards"][category][month_key] = len(shard)
+
+        files += site_write(shard_rel, _dump_shard(shard), shard, precompress=True)
+        files += site_write(manifest_index_rel(), json.dumps(index, ensure_ascii=False, indent=2), index, precompress=True)
+    except Exception:
+        # 内存中的对象可能已被改动但未完整落盘，丢弃缓存，下次从磁盘重建
+        invalidate_site_cache()
+        raise
+    return files
+
+
+# ===== 全文检索索引：search/<分类>/<YYYY-MM>.json =====
+# 分片格式：{"v": 1, "docs": [{"d": 日期, "t": 标题, "u": 路径}, ...],
+#            "groups": [{"p": [日号差分], "t": "词 词 词"}, ...]}
+# 文档以“几号”为编号（月内稳定，增删一篇不必重新编号）；倒排表相同的词合并为一组，按空格拼接，
+# 大量只出现在一篇里的 CJK 二元组因此只占“词本身 + 1 字节”。
+# 词表由 search_tokens 生成；前端 ElegantDaily.tsx 用同样的规则切分查询词，只拉当前分类的分片求交集
+_SEARCH_TOKEN_RE = re.compile(r'[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+_SEARCH_URL_RE = re.compile(r'https?://\S+')
+_SEARCH_MAX_WORD = 32  # 更长的 ASCII 串多为哈希/链接残片，不入索引
+
+
+def search_tokens(text: str) -> set:
+    """NFKC + 小写后切词：连续 ASCII 字母数字为一个词（单字母除外）；中日韩连续字符切成二元组，孤立单字成词。"""
+    text = _SUM_IMAGE_RE.sub(' ', text)
+    text = _SUM_LINK_RE.sub(r'\1', text)
+    text = _SEARCH_URL_RE.sub(' ', text)
+    tokens = set()
+    for run in _SEARCH_TOKEN_RE.findall(unicodedata.normalize("NFKC", text).lower()):
+        if run[0] < "\u0080":
+            if 1 < len(run) <= _SEARCH_MAX_WORD:
+                tokens.add(run)
+        elif len(run) == 1:
+            tokens.add(run)
+        else:
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def search_shard_rel(category: str, month_key: str) -> str:
+    return os.path.join(SEARCH_DIR, category, f"{month_key}.json")
+
+
+def _empty_search_shard() -> dict:
+    return {"docs": {}, "postings": {}}
+
+
+def _parse_search_shard(data) -> dict:
+    # 内存中：日期 -> 文档、词 -> 日号位图（bit d 表示 d 号），增删一篇只需改位
+    shard = _empty_search_shard()
+    if not isinstance(data, dict):
+        return shard
+    for doc in data.get("docs") or []:
+        if isinstance(doc, dict) and doc.get("d"):
+            shard["docs"][doc["d"]] = doc
+    postings = shard["postings"]
+    for group in data.get("groups") or []:
+        mask = day = 0
+        for delta in group.get("p") or []:
+            day += delta
+            mask |= 1 << day
+        for term in (group.get("t") or "").split():
+            postings[term] = mask
+    return shard
+
+
+def _dump_search_shard(shard: dict) -> str:
+    groups = {}
+    for term, mask in shard["postings"].items():
+        groups.setdefault(mask, []).append(term)
+    out = []
+    for mask in sorted(groups):
+        days = [d for d in range(1, 32) if mask >> d & 1]
+        out.append({"p": [b - a for a, b in zip([0] + days, days)], "t": " ".join(sorted(groups[mask]))})
+    data = {"v": 1, "docs": [shard["docs"][d] for d in sorted(shard["docs"])], "groups": out}
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _search_doc(category: str, yyyy: str, mm: str, dd: str, title: str) -> dict:
+    return {"d": f"{yyyy}-{mm}-{dd}", "t": title, "u": f"{category}/{yyyy}/{mm}/{dd}.md"}
+
+
+def _add_search_doc(shard: dict, doc: dict, tokens):
+    shard["docs"][doc["d"]] = doc
+    bit = 1 << int(doc["d"][-2:])
+    postings = shard["postings"]
+    for term in tokens:
+        postings[term] = postings.get(term, 0) | bit
+
+
+def update_search_shard(category: str, yyyy: str, mm: str, dd: str, title: str, content: str) -> list:
+    """只重建本篇在所属月份分片中的倒排项，返回写入的路径。"""
+    rel = search_shard_rel(category, f"{yyyy}-{mm}")
+    shard = site_load(rel, _parse_search_shard, _empty_search_shard)
+    doc = _search_doc(category, yyyy, mm, dd, title)
+    try:
+        postings = shard["postings"]
+        bit = 1 << int(dd)
+        for term in [t for t, mask in postings.items() if mask & bit]:
+            if postings[term] == bit:
+                del postings[term]
+            else:
+                postings[term] &= ~bit
+        _add_search_doc(shard, doc, search_tokens(title + "\n" + content))
+        return site_write(rel, _dump_search_shard(shard), shard, precompress=True)
+    except Exception:
+        invalidate_site_cache()
+        raise
+
+
+# ===== 预渲染正文：<分类>/<YYYY>/<MM>/<DD>.html =====
+# 与 ElegantDaily.tsx 桌面端详情同一套预处理（stripFirstHeading / stripLeadingTocAndIntro / stripFrontmatter /
+# normalizeMarkdown / parseMetaAndToc）后交给 python-markdown 渲染，mdComponents 的样式类与 H2 锚点、分类/来源标签一并输出；
+# 代码块由 pygments 切词、按 highlight.js 的类名输出，沿用 public/hljs/*.css 主题。
+# 首行注释记录渲染版本与源 .md 的 SHA-256：源文未变则不重新渲染，前端也据此判断片段是否仍对应当前 .md
+# 片段末尾附带移动端分节卡片数据（<script type="application/json" data-mobile-cards>），
+# 与 MobileNewsSectionList 的 splitByH2 / parseSectionMeta / parseSectionBody 同一套规则，移动端据此直接出卡片
+HTML_RENDER_VERSION = 2  # 渲染规则变化时递增，已有片段在下次发布 / render-html 时重新生成
+_HTML_HEADER_RE = re.compile(r'^<!-- dify-html v(\d+) sha256=([0-9a-f]{64}) -->\n')
+_MD_EXTENSIONS = ["tables", "fenced_code", "nl2br", "sane_lists"]  # remark-gfm 表格 + remark-breaks 换行
+
+# 与 mdComponents 中的 className 保持一致
+_HTML_CLASSES = {
+    "a": "underline decoration-teal-400/60 underline-offset-4 hover:text-teal-600 dark:hover:text-teal-300",
+    "blockquote": "my-4 rounded-lg border-l-2 border-sky-400/30 bg-white/40 px-4 py-3 text-slate-700 "
+                  "dark:border-sky-300/30 dark:bg-white/5 dark:text-[#C0C0C0]",
+    "code": "rounded bg-slate-100 px-1.5 py-0.5 text-[92%] text-teal-600 dark:bg-slate-900/70 dark:text-teal-300",
+    "pre": "my-4 overflow-auto rounded-xl bg-slate-100 p-4 text-sm leading-6 shadow-inner dark:bg-slate-900/70",
+}
+
+# pygments token 类型 -> highlight.js 类名，按顺序取第一个匹配（子类型写在父类型前面）
+_HLJS_CLASSES = (
+    ("Keyword.Constant", "literal"), ("Keyword.Type", "type"), ("Keyword", "keyword"),
+    ("Name.Builtin.Pseudo", "variable language_"), ("Name.Builtin", "built_in"),
+    ("Name.Function", "title function_"), ("Name.Class", "title class_"), ("Name.Decorator", "meta"),
+    ("Name.Tag", "name"), ("Name.Attribute", "attr"), ("Name.Label", "symbol"),
+    ("Name.Variable", "variable"), ("Name.Constant", "variable constant_"),
+    ("Literal.String.Regex", "regexp"), ("Literal.String.Escape", "char escape_"),
+    ("Literal.String.Doc", "comment"), ("Literal.String", "string"), ("Literal.Number", "number"),
+    ("Comment.Preproc", "meta"), ("Comment", "comment"), ("Operator.Word", "keyword"),
+    ("Generic.Deleted", "deletion"), ("Generic.Inserted", "addition"), ("Generic.Heading", "section"),
+    ("Generic.Subheading", "section"), ("Generic.Emph", "emphasis"), ("Generic.Strong", "strong"),
+)
+_hljs_class_cache = {}
+
+_CODE_BLOCK_RE = re.compile(r'<pre><code(?: class="language-([^"]+)")?>(.*?)</code></pre>', re.S)
+_BLOCKQUOTE_RE = re.compile(r'<blockquote>(.*?)</blockquote>', re.S)
+_HEADING_RE = re.compile(r'<h([23])>(.*?)</h\1>', re.S)
+_URL_ATTR_RE = re.compile(r'<(a|img)\b([^>]*?) (href|src)="([^"]*)"')
+_TAG_RE = re.compile(r'<[^>]+>')
+_SAFE_URL_SCHEMES = ("http", "https", "mailto", "irc", "ircs", "xmpp")  # react-markdown defaultUrlTransform 白名单
+_CAT_META_RES = [re.compile(p) for p in (r'>\s*\*\*\s*分类\s*[：:]\s*\*\*\s*([^\n\r]+)',
+                                         r'>\s*\*\*\s*分类\s*\*\*\s*[：:]\s*([^\n\r]+)',
+                                         r'>\s*分类\s*[：:]\s*([^\n\r]+)')]
+_SRC_META_RES = [re.compile(p) for p in (r'>\s*\*\*\s*来源\s*[：:]\s*\*\*\s*([^\n\r]+)',
+                                         r'>\s*\*\*\s*来源\s*\*\*\s*[：:]\s*([^\n\r]+)',
+                                         r'>\s*来源\s*[：:]\s*([^\n\r]+)')]
+_MD_LINK_RE = re.compile(r'\[([^\]]+)\]\(([^)]+)\)')
+_H2_LINE_RE = re.compile(r'##\s+([^\n\r\u2028\u2029]+)$')  # JS 的 . 不匹配 \r / \u2028 / \u2029
+_JS_TRIM_RE = re.compile(r'^[\s\ufeff]+|[\s\ufeff]+$')
+_META_SEP_RE = re.compile(r'^[：:，、\-|\s]+')
+_INSIGHT_SEP_RE = re.compile(r'^[\s*:_：\ufffd，、\-|]+')
+_BULLET_RE = re.compile(r'^(-|\*|\+|[0-9]+[.)])\s+')
+
+
+def html_rel_for(md_rel: str) -> str:
+    return md_rel[:-3] + ".html"
+
+
+def html_header(digest: str) -> str:
+    return f"<!-- dify-html v{HTML_RENDER_VERSION} sha256={digest} -->\n"
+
+
+def _hljs_class(ttype) -> str:
+    cls = _hljs_class_cache.get(ttype)
+    if cls is None:
+        cls = next((c for name, c in _HLJS_CLASSES if ttype in _tokentype(name)), "")
+        _hljs_class_cache[ttype] = cls
+    return cls
+
+
+def highlight_code_html(code: str, language: Optional[str]) -> str:
+    """按 highlight.js 的类名输出高亮后的 HTML；未安装 pygments、未标语言或语言不认识时只做转义。"""
+    if not language or _get_lexer_by_name is None:
+        return html.escape(code, quote=False)
+    try:
+        lexer = _get_lexer_by_name(language, stripnl=False, ensurenl=False)
+    except _ClassNotFound:
+        return html.escape(code, quote=False)
+    runs = []  # 相邻同类 token 合并为一个 span
+    for ttype, value in lexer.get_tokens(code):
+        cls = _hljs_class(ttype)
+        if runs and runs[-1][0] == cls:
+            runs[-1][1].append(value)
+        else:
+            runs.append((cls, [value]))
+    out = []
+    for cls, values in runs:
+        text = html.escape("".join(values), quote=False)
+        out.append(f'<span class="hljs-{cls}">{text}</span>' if cls else text)
+    return "".join(out)
+
+
+def _slugify(text: str) -> str:
+    s = text.strip().lower()
+    s = re.sub(r'[^a-z0-9\-\u4e00-\u9fa5]+', '-', re.sub(r'\s+', '-', s).replace('.', '-'))
+    return "h2-" + urllib.parse.quote(s, safe="-_.!~*'()")
+
+
+def _strip_leading_toc(md: str) -> str:
+    # H1 与首个 H2 之间若有 3 行以上带《》/【】的链接，视为人工目录，整段去掉
+    lines = md.split("\n")
+    first_h2 = next((i for i, line in enumerate(lines) if re.match(r'##\s+', line)), -1)
+    if first_h2 > 5:
+        links = sum(1 for line in lines[1:first_h2] if "](" in line and ("《" in line or "【" in line))
+        if links >= 3:
+            return "\n".join(lines[first_h2:])
+    return md
+
+
+def _normalize_for_render(md: str) -> str:
+    md = md.replace("\ufeff", "").replace("\r\n", "\n")
+    md = re.sub(r'(^>.*\n)(?!>|\n)', r'\1\n', md, flags=re.M)
+    md = re.sub(r'([^\n>])\n(- |\* |\d+[.)、] )', r'\1\n\n\2', md)
+    md = re.sub(r'^\*\*核心洞察：\*\*\s*', '## 核心洞察\n\n', md, flags=re.M)
+    return re.sub(r'^\*\*内容简介：\*\*\s*', '## 内容简介\n\n', md, flags=re.M)
+
+
+def _prepare_render_markdown(md: str, title: str) -> str:
+    md = re.sub(r'^#\s*' + re.escape(title) + r'\s*\n', '', md, count=1)
+    md = _strip_leading_toc(md)
+    md = _normalize_for_render(re.sub(r'^---[\s\S]*?---\n?', '', md, count=1))
+    for label in ("分类", "来源"):
+        m = re.search(rf'^>\s*\*\*{label}：\*\*\s*([^\n]+)$', md, re.M)
+        if m:
+            md = md.replace(m.group(0) + "\n", "", 1)
+    return md
+
+
+def _h2_meta_html(raw_md: str, text: str) -> str:
+    # 对应 mdComponents.h2 的 extractMetaForH2：在原文中找到该节，渲染分类 / 来源标签
+    start = raw_md.find(f"## {text}")
+    if start < 0:
+        return ""
+    end = raw_md.find("\n## ", start + len(text) + 3)
+    section = raw_md[start:end if end >= 0 else len(raw_md)]
+    chips = []
+    cat = next((m for m in (r.search(section) for r in _CAT_META_RES) if m), None)
+    if cat:
+        chips.append(f'<span class="chip chip--meta">{html.escape(cat.group(1).strip())}</span>')
+    src = next((m for m in (r.search(section) for r in _SRC_META_RES) if m), None)
+    if src:
+        for label, href in _MD_LINK_RE.findall(src.group(1).strip()):
+            chips.append(f'<a href="{html.escape(_safe_url(href))}" target="_blank" rel="noreferrer" '
+                         f'class="chip chip--link">{html.escape(label)}</a>')
+    return f'<div class="mb-4 flex flex-wrap items-center gap-2">{"".join(chips)}</div>' if chips else ""
+
+
+def _safe_url(url: str) -> str:
+    scheme = re.match(r'\s*([a-zA-Z][a-zA-Z0-9+.\-]*):', url)
+    if scheme and scheme.group(1).lower() not in _SAFE_URL_SCHEMES:
+        return ""
+    return url
+
+
+def _markdown_renderer():
+    md = _markdown.Markdown(extensions=_MD_EXTENSIONS, output_format="html")
+    # 与 react-markdown 默认行为一致：正文中的原始 HTML 不进入页面，按文本显示
+    md.preprocessors.deregister("html_block")
+    md.inlinePatterns.deregister("html")
+    return md
+
+
+def render_report_html(content: str, title: str) -> str:
+    """把日报 Markdown 渲染为可直接插入详情页 <article> 的 HTML 片段（不含首行缓存注释），末尾附移动端卡片数据。"""
+    body = _markdown_renderer().convert(_prepare_render_markdown(content, title))
+
+    def code_block(m):
+        language = html.unescape(m.group(1)) if m.group(1) else None
+        code = html.unescape(m.group(2))
+        code = code[:-1] if code.endswith("\n") else code
+        lang_cls = f" language-{html.escape(language)}" if language else ""
+        return (f'<pre class="{_HTML_CLASSES["pre"]}"><code class="hljs{lang_cls}">'
+                f'{highlight_code_html(code, language)}</code></pre>')
+
+    def blockquote(m):
+        text = html.unescape(_TAG_RE.sub("", m.group(1)))
+        if "分类：" in text or "来源：" in text:
+            return ""  # 分类/来源引用块改由 H2 下方的标签展示
+        return f'<blockquote class="{_HTML_CLASSES["blockquote"]}">{m.group(1)}</blockquote>'
+
+    def heading(m):
+        level, inner = m.group(1), m.group(2)
+        text = html.unescape(_TAG_RE.sub("", inner))
+        tag = f'<h{level} id="{html.escape(_slugify(text))}">{inner}</h{level}>'
+        return f'<div>{tag}{_h2_meta_html(content, text)}</div>' if level == "2" else tag
+
+    def url_attr(m):
+        tag, attrs, name, url = m.groups()
+        if tag == "a":
+            attrs = f' target="_blank" rel="noreferrer" class="{_HTML_CLASSES["a"]}"' + attrs
+        return f'<{tag}{attrs} {name}="{html.escape(_safe_url(html.unescape(url)))}"'
+
+    body = _CODE_BLOCK_RE.sub(code_block, body)
+    body = body.replace("<code>", f'<code class="{_HTML_CLASSES["code"]}">')
+    body = _BLOCKQUOTE_RE.sub(blockquote, body)
+    body = _URL_ATTR_RE.sub(url_attr, body)
+    body = _HEADING_RE.sub(heading, body)  # 最后处理：H2 下方的来源标签自带链接属性
+    return body.strip() + "\n" + _mobile_cards_script(content)
+
+
+def _js_trim(text: str) -> str:
+    return _JS_TRIM_RE.sub("", text)
+
+
+def _strip_md_inline(text: str) -> str:
+    # 对应 stripMdInline
+    text = re.sub(r'`([^`]+)`', r'\1', text)
+    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)
+    text = re.sub(r'\*([^*]+)\*', r'\1', text)
+    text = re.sub(r'!\[[^\]]*\]\([^)]*\)', '', text)
+    text = _MD_LINK_RE.sub(r'\1', text)
+    text = re.sub(r'[#>]', '', text)
+    return _js_trim(re.sub(r'[\s\ufeff]+', ' ', text))
+
+
+def _md_links(text: str) -> list:
+    return [{"label": label, "href": href} for label, href in _MD_LINK_RE.findall(text)]
+
+
+def _section_meta(section_md: str) -> dict:
+    # 对应 parseSectionMeta：只看前 12 行中以 '>' 开头的引文行
+    category = src_text = None
+    for raw in section_md.split("\n")[:12]:
+        t = _js_trim(raw)
+        if not t.startswith(">"):
+            continue
+        line = _js_trim(re.sub(r'^>[\s\ufeff]*', '', t).replace("**", ""))
+        if "分类" in line and category is None:
+            category = _js_trim(_META_SEP_RE.sub("", line[line.index("分类") + 2:])) or None
+        if "来源" in line and src_text is None:
+            src_text = _js_trim(_META_SEP_RE.sub("", line[line.index("来源") + 2:])) or None
+    sources = []
+    if src_text:
+        sources = _md_links(src_text) or [{"label": label, "href": "#"}
+                                          for label in re.split(r'[，、,\s\ufeff]+', src_text) if label]
+    return {"category": category, "sources": sources}
+
+
+def _section_body(body: str) -> dict:
+    # 对应 parseSectionBody：核心洞察 + 内容简介列表（没有“内容简介”时取整节的列表项）
+    lines = body.split("\n")
+    insight = None
+    bullets = []
+    in_summary = False
+    for i, raw in enumerate(lines):
+        t = _js_trim(raw)
+        if not t or t.startswith(">"):
+            continue
+        if not insight and "核心洞察" in t:
+            seg = _INSIGHT_SEP_RE.sub("", t[t.index("核心洞察") + 4:]).replace("**", "")
+            cut = seg.find("内容简介")
+            if cut >= 0:
+                left = _js_trim(seg[:cut])
+                if left:
+                    insight = _strip_md_inline(left)
+                in_summary = True
+            elif seg:
+                insight = _strip_md_inline(seg)
+            else:
+                buf = []
+                for nxt in lines[i + 1:]:
+                    nxt = _js_trim(nxt)
+                    if not nxt or "内容简介" in nxt or "核心洞察" in nxt or nxt.startswith(">"):
+                        break
+                    buf.append(nxt)
+                if buf:
+                    insight = _strip_md_inline(" ".join(buf))
+            continue
+        if "内容简介" in t:
+            in_summary = True
+            continue
+        if in_summary and _BULLET_RE.match(t):
+            bullets.append(_strip_md_inline(_BULLET_RE.sub("", t, count=1)))
+    if not bullets:
+        bullets = [_strip_md_inline(_BULLET_RE.sub("", t, count=1))
+                   for t in map(_js_trim, lines) if _BULLET_RE.match(t)]
+    return {"insight": insight or None, "bullets": bullets}
+
+
+def mobile_cards(raw_md: str) -> dict:
+    """按 MobileNewsSectionList 的规则把原文拆成移动端卡片：{"sections": [...], "related": [...]}。"""
+    sections = []
+    title, buf = None, []
+    for line in raw_md.split("\n"):
+        m = _H2_LINE_RE.match(line)
+        if m:
+            if title:
+                sections.append((title, _js_trim("\n".join(buf))))
+            title, buf = _js_trim(m.group(1)), []
+        elif title:
+            buf.append(line)
+    if title:
+        sections.append((title, _js_trim("\n".join(buf))))
+    doc_meta = _section_meta("\n".join(raw_md.split("\n")[:30]))
+    related = next((i for i, (t, _) in enumerate(sections) if _js_trim(t).startswith("其他相关资讯")), None)
+    cards = []
+    for i, (t, body) in enumerate(sections):
+        if i == related:
+            continue
+        meta = _section_meta(t + "\\n" + body)  # 与前端一致：标题与正文以字面量 "\n" 相连
+        card = {"title": t, "category": meta["category"] or doc_meta["category"],
+                "sources": meta["sources"] or doc_meta["sources"]}
+        card.update(_section_body(body))
+        cards.append({k: v for k, v in card.items() if v is not None})
+    return {"sections": cards, "related": _md_links(sections[related][1]) if related is not None else []}
+
+
+def _mobile_cards_script(raw_md: str) -> str:
+    # "<" 一律转义，数据里的 </script> / <!-- 不会提前结束脚本块
+    data = json.dumps(mobile_cards(raw_md), ensure_ascii=False, separators=(",", ":")).replace("<", "\\u003c")
+    return f'<script type="application/json" data-mobile-cards>{data}</script>\n'
+
+
+def update_report_html(md_rel: str, content: str, title: str, digest: str) -> list:
+    """在 DD.md 旁写入 DD.html（及预压缩副本）。已有片段的首行哈希与源文一致时跳过渲染，返回写入的路径。"""
+    rel = html_rel_for(md_rel)
+    header = html_header(digest)
+    existing = site_read_text(rel)
+    if existing is not None and existing.startswith(header):
+        log.info(f"预渲染正文未变化，跳过：{rel}")
+        return []
+    return site_write(rel, header + render_report_html(content, title), precompress=True)
+
+
+# ===== 订阅源：feed.json / feed.xml / atom.xml =====
+# 每个分类一份（<分类>/feed.*），另有全站合并的一份（根目录 feed.*）。feed.json（JSON Feed 1.1）是唯一数据源：
+# 发布时读出、按 id 插入或替换当天条目、按日期倒序截取最近 FEED_MAX_ITEMS 条，RSS 2.0 与 Atom 由它派生。
+# 条目的 date_modified 只在内容哈希变化时更新，订阅源的 lastBuildDate / <updated> 取各条目 date_modified 的最大值：
+# 内容不变时文件逐字节不变，静态托管给出的 ETag / Last-Modified 也不变，条件请求直接 304
+FEED_NAMES = ("feed.json", "feed.xml", "atom.xml")
+_XML_INVALID_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def feed_rel(category: Optional[str], name: str) -> str:
+    return os.path.join(category, name) if category else name
+
+
+def _parse_feed(data) -> list:
+    items = data.get("items") if isinstance(data, dict) else None
+    return [it for it in items or [] if isinstance(it, dict) and it.get("id")]
+
+
+def _feed_site() -> Tuple[dict, dict]:
+    index = site_load(manifest_index_rel(), _parse_index) or {}
+    target = current_target()
+    return index.get("site") or target.site, index.get("categories") or target.categories
+
+
+def make_feed_item(category: str, date_str: str, title: str, summary: str, digest: str, label: str,
+                   modified: Optional[str] = None) -> dict:
+    """JSON Feed 条目；modified 为空时取报告日期（重建归档时条目时间可复现）。"""
+    yyyy, mm, dd = date_str.split("-")
+    published = f"{date_str}T00:00:00+08:00"
+    return {
+        "id": f"{category}/{date_str}",
+        "url": f"{current_target().site_url.rstrip('/')}/?cat={category}&date={date_str}",
+        "title": title,
+        "summary": summary,
+        "content_text": summary or title,
+        "date_published": published,
+        "date_modified": modified or published,
+        "tags": [label],
+        "_dify": {"category": category, "path": f"{category}/{yyyy}/{mm}/{dd}.md", "sha256": digest},
+    }
+
+
+def merge_feed_items(old_items: list, new_items: list, replace: bool = False) -> list:
+    """
+    按 id 插入/替换条目，按日期倒序截取最近 FEED_MAX_ITEMS 条。
+    内容哈希未变的条目沿用原 date_modified；replace=True 时不保留 new_items 以外的旧条目（重建用）。
+    """
+    previous = {it["id"]: it for it in old_items}
+    merged = {} if replace else dict(previous)
+    for item in new_items:
+        old = previous.get(item["id"])
+        if old is not None and (old.get("_dify") or {}).get("sha256") == item["_dify"]["sha256"]:
+            item = dict(item, date_modified=old.get("date_modified") or item["date_modified"])
+        merged[item["id"]] = item
+    ordered = sorted(merged.values(), key=lambda it: (it.get("date_published", ""), it["id"]), reverse=True)
+    return ordered[:FEED_MAX_ITEMS]
+
+
+def _rfc822(iso: str) -> str:
+    return email.utils.format_datetime(datetime.fromisoformat(iso))
+
+
+def _xml_text(value) -> str:
+    return xml_escape(_XML_INVALID_RE.sub("", str(value or "")))
+
+
+def render_feeds(category: Optional[str], items: list, site: dict, categories: dict) -> dict:
+    """由条目列表生成 {文件名: 内容}：feed.json 原样保存条目，feed.xml / atom.xml 从中派生。"""
+    base = current_target().site_url.rstrip("/")
+    title = site.get("title") or current_target().site["title"]
+    if category:
+        title = f"{title} · {categories.get(category, category)}"
+    description = site.get("description") or ""
+    home = f"{base}/?cat={category}" if category else f"{base}/"
+    feed_base = f"{base}/{category}/" if category else f"{base}/"
+    updated = max((it.get("date_modified") or it["date_published"] for it in items),
+                  default="1970-01-01T00:00:00+00:00", key=lambda v: datetime.fromisoformat(v))
+
+    feed_json = {
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": title,
+        "home_page_url": home,
+        "feed_url": feed_base + "feed.json",
+        "description": description,
+        "language": "zh-CN",
+        "items": items,
+    }
+
+    rss = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">',
+        "<channel>",
+        f"  <title>{_xml_text(title)}</title>",
+        f"  <link>{_xml_text(home)}</link>",
+        f"  <description>{_xml_text(description)}</description>",
+        "  <language>zh-CN</language>",
+        f"  <lastBuildDate>{_rfc822(updated)}</lastBuildDate>",
+        f'  <atom:link href={xml_quoteattr(feed_base + "feed.xml")} rel="self" type="application/rss+xml"/>',
+    ]
+    for it in items:
+        rss += [
+            "  <item>",
+            f"    <title>{_xml_text(it.get('title'))}</title>",
+            f"    <link>{_xml_text(it.get('url'))}</link>",
+            f'    <guid isPermaLink="false">{_xml_text(it["id"])}</guid>',
+            f"    <pubDate>{_rfc822(it['date_published'])}</pubDate>",
+            f"    <description>{_xml_text(it.get('summary'))}</description>",
+            *(f"    <category>{_xml_text(tag)}</category>" for tag in it.get("tags") or []),
+            "  </item>",
+        ]
+    rss += ["</channel>", "</rss>", ""]
+
+    atom = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<feed xmlns="http://www.w3.org/2005/Atom" xml:lang="zh-CN">',
+        f"  <title>{_xml_text(title)}</title>",
+        f"  <subtitle>{_xml_text(description)}</subtitle>",
+        f"  <id>{_xml_text(home)}</id>",
+        f"  <link href={xml_quoteattr(home)}/>",
+        f'  <link rel="self" type="application/atom+xml" href={xml_quoteattr(feed_base + "atom.xml")}/>',
+        f"  <updated>{updated}</updated>",
+        f"  <author><name>{_xml_text(title)}</name></author>",
+    ]
+    for it in items:
+        atom += [
+            "  <entry>",
+            f"    <title>{_xml_text(it.get('title'))}</title>",
+            f"    <id>{_xml_text(it.get('url'))}</id>",
+            f"    <link href={xml_quoteattr(it.get('url') or '')}/>",
+            f"    <published>{it['date_published']}</published>",
+            f"    <updated>{it.get('date_modified') or it['date_published']}</updated>",
+            f"    <summary>{_xml_text(it.get('summary'))}</summary>",
+            *(f"    <category term={xml_quoteattr(_XML_INVALID_RE.sub('', str(tag)))}/>" for tag in it.get("tags") or []),
+            "  </entry>",
+        ]
+    atom += ["</feed>", ""]
+
+    return {
+        "feed.json": json.dumps(feed_json, ensure_ascii=False, indent=2),
+        "feed.xml": "\n".join(rss),
+        "atom.xml": "\n".join(atom),
+    }
+
+
+def write_feeds(category: Optional[str], items: list, site: dict, categories: dict) -> list:
+    files = []
+    for name, data in render_feeds(category, items, site, categories).items():
+        files += site_write(feed_rel(category, name), data, items if name == "feed.json" else None, precompress=True)
+    return files
+
+
+def update_feeds(category: str, date_str: str, title: str, summary: str, digest: str) -> list:
+    """把当天条目并入该分类与全站合并的订阅源，条目无变化时不写文件。返回写入的路径。"""
+    site, categories = _feed_site()
+    modified = datetime.now(CN_TZ).isoformat(timespec="seconds")
+    item = make_feed_item(category, date_str, title, summary, digest, categories.get(category, category), modified)
+    files = []
+    try:
+        for cat in (category, None):
+            items = site_load(feed_rel(cat, "feed.json"), _parse_feed, list)
+            merged = merge_feed_items(items, [item])
+            if merged != items:
+                files += write_feeds(cat, merged, site, categories)
+    except Exception:
+        invalidate_site_cache()
+        raise
+    return files
+
+
+# ===== 图片资源：assets/<sha256>.<ext>（内容寻址，跨报告去重） =====
+_MD_IMAGE_RE = re.compile(r'!\[(?P<alt>[^\]\n]*)\]\(\s*(?:<(?P<src_a>[^>\n]+)>|(?P<src>[^)\s]+))(?P<title>\s+"[^"\n]*")?\s*\)')
+_HTML_IMG_RE = re.compile(r'(<img\b[^>]*?\ssrc=)(["\'])(?P<src>[^"\'>]+)\2', re.IGNORECASE)
+_DATA_URI_RE = re.compile(r'data:image/[a-zA-Z0-9.+\-]+;base64,(?P<b64>[A-Za-z0-9+/=\s]+)')
+_URL_SCHEME_RE = re.compile(r'[a-zA-Z][a-zA-Z0-9+.\-]+:')  # 至少两个字符，C:\ 这类盘符不算 scheme
+_IMAGE_MAGIC = ((b"\x89PNG\r\n\x1a\n", "png"), (b"\xff\xd8\xff", "jpg"), (b"GIF87a", "gif"), (b"GIF89a", "gif"))
+
+
+class ImageAsset:
+    """正文中的一张图片：原图字节、内容寻址文件名，以及要另存的 WebP 版本 [(文件名后缀, 宽度或 None)]。"""
+
+    __slots__ = ("sha", "ext", "data", "plan")
+
+    def __init__(self, sha: str, ext: str, data: bytes, plan: list):
+        self.sha = sha
+        self.ext = ext
+        self.data = data
+        self.plan = plan
+
+    @property
+    def name(self) -> str:
+        return f"{self.sha}.{self.ext}"
+
+    @property
+    def display(self) -> str:
+        # 正文中引用的版本：最大的一档缩略图，其次整图 WebP，都没有时为原图
+        return f"{self.sha}.{self.plan[-1][0]}" if self.plan else self.name
+
+
+def asset_rel(name: str) -> str:
+    return os.path.join(ASSETS_DIR, name)
+
+
+def asset_url(name: str) -> str:
+    return f"{current_target().site_url.rstrip('/')}/{ASSETS_DIR}/{name}"
+
+
+def image_type(data: bytes) -> Optional[str]:
+    """按文件头识别位图格式，返回扩展名；不是 png/jpg/gif/webp 时返回 None（SVG 等不提取）。"""
+    for magic, ext in _IMAGE_MAGIC:
+        if data.startswith(magic):
+            return ext
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _load_image_source(src: str) -> Optional[bytes]:
+    """读取图片引用：base64 data URI 直接解码，本地路径只在 IMAGE_LOCAL_DIRS 内查找；其他来源返回 None。"""
+    if src.startswith("data:"):
+        m = _DATA_URI_RE.fullmatch(src)
+        if not m:
+            return None
+        try:
+            return base64.b64decode(re.sub(r'\s+', '', m.group("b64")), validate=True)
+        except ValueError:
+            return None
+    if src.lower().startswith("file:"):
+        src = urllib.request.url2pathname(urllib.parse.urlparse(src).path)
+    elif _URL_SCHEME_RE.match(src):
+        return None
+    else:
+        src = urllib.parse.unquote(src)
+    name = src.replace("\\", "/")
+    for base in IMAGE_LOCAL_DIRS:
+        root = os.path.realpath(base)
+        # 原样拼接（相对路径 / 绝对路径）不命中时按文件名查找，如 .codebuddy/.ignored_image/<md5>.png
+        for candidate in (os.path.join(root, name), os.path.join(root, os.path.basename(name))):
+            path = os.path.realpath(candidate)
+            try:
+                inside = os.path.commonpath([root, path]) == root
+            except ValueError:  # Windows 下不同盘符
+                inside = False
+            if not inside or not os.path.isfile(path):
+                continue
+            if os.path.getsize(path) > IMAGE_MAX_BYTES:
+                log.warning(f"本地图片超过 {IMAGE_MAX_BYTES} 字节，保留原引用：{src}")
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+    return None
+
+
+def _variant_plan(data: bytes, ext: str) -> list:
+    """按原图宽度确定要另存的 WebP 版本；未装 Pillow、动图或无法解析时为空（只存原图）。"""
+    if _PILImage is None:
+        return []
+    try:
+        with _PILImage.open(io.BytesIO(data)) as im:
+            if getattr(im, "is_animated", False):
+                return []
+            width = im.width
+    except Exception:
+        return []
+    plan = [] if ext == "webp" else [("webp", None)]
+    return plan + [(f"w{w}.webp", w) for w in sorted(set(IMAGE_WIDTHS)) if w < width]
+
+
+def _render_variants(data: bytes, plan: list) -> list:
+    """线程池 worker：按 plan 生成 WebP，返回 [(文件名后缀, bytes)]。"""
+    out = []
+    with _PILImage.open(io.BytesIO(data)) as im:
+        im.load()
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if ("A" in im.getbands() or "transparency" in im.info) else "RGB")
+        for suffix, width in plan:
+            img = im if width is None else im.resize((width, max(1, round(im.height * width / im.width))),
+                                                     _PILImage.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, "WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+            out.append((suffix, buf.getvalue()))
+    return out
+
+
+_IMAGE_POOL = None
+_IMAGE_POOL_LOCK = threading.Lock()
+
+
+def image_pool() -> ThreadPoolExecutor:
+    global _IMAGE_POOL
+    with _IMAGE_POOL_LOCK:
+        if _IMAGE_POOL is None:
+            _IMAGE_POOL = ThreadPoolExecutor(max_workers=max(1, IMAGE_WORKERS), thread_name_prefix="image")
+        return _IMAGE_POOL
+
+
+def extract_images(content: str) -> Tuple[str, list]:
+    """
+    把正文中的内嵌图片（Markdown ![..](..) 与 <img src>）改为引用 assets/ 下的内容寻址文件，
+    返回 (改写后的正文, [ImageAsset])。只读不写，同一输入得到同一输出，改写结果可直接参与内容哈希比较。
+    有缩略图时正文显示缩略图并链接原图；无法识别或读取的引用（含远程 URL）保持原样。
+    """
+    if "![" not in content and "<img" not in content.lower():
+        return content, []
+    assets = {}
+
+    def resolve(src: str) -> Optional[ImageAsset]:
+        data = _load_image_source(src.strip())
+        if data is None or len(data) > IMAGE_MAX_BYTES:
+            return None
+        ext = image_type(data)
+        if ext is None:
+            return None
+        sha = hashlib.sha256(data).hexdigest()
+        if sha not in assets:
+            assets[sha] = ImageAsset(sha, ext, data, _variant_plan(data, ext))
+        return assets[sha]
+
+    def md_image(m) -> str:
+        asset = resolve(m.group("src_a") or m.group("src"))
+        if asset is None:
+            return m.group(0)
+        image = f"![{m.group('alt')}]({asset_url(asset.display)}{m.group('title') or ''})"
+        # 已经包在链接里的图片（[![..](..)](..)）不再套一层
+        if asset.display == asset.name or content[m.start() - 1:m.start()] == "[":
+            return image
+        return f"[{image}]({asset_url(asset.name)})"
+
+    def html_image(m) -> str:
+        asset = resolve(html.unescape(m.group("src")))
+        if asset is None:
+            return m.group(0)
+        return f"{m.group(1)}{m.group(2)}{asset_url(asset.display)}{m.group(2)}"
+
+    content = _MD_IMAGE_RE.sub(md_image, content)
+    content = _HTML_IMG_RE.sub(html_image, content)
+    return content, list(assets.values())
+
+
+def store_image_assets(assets) -> list:
+    """
+    把尚未入库的原图与 WebP 版本写入 assets/，返回待提交路径。
+    已存在的文件不重写、不进入提交；缺少的 WebP 版本（如后来才装 Pillow）在线程池中补生成。调用方须持有目标的仓库锁。
+    """
+    files, pending = [], []
+    for asset in assets:
+        if site_exists(asset_rel(asset.name)):
+            log.info(f"图片已入库，跳过：{asset.name}")
+        else:
+            files += site_write(asset_rel(asset.name), asset.data)
+        missing = [(suffix, width) for suffix, width in asset.plan
+                   if not site_exists(asset_rel(f"{asset.sha}.{suffix}"))]
+        if missing:
+            pending.append((asset, image_pool().submit(_render_variants, asset.data, missing)))
+    for asset, future in pending:
+        for suffix, data in future.result():
+            files += site_write(asset_rel(f"{asset.sha}.{suffix}"), data)
+    return files
+
+
 # ===== Git 操作 =====
-def run_git(cmd, cwd, timeout=180):
+_SAFE_DIRS = set()  # 已登记 safe.directory 的仓库，避免每条 git 命令都多起一个子进程
+_SAFE_DIRS_LOCK = threading.Lock()
+
+
+def _ensure_safe_directory(cwd):
+    with _SAFE_DIRS_LOCK:
+        if cwd in _SAFE_DIRS:
+            return
+        _SAFE_DIRS.add(cwd)
     try:
         subprocess.run(["git", "config", "--global", "--add", "safe.directory", cwd], check=False, cwd=cwd)
     except Exception:
         pass
+
+
+def run_git(cmd, cwd, timeout=180):
+    _ensure_safe_directory(cwd)
     env = os.environ.copy()
     env["GIT_TERMINAL_PROMPT"] = "0"
+    command = cmd[1] if len(cmd) > 1 else cmd[0]
+    start = time.perf_counter()
+    status = "error"
     try:
         result = subprocess.run(
             cmd,
@@ -319,8 +1731,10 @@ def run_git(cmd, cwd, timeout=180):
             log.info("Git stdout: " + result.stdout.strip())
         if result.stderr.strip():
             log.info("Git stderr: " + result.stderr.strip())
+        status = "ok"
         return result
     except subprocess.TimeoutExpired as e:
+        status = "timeout"
         raise RuntimeError(f"Git command timed out after {timeout}s: {cmd}") from e
     except subprocess.CalledProcessError as e:
         stdout = (e.stdout or "").strip()
@@ -330,148 +1744,1758 @@ def run_git(cmd, cwd, timeout=180):
         if stderr:
             log.error("Git stderr: " + stderr)
         raise
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe("dify_git_command_seconds", elapsed, command=command)
+        log_event("git", command=command, status=status, seconds=round(elapsed, 6))
 
 
-def git_commit_push(cwd: str, message: str, paths):
+def git_commit_push(cwd: str, message: str, paths, push: bool = True, branch: str = "main"):
+    """提交 paths；push=False 时只提交，推送交给目标的 GitPusher。返回是否产生了新提交。"""
     unique_paths = []
     for path in paths:
         if path and path not in unique_paths:
             unique_paths.append(path)
-    run_git(["git", "add", "--"] + unique_paths, cwd)
+    # 分段 git add，避免批量重建时命令行超出 Windows 长度限制
+    for i in range(0, len(unique_paths), 200):
+        run_git(["git", "add", "--"] + unique_paths[i:i + 200], cwd)
     rs = subprocess.run(["git", "diff", "--cached", "--quiet"], cwd=cwd)
     if rs.returncode == 0:
-        log.info("无文件变更，尝试推送未发布提交。")
-        run_git(["git", "push", "origin", "main"], cwd)
+        if not push:
+            log.info("无文件变更，跳过提交。")
+            return False
+        ahead = run_git(["git", "rev-list", "--count", f"origin/{branch}..HEAD"], cwd).stdout.strip()
+        if ahead in ("", "0"):
+            log.info("无文件变更，且没有未推送的提交，跳过 push。")
+        else:
+            log.info(f"无文件变更，推送 {ahead} 个未发布提交。")
+            run_git(["git", "push", "origin", branch], cwd)
         return False
     run_git(["git", "commit", "-m", message], cwd)
-    run_git(["git", "push", "origin", "main"], cwd)
+    if push:
+        run_git(["git", "push", "origin", branch], cwd)
     return True
 
 
+def git_head(cwd: str) -> str:
+    return run_git(["git", "rev-parse", "HEAD"], cwd).stdout.strip()
+
+
+# ===== Git 对象库直写后端（GIT_BACKEND = "plumbing"） =====
+def _repo_path(*parts) -> str:
+    # 对象库中的路径一律用 /，与 os.sep 无关
+    return "/".join(p.replace(os.sep, "/") for p in parts)
+
+
+def _git_blob_sha(data: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class GitObjectStore:
+    """
+    不经过工作区与 index 的提交后端：
+    - 读：常驻 `git cat-file --batch`，按 <基准提交>:<路径> 取 blob；解析结果按 blob sha 缓存；
+      只判断是否存在时走常驻 `git cat-file --batch-check`，只读对象头、不传输内容
+    - 写：先记入内存 overlay，commit() 时把有变化的文件经常驻 `git fast-import` 写成一个提交，
+      checkpoint 后 refs/heads/main 快进到新提交（不会强制覆盖外部推进的分支）
+    每次发布不再为 add/diff/commit 各起一个 git 进程；工作区（如有）不会随之更新。
+    每个发布目标一个实例（Target.store()），所有方法都要求调用方持有该目标的仓库锁。
+    """
+
+    def __init__(self, repo: str, branch: str = "main"):
+        self.repo = repo
+        self.ref = f"refs/heads/{branch}"
+        self._cat = None
+        self._check = None
+        self._fi = None
+        self._fi_err = None
+        self._ident = None
+        self._base = None    # 当前 overlay 基于的提交；overlay 为空时每次读取都重新解析分支
+        self._pending = {}   # 路径 -> (bytes, 解析结果或 None)
+        self._cache = {}     # 路径 -> (blob sha, 解析结果)
+        self._commits = 0
+
+    def _spawn(self, args, stderr=subprocess.DEVNULL):
+        _ensure_safe_directory(self.repo)
+        env = os.environ.copy()
+        env["GIT_TERMINAL_PROMPT"] = "0"
+        return subprocess.Popen(["git"] + args, cwd=self.repo, env=env,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
+
+    def _cat_file(self, name: str) -> Tuple[Optional[str], Optional[bytes]]:
+        if self._cat is None or self._cat.poll() is not None:
+            self._cat = self._spawn(["cat-file", "--batch"])
+        p = self._cat
+        p.stdin.write(name.encode("utf-8") + b"\n")
+        p.stdin.flush()
+        header = p.stdout.readline()
+        if not header:
+            self._cat = None
+            raise RuntimeError("git cat-file --batch 进程意外退出")
+        parts = header.split()
+        if len(parts) != 3:
+            return None, None  # <name> missing / ambiguous
+        size = int(parts[2])
+        data = p.stdout.read(size)
+        p.stdout.read(1)
+        return parts[0].decode("ascii"), data
+
+    def _check_file(self, name: str) -> Optional[str]:
+        """返回对象 sha，不存在时返回 None。"""
+        if self._check is None or self._check.poll() is not None:
+            self._check = self._spawn(["cat-file", "--batch-check"])
+        p = self._check
+        p.stdin.write(name.encode("utf-8") + b"\n")
+        p.stdin.flush()
+        header = p.stdout.readline()
+        if not header:
+            self._check = None
+            raise RuntimeError("git cat-file --batch-check 进程意外退出")
+        parts = header.split()
+        return parts[0].decode("ascii") if len(parts) == 3 else None
+
+    def _resolve_branch(self) -> Optional[str]:
+        return self._check_file(self.ref)
+
+    def _base_commit(self) -> Optional[str]:
+        if not self._pending:
+            self._base = self._resolve_branch()
+        return self._base
+
+    def _read(self, path: str) -> Tuple[Optional[str], Optional[bytes]]:
+        base = self._base_commit()
+        if base is None:
+            return None, None
+        return self._cat_file(f"{base}:{path}")
+
+    def exists(self, path: str) -> bool:
+        if path in self._pending:
+            return True
+        base = self._base_commit()
+        return base is not None and self._check_file(f"{base}:{path}") is not None
+
+    def load(self, path: str, parse, default=None):
+        """与 ManifestCache.load 语义一致：返回可原地修改的解析结果，改完须 write() 回去。"""
+        if path in self._pending:
+            data, value = self._pending[path]
+            return value if value is not None else parse(json.loads(data.decode("utf-8")))
+        sha, data = self._read(path)
+        if sha is None:
+            return default() if default else None
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == sha:
+            return cached[1]
+        try:
+            obj = json.loads(data.decode("utf-8"))
+        except Exception as e:
+            log.warning(f"读取 {path}@{sha[:8]} 失败 ({e})，按空内容处理。")
+            obj = None
+        value = parse(obj)
+        self._cache[path] = (sha, value)
+        return value
+
+    def list_files(self, prefix: str) -> list:
+        """列出 prefix 目录下的全部文件路径（含未提交的 overlay）。"""
+        prefix = prefix.rstrip("/") + "/"
+        found = {path for path in self._pending if path.startswith(prefix)}
+        base = self._base_commit()
+        if base is not None:
+            out = run_git(["git", "ls-tree", "-r", "--name-only", "-z", base, "--", prefix], self.repo).stdout
+            found.update(path for path in out.split("\0") if path)
+        return sorted(found)
+
+    def read(self, path: str) -> Optional[bytes]:
+        """读取文件原始内容（含未提交的 overlay），不存在时返回 None。"""
+        if path in self._pending:
+            return self._pending[path][0]
+        return self._read(path)[1]
+
+    def write(self, path: str, data, value=None):
+        if "\n" in path:
+            raise ValueError(f"非法路径：{path!r}")
+        self._base_commit()
+        self._pending[path] = (data if isinstance(data, bytes) else data.encode("utf-8"), value)
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def discard(self):
+        """丢弃未提交的 overlay 与缓存（提交失败后调用，避免脏数据进入下一批）。"""
+        self._pending.clear()
+        self._cache.clear()
+        self._base = None
+
+    def _committer(self) -> str:
+        if self._ident is None:
+            ident = run_git(["git", "var", "GIT_COMMITTER_IDENT"], self.repo).stdout.strip()
+            self._ident = ident.rsplit(" ", 2)[0]
+        now = datetime.now().astimezone()
+        return f"{self._ident} {int(now.timestamp())} {now.strftime('%z')}"
+
+    def _fast_import(self):
+        if self._fi is None or self._fi.poll() is not None:
+            self._fi_err = tempfile.TemporaryFile()
+            self._fi = self._spawn(["fast-import", "--quiet"], stderr=self._fi_err)
+        return self._fi
+
+    def _fast_import_error(self) -> str:
+        try:
+            self._fi_err.seek(0)
+            return self._fi_err.read().decode("utf-8", errors="replace").strip()
+        except Exception:
+            return ""
+
+    def commit(self, message: str) -> Tuple[bool, Optional[str]]:
+        """把 overlay 中内容有变化的文件写成一个提交并快进分支。返回 (是否有新提交, 分支当前提交)。"""
+        base = self._base
+        changes = []
+        for path, (data, _) in self._pending.items():
+            # 只比对 blob sha：走 --batch-check，不把旧内容整块读回来
+            old = self._check_file(f"{base}:{path}") if base else None
+            if old != _git_blob_sha(data):
+                changes.append((path, data))
+        if not changes:
+            log.info("无文件变更，跳过提交。")
+            self._settle()
+            return False, base
+        try:
+            msg = message.encode("utf-8")
+            buf = bytearray(f"commit {self.ref}\nmark :1\ncommitter {self._committer()}\ndata {len(msg)}\n".encode("utf-8"))
+            buf += msg + b"\n"
+            if base:
+                buf += f"from {base}\n".encode("ascii")
+            for path, data in changes:
+                buf += f"M 100644 inline {path}\ndata {len(data)}\n".encode("utf-8") + data + b"\n"
+            buf += b"\ncheckpoint\nget-mark :1\n"
+            start = time.perf_counter()
+            fi = self._fast_import()
+            try:
+                fi.stdin.write(buf)
+                fi.stdin.flush()
+                line = fi.stdout.readline()
+            except OSError:
+                line = b""
+            METRICS.observe("dify_git_command_seconds", time.perf_counter() - start, command="fast-import")
+            if not line:
+                self._fi = None
+                raise RuntimeError(f"git fast-import 失败：{self._fast_import_error()}")
+            sha = line.decode("ascii").strip()
+            head = self._resolve_branch()
+            if head != sha:
+                raise RuntimeError(f"{self.ref} 未能快进到 {sha[:8]}（当前 {str(head)[:8]}，分支可能已被外部推进）")
+        except Exception:
+            self.discard()
+            raise
+        log.info(f"对象库直写提交：{sha[:8]}（{len(changes)} 个文件）")
+        self._base = sha
+        self._settle()
+        self._commits += 1
+        if self._commits % 50 == 0:
+            # 每次 checkpoint 都会生成一个小 pack，定期让 git 自行判断是否需要合并
+            run_git(["git", "gc", "--auto", "--quiet"], self.repo)
+        return True, sha
+
+    def _settle(self):
+        # 提交后 overlay 中的解析结果即为新 blob 的缓存
+        for path, (data, value) in self._pending.items():
+            if value is not None:
+                self._cache[path] = (_git_blob_sha(data), value)
+            else:
+                self._cache.pop(path, None)
+        self._pending.clear()
+
+    def close(self):
+        for p in (self._cat, self._check, self._fi):
+            if p is not None and p.poll() is None:
+                try:
+                    p.stdin.close()
+                    p.wait(timeout=10)
+                except Exception:
+                    p.kill()
+        self._cat = self._check = self._fi = None
+
+
+def git_store() -> GitObjectStore:
+    return current_target().store()
+
+
+# ===== 后台推送线程 =====
+_PUSH_REJECTED_RE = re.compile(r'non-fast-forward|fetch first|\[rejected\]|stale info')
+
+
+class PushDeferred(Exception):
+    """仓库正忙（发布批次写入中），本轮推送推迟；连续 PUSH_MAX_DEFERRALS 次以内不计入失败次数。"""
+
+
+class GitPusher:
+    """
+    把本地领先 origin/main 的提交推送出去，与发布流程解耦：
+    - 提交后 notify() 唤醒；推送失败按 PUSH_BACKOFF_BASE 起指数退避重试，直到成功
+    - 被远端拒绝（non-fast-forward）时 fetch 后把本地提交 rebase 到 origin/main 上再推
+      （worktree 后端就地 rebase；plumbing 后端在临时 git worktree 中 rebase 后移动分支）；
+      工作区或 overlay 中有尚未提交的批次时推迟 rebase，rebase 后把任务结果中的提交 sha 改写为新提交
+    - status() 提供领先提交数、最近一次推送耗时与错误，供 GET /push/status 查询
+    每个发布目标一个实例、一个线程，某个站点推送缓慢或失败不影响其他站点。
+    """
+
+    def __init__(self, target: "Target"):
+        self.target = target
+        self.branch = target.branch
+        self.remote_ref = f"refs/remotes/origin/{self.branch}"
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._state = {
+            "ahead": None,
+            "failures": 0,
+            "deferrals": 0,
+            "last_push_at": None,
+            "last_push_seconds": None,
+            "last_pushed": None,
+            "last_error": None,
+            "last_error_at": None,
+            "next_retry_at": None,
+        }
+
+    def notify(self):
+        self._wake.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            return dict(self._state, running=self._thread is not None)
+
+    def _set(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"git-pusher-{self.target.name}", daemon=True)
+            self._thread.start()
+            self.notify()  # 启动时先把上次遗留的未推送提交推出去
+
+    def _run(self):
+        delay = None
+        while True:
+            self._wake.wait(timeout=delay)
+            self._wake.clear()
+            try:
+                self.push_once()
+                delay = None
+                self._set(failures=0, deferrals=0, next_retry_at=None)
+            except Exception as e:
+                with self._lock:
+                    deferrals = self._state["deferrals"] + 1 if isinstance(e, PushDeferred) else 0
+                    self._state["deferrals"] = deferrals
+                if 0 < deferrals <= PUSH_MAX_DEFERRALS:
+                    # 批次提交后会再次 notify()；这里只兜底一个短延迟
+                    delay = PUSH_BACKOFF_BASE
+                    retry_at = datetime.now(CN_TZ) + timedelta(seconds=delay)
+                    self._set(next_retry_at=retry_at.isoformat(timespec="seconds"))
+                    log.info(f"[{self.target.name}] 推送推迟（第 {deferrals} 次）：{e}")
+                    continue
+                with self._lock:
+                    self._state["failures"] += 1
+                    failures = self._state["failures"]
+                delay = min(PUSH_BACKOFF_MAX, PUSH_BACKOFF_BASE * 2 ** (failures - 1))
+                retry_at = datetime.now(CN_TZ) + timedelta(seconds=delay)
+                self._set(last_error=str(e), last_error_at=datetime.now(CN_TZ).isoformat(timespec="seconds"),
+                          next_retry_at=retry_at.isoformat(timespec="seconds"))
+                log.warning(f"[{self.target.name}] 推送失败（第 {failures} 次）：{e}；{delay:g} 秒后重试")
+
+    def _ahead(self, repo: str) -> int:
+        try:
+            out = run_git(["git", "rev-list", "--count", f"{self.remote_ref}..refs/heads/{self.branch}"], repo).stdout
+        except subprocess.CalledProcessError:
+            # 还没有 origin/main 跟踪分支（例如 bare 克隆）：先取一次
+            self._fetch(repo)
+            out = run_git(["git", "rev-list", "--count", f"{self.remote_ref}..refs/heads/{self.branch}"], repo).stdout
+        return int(out.strip() or 0)
+
+    def _fetch(self, repo: str):
+        run_git(["git", "fetch", "origin", f"+refs/heads/{self.branch}:{self.remote_ref}"], repo, timeout=PUSH_TIMEOUT)
+
+    def push_once(self):
+        """推送到远端追平为止；被拒绝时 rebase 一次后重推。失败抛异常，由调用方退避重试。"""
+        repo = self.target.repo
+        for attempt in range(2):
+            ahead = self._ahead(repo)
+            self._set(ahead=ahead)
+            if ahead == 0:
+                return
+            sha = run_git(["git", "rev-parse", f"refs/heads/{self.branch}"], repo).stdout.strip()
+            log.info(f"[{self.target.name}] 后台推送：{ahead} 个提交 → origin/{self.branch}（{sha[:8]}）")
+            start = time.perf_counter()
+            try:
+                run_git(["git", "push", "origin", f"{sha}:refs/heads/{self.branch}"], repo, timeout=PUSH_TIMEOUT)
+            except subprocess.CalledProcessError as e:
+                if attempt or not _PUSH_REJECTED_RE.search(e.stderr or ""):
+                    raise RuntimeError(f"git push 失败：{(e.stderr or '').strip()[-300:]}") from e
+                log.warning("推送被拒绝（远端已有新提交），fetch 后 rebase 重试。")
+                self._fetch(repo)
+                self._rebase(repo)
+                continue
+            elapsed = time.perf_counter() - start
+            run_git(["git", "update-ref", self.remote_ref, sha], repo)
+            self._set(last_push_at=datetime.now(CN_TZ).isoformat(timespec="seconds"),
+                      last_push_seconds=round(elapsed, 3), last_pushed=sha, last_error=None)
+            log.info(f"[{self.target.name}] 推送完成：{sha[:8]}（{elapsed:.2f}s）")
+        self._set(ahead=self._ahead(repo))
+
+    def _rebase(self, repo: str):
+        with self.target.lock:
+            old = run_git(["git", "rev-parse", f"refs/heads/{self.branch}"], repo).stdout.strip()
+            replayed = self._local_commits(repo, old)
+            if self.target.backend == "plumbing":
+                store = self.target.loaded_store()
+                if store is not None and store._pending:
+                    raise PushDeferred("有已暂存未提交的内容，稍后再 rebase")
+                new = self._rebase_detached(repo, old)
+            else:
+                # 只看已跟踪文件：未跟踪的 dify_targets.json、node_modules/、.next/ 等不影响 rebase
+                dirty = run_git(["git", "status", "--porcelain", "--untracked-files=no"], repo).stdout
+                if dirty.strip():
+                    paths = [line[3:] for line in dirty.splitlines()][:5]
+                    raise PushDeferred(f"工作区有未提交的改动（{', '.join(paths)}），稍后再 rebase")
+                try:
+                    run_git(["git", "rebase", self.remote_ref], repo)
+                except subprocess.CalledProcessError as e:
+                    self._abort_rebase(repo)
+                    raise RuntimeError(f"rebase 到 origin/{self.branch} 失败，需要人工处理：{(e.stderr or '').strip()[-300:]}") from e
+                new = run_git(["git", "rev-parse", "HEAD"], repo).stdout.strip()
+            self.target.queue.rewrite_commits(self._rewrite_map(replayed, self._local_commits(repo, new), new))
+
+    def _local_commits(self, repo: str, head: str) -> list:
+        out = run_git(["git", "rev-list", "--reverse", f"{self.remote_ref}..{head}"], repo).stdout
+        return out.split()
+
+    @staticmethod
+    def _rewrite_map(old: list, new: list, head: str) -> dict:
+        # rebase 逐个重放本地提交：数量一致时一一对应；有提交因变空被丢弃时，全部对应到新的分支头（内容都已包含在内）
+        if len(old) == len(new):
+            return dict(zip(old, new))
+        return {sha: head for sha in old}
+
+    def _rebase_detached(self, repo: str, old: str) -> str:
+        # bare 仓库没有工作区：在临时 worktree 里 rebase，成功后再用 compare-and-swap 移动分支
+        tmp = tempfile.mkdtemp(prefix="dify-rebase-")
+        try:
+            run_git(["git", "worktree", "add", "--detach", tmp, old], repo)
+            try:
+                run_git(["git", "rebase", self.remote_ref], tmp)
+            except subprocess.CalledProcessError as e:
+                self._abort_rebase(tmp)
+                raise RuntimeError(f"rebase 到 origin/{self.branch} 失败，需要人工处理：{(e.stderr or '').strip()[-300:]}") from e
+            new = run_git(["git", "rev-parse", "HEAD"], tmp).stdout.strip()
+            run_git(["git", "update-ref", f"refs/heads/{self.branch}", new, old], repo)
+            return new
+        finally:
+            try:
+                run_git(["git", "worktree", "remove", "--force", tmp], repo)
+            except Exception:
+                shutil.rmtree(tmp, ignore_errors=True)
+                run_git(["git", "worktree", "prune"], repo)
+
+    @staticmethod
+    def _abort_rebase(cwd: str):
+        try:
+            run_git(["git", "rebase", "--abort"], cwd)
+        except Exception:
+            pass
+
+
 # ===== 内容校验：过滤测试/无效请求 =====
 MIN_CONTENT_LENGTH = 100  # 正式日报至少 100 字符
 
-def validate_content(content: str) -> Tuple[bool, str]:
-    """校验内容是否为有效日报，返回 (是否有效, 原因)"""
-    stripped = content.strip()
-    if not stripped:
+def validate_content(content: str, meta: Optional[ReportMeta] = None) -> Tuple[bool, str]:
+    """校验内容是否为有效日报，返回 (是否有效, 原因)。已有 analyze_report 结果时传入 meta 避免重复扫描。"""
+    if not content.strip():
         return False, "内容为空"
+    meta = meta or analyze_report(content)
     # 去掉 Markdown 标记后的纯文本长度
-    plain = re.sub(r'[#>*_`~\-\[\]()!]+', '', stripped)
-    plain = re.sub(r'\s+', '', plain)
-    if len(plain) < MIN_CONTENT_LENGTH:
-        return False, f"内容过短（纯文本仅 {len(plain)} 字符，最少需要 {MIN_CONTENT_LENGTH}），疑似测试数据"
+    if meta.plain_length < MIN_CONTENT_LENGTH:
+        return False, f"内容过短（纯文本仅 {meta.plain_length} 字符，最少需要 {MIN_CONTENT_LENGTH}），疑似测试数据"
     # 检查是否包含日报关键特征（至少一个 H2 标题）
-    if not re.search(r'^\s*##\s+', stripped, flags=re.M):
+    if not meta.has_h2:
         return False, "缺少二级标题（## ），不符合日报格式"
     return True, "OK"
 
 
+# ===== 内容哈希索引：重复提交直接短路 =====
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ContentHashIndex:
+    """
+    记录每个 (分类, 日期) 最近一次成功提交的规范化 Markdown 的 SHA-256。
+    Dify 重试/重放相同内容时，在任何磁盘写入与 git 操作之前即可判定为 unchanged。
+    只在 commit 成功后更新；reindex 会按归档现状整体重建。
+    已写入工作区但尚未提交的 (分类, 日期) 在提交前不判定为 unchanged（同一批内后到的旧内容不能被跳过）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+        self._staged = set()  # 已写入、待提交的 key
+
+    def _loaded(self) -> dict:
+        # 调用方须持有 self._lock
+        if self._data is None:
+            data = _read_json(self.path, {})
+            self._data = data if isinstance(data, dict) else {}
+        return self._data
+
+    @staticmethod
+    def _key(category: str, date_str: str) -> str:
+        return f"{category}/{date_str}"
+
+    def matches(self, category: str, date_str: str, digest: str) -> bool:
+        key = self._key(category, date_str)
+        with self._lock:
+            return key not in self._staged and self._loaded().get(key) == digest
+
+    def mark_staged(self, category: str, date_str: str):
+        with self._lock:
+            self._staged.add(self._key(category, date_str))
+
+    def record(self, items):
+        """items: [(category, date_str, digest)]"""
+        with self._lock:
+            data = self._loaded()
+            for category, date_str, digest in items:
+                key = self._key(category, date_str)
+                data[key] = digest
+                self._staged.discard(key)
+            atomic_write(self.path, json.dumps(data, ensure_ascii=False, indent=0, sort_keys=True))
+
+    def replace_all(self, items):
+        with self._lock:
+            self._data = {}
+        self.record(items)
+
+
 # ===== 主处理逻辑 =====
-def process_dify_report(content: str):
+def prepare_report(content: str) -> Tuple[str, Optional[dict], Optional[ReportMeta]]:
+    """格式化 + 分析 + 校验（纯 CPU，可在请求线程并行执行）。返回 (格式化后内容, 跳过结果或 None, 元数据)。"""
     # ===== 在处理前先调用 v15 格式化函数 =====
-    content = format_markdown_spacing(content)
+    with timed("format"):
+        content = format_markdown_spacing(content)
 
-    log.info(f"处理 Dify 报告 (v16 格式化)...（TZ={TZ_LABEL}）")
     if not content or not content.strip():
         log.warning("内容为空，忽略。")
-        return
+        count_outcome("skipped")
+        return content, {"status": "skipped", "reason": "内容为空"}, None
 
+    with timed("analyze"):
+        meta = analyze_report(content)
     # ===== 内容校验 =====
-    valid, reason = validate_content(content)
+    valid, reason = validate_content(content, meta)
     if not valid:
         log.warning(f"内容校验未通过：{reason}，跳过发布。")
-        return {"status": "skipped", "reason": reason}
+        count_outcome("skipped", meta.category)
+        return content, {"status": "skipped", "reason": reason}, meta
+    return content, None, meta
+
+
+def unchanged_result(category: str, date_str: str) -> dict:
+    count_outcome("unchanged", category)
+    return {"status": "unchanged", "category": category, "date": date_str}
+
 
-    category = classify(content)
+def resolve_report_target(content: str, meta: Optional[ReportMeta] = None) -> Tuple[str, str, str, str]:
+    """确定报告的 (分类, yyyy, mm, dd)：优先正文中的日期，缺失时用当天日期。"""
+    meta = meta or analyze_report(content)
+    category = meta.category
     log.info(f"分类：{category}")
 
     now_cn = datetime.now(CN_TZ)
     yyyy, mm, dd = now_cn.strftime("%Y"), now_cn.strftime("%m"), now_cn.strftime("%d")
     # 优先使用 H1 标题中的日期
-    parsed = parse_date_any(content)
+    parsed = meta.date
     if parsed:
         yyyy, mm, dd = parsed
         log.info(f"使用 H1 日期命名：{yyyy}-{mm}-{dd}")
     else:
         log.info(f"使用当天日期命名：{yyyy}-{mm}-{dd}")
-    date_str = f"{yyyy}-{mm}-{dd}"
+    return category, yyyy, mm, dd
+
+
+def stage_dify_report(content: str, prepared: bool = False):
+    """
+    写入 Markdown 与 manifest（不提交）。发布结果中的 _files 为待提交路径。
+    prepared=True 表示内容已在请求线程中经过 prepare_report。
+    """
+    meta = None
+    if not prepared:
+        content, skipped, meta = prepare_report(content)
+        if skipped:
+            return skipped
+
+    log.info(f"处理 Dify 报告 (v16 格式化)...（TZ={TZ_LABEL}）")
 
-    if not os.path.isdir(GITHUB_REPO_PATH):
-        log.error(f"仓库目录不存在：{GITHUB_REPO_PATH}")
-        raise FileNotFoundError(f"仓库目录不存在：{GITHUB_REPO_PATH}")
+    if meta is None:
+        with timed("analyze"):
+            meta = analyze_report(content)
+    assets = []
+    if ASSETS:
+        with timed("extract_images"):
+            content, assets = extract_images(content)
+        if assets:
+            log.info(f"提取内嵌图片 {len(assets)} 张")
+            meta = analyze_report(content)
+    category, yyyy, mm, dd = resolve_report_target(content, meta)
+    digest = content_digest(content)
+    target = current_target()
+    if target.hashes.matches(category, f"{yyyy}-{mm}-{dd}", digest):
+        log.info(f"内容与已发布版本一致（{category} {yyyy}-{mm}-{dd}），跳过写入与提交。")
+        return unchanged_result(category, f"{yyyy}-{mm}-{dd}")
+
+    title, summary = meta.title, meta.summary
+
+    if not os.path.isdir(target.repo):
+        log.error(f"仓库目录不存在：{target.repo}")
+        raise FileNotFoundError(f"仓库目录不存在：{target.repo}")
+
+    with target.lock:
+        target.hashes.mark_staged(category, f"{yyyy}-{mm}-{dd}")
+        result = _write_report(content, category, yyyy, mm, dd, title, summary, assets)
+    result["sha256"] = digest
+    return result
+
+
+def _write_report(content: str, category: str, yyyy: str, mm: str, dd: str, title: str, summary: str,
+                  assets=()) -> dict:
+    # 调用方须持有目标的仓库锁
+    target = current_target()
+    log.info(f"仓库目录：{target.repo}（{target.name}，{target.backend}）")
+    date_str = f"{yyyy}-{mm}-{dd}"
 
-    os.chdir(GITHUB_REPO_PATH)
-    log.info(f"仓库目录：{GITHUB_REPO_PATH}")
+    files = []
+    if assets:
+        with timed("assets", category=category):
+            files += store_image_assets(assets)
+        log.info(f"图片资源：{len(assets)} 张，新写入 {len(files)} 个文件")
 
     md_rel = os.path.join(category, yyyy, mm, f"{dd}.md")
+    digest = content_digest(content)
     # 覆盖写入（同日同类名文件会被替换）
-    atomic_write(os.path.join(PUBLIC_DIR, md_rel), content)
-    if WRITE_TO_ROOT:
-        atomic_write(md_rel, content)
-    log.info(f"Markdown 写入：{os.path.join(PUBLIC_DIR, md_rel)}" + (" & " + md_rel if WRITE_TO_ROOT else ""))
-
-    manifest_root = os.path.join("manifest.json")
-    manifest_pub  = os.path.join(PUBLIC_DIR, "manifest.json")
-    manifest_load_path = manifest_root if (WRITE_TO_ROOT and os.path.exists(manifest_root)) else manifest_pub
-    manifest = load_or_init_manifest(manifest_load_path)
-
-    title, summary = extract_title_summary(content)
-    manifest = upsert_manifest(manifest, category, yyyy, mm, dd, title, summary)
-    manifest_json = json.dumps(manifest, ensure_ascii=False, indent=2)
-
-    atomic_write(manifest_pub, manifest_json)
-    if WRITE_TO_ROOT: atomic_write(manifest_root, manifest_json)
-    log.info("manifest.json 已更新（public" + (" + root" if WRITE_TO_ROOT else "") + "）。")
-
-    commit_msg = f"docs(content): Update {category.upper()} daily report for {date_str}"
-    log.info("Git 提交中 ...")
-    changed = git_commit_push(
-        GITHUB_REPO_PATH,
-        commit_msg,
-        [os.path.join(PUBLIC_DIR, md_rel), md_rel, manifest_pub, manifest_root],
-    )
-    log.info("推送完成。")
+    with timed("write_markdown", category=category):
+        md_files = site_write(md_rel, content)
+    files += md_files
+    log.info(f"Markdown 写入：{' & '.join(md_files)}")
+
+    with timed("manifest", category=category):
+        files += update_sharded_manifest(category, yyyy, mm, dd, title, summary)
+    log.info(f"manifest 分片已更新：{manifest_shard_rel(category, f'{yyyy}-{mm}')}")
+
+    if target.legacy_manifest:
+        with timed("legacy_manifest", category=category):
+            manifest = load_site_manifest()
+            try:
+                manifest = upsert_manifest(manifest, category, yyyy, mm, dd, title, summary)
+                files += site_write("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2), manifest,
+                                    precompress=True)
+            except Exception:
+                invalidate_site_cache()
+                raise
+        log.info("manifest.json 已更新（public" + (" + root" if target.write_to_root else "") + "）。")
+
+    if SEARCH_INDEX:
+        with timed("search_index", category=category):
+            files += update_search_shard(category, yyyy, mm, dd, title, content)
+
+    if RENDER_HTML and _markdown is not None:
+        with timed("render_html", category=category):
+            files += update_report_html(md_rel, content, title, digest)
+
+    if FEEDS:
+        with timed("feeds", category=category):
+            files += update_feeds(category, date_str, title, summary, digest)
+
     return {
         "status": "published",
         "category": category,
         "date": date_str,
         "path": md_rel.replace("\\", "/"),
-        "changed": changed,
+        "_files": files,
+    }
+
+
+def commit_staged(results) -> Optional[str]:
+    """
+    把一批已写入的报告合并成一次 commit + 一次 push。
+    为每条发布结果补上 changed / commit（内容所在的提交），返回该提交 sha；批内无待提交文件时返回 None。
+    """
+    published = [r for r in results if isinstance(r, dict) and r.get("_files")]
+    if not published:
+        return None
+    paths = []
+    for r in published:
+        paths.extend(r.pop("_files"))
+    labels = []
+    for r in published:
+        label = f"{r['category'].upper()} {r['date']}"
+        if label not in labels:
+            labels.append(label)
+    if len(labels) == 1:
+        category, date_str = labels[0].split(" ")
+        commit_msg = f"docs(content): Update {category} daily report for {date_str}"
+    else:
+        commit_msg = f"docs(content): Update {len(labels)} daily reports\n\n" + "\n".join(f"- {x}" for x in labels)
+    target = current_target()
+    log.info(f"Git 提交中 ...（{target.name}，本批 {len(published)} 篇）")
+    with target.lock, timed("git_commit_push", reports=len(published)):
+        if target.backend == "plumbing":
+            changed, sha = target.store().commit(commit_msg)
+            if changed and not BACKGROUND_PUSH:
+                run_git(["git", "push", "origin", target.branch], target.repo)
+        else:
+            changed = git_commit_push(target.repo, commit_msg, paths, push=not BACKGROUND_PUSH, branch=target.branch)
+            sha = git_head(target.repo)
+    if sha is None:
+        # plumbing 后端：没有可提交的变更且分支尚不存在，内容不在任何提交中，不登记内容哈希
+        log.warning(f"本批没有产生提交，且分支 {target.branch} 尚不存在。")
+    elif BACKGROUND_PUSH:
+        log.info(f"本地提交完成：{sha[:8]}（交由后台推送）")
+        target.pusher.notify()
+    else:
+        log.info(f"推送完成：{sha[:8]}")
+    for r in published:
+        r["changed"] = changed
+        r["commit"] = sha
+        count_outcome("published", r["category"])
+    if sha is not None:
+        target.hashes.record([(r["category"], r["date"], r["sha256"]) for r in published if r.get("sha256")])
+    return sha
+
+
+def process_dify_report(content: str):
+    result = stage_dify_report(content)
+    commit_staged([result])
+    return result
+
+
+# ===== 归档批量重整 / 重建 manifest =====
+_ARCHIVE_PARTS_RE = re.compile(r'^(20\d{2})/(\d{2})/(\d{2})\.md$')
+
+
+def commit_maintenance(target: "Target", message: str, paths) -> str:
+    """
+    维护命令（reindex / search-index / render-html / feeds）的提交，与 commit_staged 一样遵循 BACKGROUND_PUSH：
+    后台推送时只提交并唤醒推送线程；命令行进程没有推送线程，当场推一次，失败则留给服务进程的后台推送。
+    返回分支当前提交。
+    """
+    git_commit_push(target.repo, message, paths, push=not BACKGROUND_PUSH, branch=target.branch)
+    if BACKGROUND_PUSH:
+        target.pusher.notify()
+        if not target.pusher.status()["running"]:
+            try:
+                target.pusher.push_once()
+            except Exception as e:
+                log.warning(f"[{target.name}] 推送失败，提交留在本地，由后台推送补推：{e}")
+    return git_head(target.repo)
+
+
+def archive_categories() -> list:
+    return list(current_target().categories)
+
+
+def scan_archive(categories=None) -> list:
+    """
+    列出归档中的全部日报：[(category, yyyy, mm, dd, [各副本路径])]，路径相对仓库根目录，
+    public/ 副本在前（作为读取来源），WRITE_TO_ROOT 时附带根目录副本。
+    """
+    found = {}
+    target = current_target()
+    bases = [target.public_dir] + ([""] if target.write_to_root else [])
+    for cat in categories or archive_categories():
+        for base in bases:
+            cat_dir = os.path.join(target.repo, base, cat)
+            for dirpath, _, filenames in os.walk(cat_dir):
+                for name in filenames:
+                    full = os.path.join(dirpath, name)
+                    sub = os.path.relpath(full, cat_dir).replace("\\", "/")
+                    m = _ARCHIVE_PARTS_RE.match(sub)
+                    if not m:
+                        continue
+                    key = (cat,) + m.groups()
+                    found.setdefault(key, []).append(os.path.join(base, cat, *sub.split("/")))
+    return [key + (paths,) for key, paths in sorted(found.items())]
+
+
+def _reindex_one(item) -> dict:
+    """进程池 worker：重新格式化一篇归档并提取元数据（只读，不写盘）。"""
+    category, yyyy, mm, dd, paths, repo_path = item
+    raws = []
+    for rel in paths:
+        with open(os.path.join(repo_path, rel), "rb") as f:
+            raws.append(f.read().decode("utf-8", errors="replace"))
+    normalized = format_markdown_spacing(raws[0])
+    meta = analyze_report(normalized)
+    title, summary, parsed = meta.title, meta.summary, meta.date
+    rewrite = [rel for rel, raw in zip(paths, raws) if raw != normalized]
+    diff = None
+    if rewrite:
+        old_lines = raws[0].replace("\r\n", "\n").split("\n")
+        new_lines = normalized.split("\n")
+        plus = minus = 0
+        for ln in difflib.unified_diff(old_lines, new_lines, lineterm="", n=0):
+            if ln.startswith("+") and not ln.startswith("+++"):
+                plus += 1
+            elif ln.startswith("-") and not ln.startswith("---"):
+                minus += 1
+        diff = (plus, minus)
+    return {
+        "category": category, "yyyy": yyyy, "mm": mm, "dd": dd,
+        "title": title, "summary": summary,
+        "parsed_date": "-".join(parsed) if parsed else None,
+        "bytes": sum(len(r) for r in raws),
+        "rewrite": rewrite,
+        "diff": diff,
+        "content": normalized if rewrite else None,
+        "sha256": content_digest(normalized),
+    }
+
+
+def rebuild_manifest(records, dry_run: bool = False) -> Tuple[list, list]:
+    """
+    用归档元数据从零重建分片 manifest（条目结构与 upsert_manifest 一致，按日期倒序）。
+    只写入内容有变化的分片；返回 (写入的路径, 有变化的分片相对路径)。调用方须持有目标的仓库锁。
+    """
+    target = current_target()
+    months = {cat: {} for cat in archive_categories()}
+    for r in records:
+        entry = make_manifest_entry(r["category"], r["yyyy"], r["mm"], r["dd"], r["title"], r["summary"])
+        months.setdefault(r["category"], {}).setdefault(f"{r['yyyy']}-{r['mm']}", []).append(entry)
+    for cat_months in months.values():
+        for entries in cat_months.values():
+            entries.sort(key=lambda e: e["date"], reverse=True)
+
+    meta = MANIFEST_CACHE.load(_site_read_path(manifest_index_rel()), _parse_index)
+    if meta is None:
+        meta = load_or_init_manifest(_site_read_path("manifest.json"))
+    manifest = {"site": meta["site"], "categories": meta["categories"], "months": months}
+
+    outputs = {manifest_index_rel(): (None, json.dumps(build_manifest_index(manifest), ensure_ascii=False, indent=2))}
+    for cat, cat_months in months.items():
+        for mk, entries in cat_months.items():
+            outputs[manifest_shard_rel(cat, mk)] = (entries, json.dumps(entries, ensure_ascii=False, indent=2))
+    if target.legacy_manifest:
+        outputs["manifest.json"] = (None, json.dumps(manifest, ensure_ascii=False, indent=2))
+
+    files, changed = [], []
+    for rel, (entries, data) in outputs.items():
+        try:
+            with open(os.path.join(target.repo, target.public_dir, rel), "r", encoding="utf-8") as f:
+                if f.read() == data:
+                    continue
+        except FileNotFoundError:
+            pass
+        changed.append(rel)
+        if not dry_run:
+            files += site_write(rel, data, precompress=True)
+    if not dry_run:
+        MANIFEST_CACHE.invalidate()
+    return files, changed
+
+
+def reindex_archive(dry_run: bool = False, workers: Optional[int] = None, commit: bool = True) -> dict:
+    """
+    批量重整归档：进程池并行重跑 format_markdown_spacing / analyze_report，
+    流式收集结果，只重写规范化后有变化的文件，从零重建 manifest，最后合并为一次提交。
+    """
+    target = current_target()
+    if target.backend == "plumbing":
+        raise RuntimeError(f"reindex 需要工作区：目标 {target.name} 须使用 worktree 后端（GIT_BACKEND / backend）")
+    items = [(cat, y, m, d, paths, target.repo) for cat, y, m, d, paths in scan_archive()]
+    total = len(items)
+    workers = workers or os.cpu_count() or 1
+    log.info(f"重整归档（{target.name}）：共 {total} 篇，{workers} 个进程{'（dry-run）' if dry_run else ''}")
+
+    records, rewrites, mismatched = [], [], []
+    done = nbytes = 0
+    started = last_report = time.perf_counter()
+    with multiprocessing.Pool(processes=workers) as pool:
+        for r in pool.imap_unordered(_reindex_one, items, chunksize=8):
+            done += 1
+            nbytes += r["bytes"]
+            records.append(r)
+            date_str = f"{r['yyyy']}-{r['mm']}-{r['dd']}"
+            if r["parsed_date"] and r["parsed_date"] != date_str:
+                mismatched.append((r["category"], date_str, r["parsed_date"]))
+            if r["rewrite"]:
+                rewrites.append(r)
+                plus, minus = r["diff"]
+                log.info(f"  {'将重写' if dry_run else '重写'} {r['category']}/{date_str}：+{plus}/-{minus} 行（{len(r['rewrite'])} 个副本）")
+                if not dry_run:
+                    with target.lock:
+                        for rel in r["rewrite"]:
+                            atomic_write(os.path.join(target.repo, rel), r["content"])
+                r["content"] = None
+            now = time.perf_counter()
+            if now - last_report >= 2 or done == total:
+                elapsed = max(now - started, 1e-9)
+                log.info(f"进度 {done}/{total}（{done / elapsed:.1f} 篇/s，{nbytes / elapsed / 1024 / 1024:.2f} MB/s）")
+                last_report = now
+
+    with target.lock:
+        files, changed_shards = rebuild_manifest(records, dry_run=dry_run)
+        for rel in changed_shards:
+            log.info(f"  manifest {'将更新' if dry_run else '已更新'}：{rel.replace(os.sep, '/')}")
+        for cat, path_date, parsed_date in mismatched:
+            log.warning(f"  日期不一致：{cat}/{path_date} 正文解析为 {parsed_date}（保留原路径）")
+
+        summary = {
+            "files": total,
+            "rewritten": len(rewrites),
+            "manifest_changed": len(changed_shards),
+            "date_mismatches": len(mismatched),
+            "seconds": round(time.perf_counter() - started, 2),
+            "commit": None,
+        }
+        if not dry_run and commit and (rewrites or files):
+            paths = [rel for r in rewrites for rel in r["rewrite"]] + files
+            msg = f"chore(content): Re-normalize archive ({len(rewrites)} reports) and rebuild manifest"
+            summary["commit"] = commit_maintenance(target, msg, paths)
+        if not dry_run:
+            target.hashes.replace_all([(r["category"], f"{r['yyyy']}-{r['mm']}-{r['dd']}", r["sha256"]) for r in records])
+    log.info(f"重整完成：{json.dumps(summary, ensure_ascii=False)}")
+    return summary
+
+
+def _search_one(item) -> tuple:
+    """进程池 worker：为一篇归档切词（只读）。"""
+    category, yyyy, mm, dd, paths, repo_path = item
+    with open(os.path.join(repo_path, paths[0]), "rb") as f:
+        md = f.read().decode("utf-8", errors="replace")
+    title = analyze_report(md).title
+    return category, yyyy, mm, dd, title, search_tokens(title + "\n" + md)
+
+
+def rebuild_search_index(dry_run: bool = False, workers: Optional[int] = None, commit: bool = True) -> dict:
+    """从归档全量重建检索分片：进程池并行切词，只写内容有变化的分片，最后合并为一次提交。"""
+    target = current_target()
+    if target.backend == "plumbing":
+        raise RuntimeError(f"search-index 需要工作区：目标 {target.name} 须使用 worktree 后端（GIT_BACKEND / backend）")
+    items = [(cat, y, m, d, paths, target.repo) for cat, y, m, d, paths in scan_archive()]
+    workers = workers or os.cpu_count() or 1
+    log.info(f"重建检索索引（{target.name}）：共 {len(items)} 篇，{workers} 个进程{'（dry-run）' if dry_run else ''}")
+    started = time.perf_counter()
+    shards = {}
+    with multiprocessing.Pool(processes=workers) as pool:
+        for category, yyyy, mm, dd, title, tokens in pool.imap_unordered(_search_one, items, chunksize=8):
+            shard = shards.setdefault(search_shard_rel(category, f"{yyyy}-{mm}"), _empty_search_shard())
+            _add_search_doc(shard, _search_doc(category, yyyy, mm, dd, title), tokens)
+
+    files, changed, total_bytes = [], [], 0
+    with target.lock:
+        for rel in sorted(shards):
+            data = _dump_search_shard(shards[rel])
+            total_bytes += len(data.encode("utf-8"))
+            try:
+                with open(os.path.join(target.repo, target.public_dir, rel), "r", encoding="utf-8") as f:
+                    if f.read() == data:
+                        continue
+            except FileNotFoundError:
+                pass
+            changed.append(rel)
+            log.info(f"  检索分片{'将更新' if dry_run else '已更新'}：{rel.replace(os.sep, '/')}")
+            if not dry_run:
+                files += site_write(rel, data, precompress=True)
+        if not dry_run:
+            MANIFEST_CACHE.invalidate()
+        summary = {
+            "files": len(items),
+            "shards": len(shards),
+            "changed": len(changed),
+            "bytes": total_bytes,
+            "seconds": round(time.perf_counter() - started, 2),
+            "commit": None,
+        }
+        if files and commit:
+            summary["commit"] = commit_maintenance(
+                target, f"chore(search): Rebuild search index ({len(changed)} shards)", files)
+    log.info(f"检索索引重建完成：{json.dumps(summary, ensure_ascii=False)}")
+    return summary
+
+
+def _render_one(item) -> Optional[tuple]:
+    """进程池 worker：渲染一篇归档的 DD.html；已有片段与源文哈希一致时返回 None（只读）。"""
+    category, yyyy, mm, dd, paths, repo_path, public_dir, force = item
+    with open(os.path.join(repo_path, paths[0]), "rb") as f:
+        md = f.read().decode("utf-8", errors="replace")
+    rel = html_rel_for(os.path.join(category, yyyy, mm, f"{dd}.md"))
+    header = html_header(content_digest(md))
+    if not force:
+        try:
+            with open(os.path.join(repo_path, public_dir, rel), "r", encoding="utf-8") as f:
+                if f.readline() == header:
+                    return None
+        except FileNotFoundError:
+            pass
+    return rel, header + render_report_html(md, analyze_report(md).title)
+
+
+def rebuild_report_html(dry_run: bool = False, workers: Optional[int] = None, commit: bool = True,
+                        force: bool = False) -> dict:
+    """为归档补齐/刷新预渲染正文：源文哈希未变的片段跳过，其余并行渲染后合并为一次提交。"""
+    if _markdown is None:
+        raise RuntimeError("render-html 需要 python-markdown：pip install markdown")
+    target = current_target()
+    if target.backend == "plumbing":
+        raise RuntimeError(f"render-html 需要工作区：目标 {target.name} 须使用 worktree 后端（GIT_BACKEND / backend）")
+    items = [(cat, y, m, d, paths, target.repo, target.public_dir, force) for cat, y, m, d, paths in scan_archive()]
+    workers = workers or os.cpu_count() or 1
+    log.info(f"预渲染正文（{target.name}）：共 {len(items)} 篇，{workers} 个进程{'（dry-run）' if dry_run else ''}")
+    started = time.perf_counter()
+    files, changed = [], []
+    with multiprocessing.Pool(processes=workers) as pool:
+        rendered = [r for r in pool.imap_unordered(_render_one, items, chunksize=8) if r is not None]
+    with target.lock:
+        for rel, data in sorted(rendered):
+            changed.append(rel)
+            log.info(f"  预渲染正文{'将更新' if dry_run else '已更新'}：{rel.replace(os.sep, '/')}")
+            if not dry_run:
+                files += site_write(rel, data, precompress=True)
+        summary = {
+            "files": len(items),
+            "changed": len(changed),
+            "seconds": round(time.perf_counter() - started, 2),
+            "commit": None,
+        }
+        if files and commit:
+            summary["commit"] = commit_maintenance(target, f"chore(html): Render {len(changed)} report pages", files)
+    log.info(f"预渲染正文完成：{json.dumps(summary, ensure_ascii=False)}")
+    return summary
+
+
+def rebuild_feeds(dry_run: bool = False, commit: bool = True) -> dict:
+    """
+    从归档重建全部订阅源。每个分类只需读取最近 FEED_MAX_ITEMS 篇，标题/摘要与 manifest 一样取自 analyze_report；
+    内容哈希未变的条目沿用现有 date_modified，新条目取报告日期，重复运行结果不变。
+    """
+    target = current_target()
+    if target.backend == "plumbing":
+        raise RuntimeError(f"feeds 需要工作区：目标 {target.name} 须使用 worktree 后端（GIT_BACKEND / backend）")
+    started = time.perf_counter()
+    with target.lock:
+        site, categories = _feed_site()
+        docs = {}
+        for cat, yyyy, mm, dd, paths in scan_archive():
+            docs.setdefault(cat, []).append((f"{yyyy}-{mm}-{dd}", paths[0]))
+        feeds = {}
+        for cat, entries in docs.items():
+            items = []
+            for date_str, path in sorted(entries, reverse=True)[:FEED_MAX_ITEMS]:
+                with open(os.path.join(target.repo, path), "rb") as f:
+                    md = f.read().decode("utf-8", errors="replace")
+                meta = analyze_report(md)
+                items.append(make_feed_item(cat, date_str, meta.title, meta.summary, content_digest(md),
+                                            categories.get(cat, cat)))
+            feeds[cat] = items
+        feeds[None] = [it for items in feeds.values() for it in items]
+
+        files, changed = [], []
+        for cat, items in feeds.items():
+            old = site_load(feed_rel(cat, "feed.json"), _parse_feed, list)
+            merged = merge_feed_items(old, items, replace=True)
+            if merged == old:
+                continue
+            changed.append(cat or "(all)")
+            log.info(f"  订阅源{'将更新' if dry_run else '已更新'}：{feed_rel(cat, 'feed.*').replace(os.sep, '/')}（{len(merged)} 条）")
+            if not dry_run:
+                files += write_feeds(cat, merged, site, categories)
+        summary = {
+            "feeds": len(feeds),
+            "changed": len(changed),
+            "seconds": round(time.perf_counter() - started, 2),
+            "commit": None,
+        }
+        if files and commit:
+            summary["commit"] = commit_maintenance(target, f"chore(feed): Rebuild feeds ({', '.join(changed)})", files)
+    log.info(f"订阅源重建完成：{json.dumps(summary, ensure_ascii=False)}")
+    return summary
+
+
+# ===== 持久化发布队列 =====
+_JOB_ID_RE = re.compile(r'^\d{14}-[0-9a-f]{8}$')
+
+
+class PublishQueue:
+    """
+    磁盘持久化的发布队列：
+    - 每个任务一个 JSON 文件（QUEUE_DIR/<job_id>.json），状态 queued → running → done/failed
+    - 后台单线程按提交顺序执行 stage(content) 写入文件，Webhook 无需等待 git push
+    - 防抖窗口内陆续到达的任务（最多 GIT_BATCH_MAX 个）由 commit(results) 合并为一次提交与推送
+    - 进程崩溃后由守护进程重启，recover() 会重放 queued/running 状态的任务
+    """
+
+    def __init__(self, queue_dir: str, stage, commit, target: Optional["Target"] = None):
+        self.queue_dir = queue_dir
+        self.target = target  # 工作线程内 current_target() 返回此目标
+        self._stage = stage
+        self._commit = commit
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = {}  # job_id -> 任务状态（不含 content）
+        self._keys = {}  # Idempotency-Key -> 排队/执行中的 job_id；任务结束即移除
+        self._rewritten = {}  # rebase 前的提交 sha -> rebase 后的 sha
+        self._thread = None
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.queue_dir, f"{job_id}.json")
+
+    def _save(self, job: dict):
+        atomic_write(self._job_path(job["id"]), json.dumps(job, ensure_ascii=False))
+
+    @staticmethod
+    def _public(job: dict) -> dict:
+        return {k: v for k, v in job.items() if k != "content"}
+
+    def find_by_key(self, idempotency_key: Optional[str]) -> Optional[dict]:
+        """返回同一 Idempotency-Key 仍在排队/执行的任务；已结束的任务不再合并重发。"""
+        if not idempotency_key:
+            return None
+        with self._lock:
+            job = self._active_by_key(idempotency_key)
+            return dict(job) if job is not None else None
+
+    def _active_by_key(self, idempotency_key: str) -> Optional[dict]:
+        # 调用方须持有 self._lock
+        job = self._jobs.get(self._keys.get(idempotency_key))
+        if job is not None and job["status"] in ("queued", "running"):
+            return job
+        return None
+
+    def submit(self, content: str, idempotency_key: Optional[str] = None, slot: Optional[str] = None,
+               **options) -> Tuple[dict, bool]:
+        """
+        入队并返回 (任务, 是否新建)；同一 Idempotency-Key 的任务仍在排队/执行时直接返回该任务。
+        slot 为报告的 "<分类>/<日期>"，供 has_active() 判断同一篇报告是否还有未完成的任务。
+        """
+        now = datetime.now(CN_TZ)
+        job_id = f"{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "created_at": now.isoformat(timespec="seconds"),
+            "updated_at": now.isoformat(timespec="seconds"),
+            "idempotency_key": idempotency_key,
+            "slot": slot,
+            "content": content,
+            "options": options,
+        }
+        with self._lock:
+            existing = self._active_by_key(idempotency_key) if idempotency_key else None
+            if existing is not None:
+                return dict(existing), False
+            if idempotency_key:
+                self._keys[idempotency_key] = job_id
+            self._jobs[job_id] = self._public(job)
+        # 先落盘再入队：即使随后崩溃，任务也能在重启后重放
+        try:
+            self._save(job)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                if idempotency_key:
+                    self._keys.pop(idempotency_key, None)
+            raise
+        self._pending.put(job_id)
+        log.info(f"任务已入队：{job_id}（待处理 {self._pending.qsize()}）")
+        return self._public(job), True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        if not _JOB_ID_RE.match(job_id or ""):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return dict(job)
+        # 进程重启前已清理出内存的历史任务，回退读盘
+        try:
+            with open(self._job_path(job_id), "r", encoding="utf-8") as f:
+                return self._public(json.load(f))
+        except Exception:
+            return None
+
+    def depth(self) -> int:
+        return self._pending.qsize()
+
+    def has_active(self, slot: str) -> bool:
+        """是否有同一 slot（或 slot 未知）的任务仍在排队/执行。"""
+        with self._lock:
+            return any(job["status"] in ("queued", "running") and job.get("slot") in (slot, None)
+                       for job in self._jobs.values())
+
+    def recover(self) -> int:
+        """扫描队列目录：重放未完成任务，清理过期的已完成任务，返回重放数量。"""
+        os.makedirs(self.queue_dir, exist_ok=True)
+        replayed = 0
+        cutoff = datetime.now(CN_TZ).timestamp() - JOB_RETENTION_SECONDS
+        for name in sorted(os.listdir(self.queue_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.queue_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except Exception as e:
+                log.warning(f"跳过无法解析的任务文件 {name}：{e}")
+                continue
+            if job.get("status") in ("queued", "running"):
+                job["status"] = "queued"
+                self._save(job)
+                self._register(job)
+                self._pending.put(job["id"])
+                replayed += 1
+            elif os.path.getmtime(path) < cutoff:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            else:
+                self._register(job)
+        if replayed:
+            log.info(f"重放未完成任务 {replayed} 个。")
+        return replayed
+
+    def _register(self, job: dict):
+        with self._lock:
+            self._jobs[job["id"]] = self._public(job)
+            if job.get("idempotency_key") and job["status"] in ("queued", "running"):
+                self._keys[job["idempotency_key"]] = job["id"]
+
+    def start(self):
+        if self._thread is None:
+            name = f"publish-{self.target.name}" if self.target is not None else "publish-worker"
+            self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+            self._thread.start()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """等待已入队的任务全部执行并提交完毕；超时返回 False（未完成的任务留在磁盘，由下一个进程 recover()）。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending.all_tasks_done:
+            while self._pending.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending.all_tasks_done.wait(remaining)
+        return True
+
+    def _update(self, job: dict, **fields):
+        job.update(fields)
+        job["updated_at"] = datetime.now(CN_TZ).isoformat(timespec="seconds")
+        with self._lock:
+            self._rewrite_result(job)
+            self._save(job)
+            self._jobs[job["id"]] = self._public(job)
+            key = job.get("idempotency_key")
+            if job["status"] in ("done", "failed") and key and self._keys.get(key) == job["id"]:
+                del self._keys[key]
+
+    def _rewrite_result(self, job: dict) -> bool:
+        # 调用方须持有 self._lock
+        result = job.get("result")
+        if not isinstance(result, dict) or result.get("commit") not in self._rewritten:
+            return False
+        while result["commit"] in self._rewritten:
+            result["commit"] = self._rewritten[result["commit"]]
+        return True
+
+    def rewrite_commits(self, mapping: dict):
+        """后台推送 rebase 后调用：把任务结果里的旧提交 sha 改写为 rebase 后的 sha（包括稍后才写入结果的任务）。"""
+        with self._lock:
+            self._rewritten.update((old, new) for old, new in mapping.items() if old != new)
+            for job_id, public in list(self._jobs.items()):
+                if (public.get("result") or {}).get("commit") not in self._rewritten:
+                    continue
+                job = self._load(job_id)
+                if job is not None and self._rewrite_result(job):
+                    self._save(job)
+                    self._jobs[job_id] = self._public(job)
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._job_path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            log.error(f"读取任务 {job_id} 失败：{e}")
+            return None
+
+    def _run(self):
+        if self.target is not None:
+            _CURRENT.target = self.target
+        while True:
+            taken = [self._pending.get()]
+            try:
+                self._run_batch(taken)
+            finally:
+                # drain() 依赖 task_done：本批取出的任务无论成败都要计数
+                for _ in taken:
+                    self._pending.task_done()
+
+    def _run_batch(self, taken: list):
+        staged = []
+        job_id = taken[0]
+        while True:
+            job = self._load(job_id)
+            if job is not None:
+                self._update(job, status="running")
+                try:
+                    staged.append((job, self._stage(job["content"], **job.get("options", {}))))
+                except Exception as e:
+                    log.exception(f"任务失败：{job_id}")
+                    count_outcome("error")
+                    self._update(job, status="failed", error=str(e))
+            if GIT_BATCH_WINDOW <= 0 or len(staged) >= GIT_BATCH_MAX:
+                break
+            # 防抖：窗口内有新任务到达就继续并入本批
+            try:
+                job_id = self._pending.get(timeout=GIT_BATCH_WINDOW)
+            except queue.Empty:
+                break
+            taken.append(job_id)
+        if not staged:
+            return
+        try:
+            self._commit([result for _, result in staged])
+        except Exception as e:
+            log.exception(f"批量提交失败（{len(staged)} 个任务）")
+            for job, result in staged:
+                count_outcome("error", result.get("category") if isinstance(result, dict) else None)
+                self._update(job, status="failed", error=str(e))
+            return
+        for job, result in staged:
+            # 完成后不再保留正文，状态文件只用于查询
+            self._update(job, status="done", result=result, content=None)
+            log.info(f"任务完成：{job['id']}")
+
+
+# ===== 多站点 / 多仓库：发布目标 =====
+# TARGETS_CONFIG 不存在时只有一个 "default" 目标，设置全部取自文件开头的全局配置（与单站点时完全一致）。
+# 配置文件示例（目标中未写的键沿用全局配置）：
+# {
+#   "targets": [
+#     {"name": "daily", "repo": "C:\\sites\\daily-site", "webhook": ["/webhook", "/webhook/daily"]},
+#     {"name": "finance", "repo": "C:\\sites\\finance-site", "branch": "gh-pages", "backend": "plumbing",
+#      "webhook": "/webhook", "match": ["财经日报"],
+#      "site": {"title": "财经日报", "description": "每日财经要闻", "baseUrl": ""},
+#      "categories": {"macro": "宏观", "stock": "股市"},
+#      "classify": {"stock": ["A股", "港股"]}, "default_category": "macro",
+#      "site_url": "https://example.github.io/finance-site"}
+#   ]
+# }
+# 路由：请求路径须在目标的 webhook 列表中；多个目标共用一个路径时，正文命中 match 关键词的优先，
+# 都不命中时交给该路径下未配置 match 的目标。分类在目标内按 classify 规则判定。
+# 每个目标有独立的仓库锁、发布队列线程、git 后端与后台推送线程：不同仓库的发布并行，
+# 某个站点提交/推送缓慢不会拖慢其他站点。队列目录与内容哈希索引按目标名分开存放。
+_TARGET_NAME_RE = re.compile(r'^[A-Za-z0-9_-]{1,40}$')
+_GIT_BACKENDS = ("worktree", "plumbing")
+
+
+def _global_target_settings() -> dict:
+    return {
+        "repo": GITHUB_REPO_PATH,
+        "branch": "main",
+        "backend": GIT_BACKEND,
+        "webhook": ["/webhook"],
+        "match": [],
+        "public_dir": PUBLIC_DIR,
+        "write_to_root": WRITE_TO_ROOT,
+        "manifest_dir": MANIFEST_DIR,
+        "legacy_manifest": WRITE_LEGACY_MANIFEST,
+        "site": DEFAULT_MANIFEST["site"],
+        "categories": DEFAULT_MANIFEST["categories"],
+        "classify": CLASSIFY_RULES,
+        "default_category": DEFAULT_CATEGORY,
+        "site_url": SITE_URL,
+        "queue_dir": QUEUE_DIR,
+        "hash_index": HASH_INDEX_PATH,
     }
 
 
-# ===== Webhook Server (无变动) =====
+class Target:
+    """一个发布目标：站点仓库的设置 + 该仓库独占的锁、发布队列、git 后端与推送线程。"""
+
+    def __init__(self, name: str, settings: dict):
+        self.name = name
+        self.settings = settings
+        self.repo = settings["repo"]
+        self.branch = settings["branch"]
+        self.backend = settings["backend"]
+        self.webhooks = tuple(settings["webhook"])
+        self.match = tuple(settings["match"])
+        self.public_dir = settings["public_dir"]
+        self.write_to_root = bool(settings["write_to_root"])
+        self.manifest_dir = settings["manifest_dir"]
+        self.legacy_manifest = bool(settings["legacy_manifest"])
+        self.site = dict(settings["site"])
+        self.categories = dict(settings["categories"])
+        self.classify_rules = [(cat, tuple(words)) for cat, words in settings["classify"].items()]
+        self.default_category = settings["default_category"]
+        self.site_url = settings["site_url"]
+        # 仓库写锁：工作区文件、manifest 读-改-写与 git 操作在此锁内串行（只约束同一仓库）
+        self.lock = threading.RLock()
+        self.hashes = ContentHashIndex(settings["hash_index"])
+        self.queue = PublishQueue(settings["queue_dir"], stage_dify_report, commit_staged, target=self)
+        self.pusher = GitPusher(self)
+        self._store = None
+
+    def classify(self, content: str) -> str:
+        for category, keywords in self.classify_rules:
+            if any(k in content for k in keywords):
+                return category
+        return self.default_category
+
+    def default_manifest(self) -> dict:
+        return {"site": dict(self.site), "categories": dict(self.categories), "months": {c: {} for c in self.categories}}
+
+    def store(self) -> GitObjectStore:
+        if self._store is None:
+            self._store = GitObjectStore(self.repo, self.branch)
+        return self._store
+
+    def loaded_store(self) -> Optional[GitObjectStore]:
+        return self._store
+
+    def close_store(self):
+        # 调用方须持有 self.lock
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def start(self):
+        self.queue.recover()
+        self.queue.start()
+        if BACKGROUND_PUSH:
+            self.pusher.start()
+
+
+TARGETS = []  # init_targets() 载入；serve 期间只读
+_DEFAULT_TARGET = None
+_CURRENT = threading.local()
+
+
+def default_target() -> Target:
+    """由全局配置构成的单站点目标；全局配置被改动（如压测脚本改写 GITHUB_REPO_PATH）时重新创建。"""
+    global _DEFAULT_TARGET
+    settings = _global_target_settings()
+    if _DEFAULT_TARGET is None or _DEFAULT_TARGET.settings != settings:
+        if _DEFAULT_TARGET is not None:
+            with _DEFAULT_TARGET.lock:
+                _DEFAULT_TARGET.close_store()
+        _DEFAULT_TARGET = Target("default", settings)
+    return _DEFAULT_TARGET
+
+
+def current_target() -> Target:
+    """当前线程正在处理的目标：发布队列线程固定为所属目标，请求线程在路由后设置，其余情况取第一个目标。"""
+    target = getattr(_CURRENT, "target", None)
+    if target is not None:
+        return target
+    return TARGETS[0] if TARGETS else default_target()
+
+
+@contextmanager
+def use_target(target: Target):
+    previous = getattr(_CURRENT, "target", None)
+    _CURRENT.target = target
+    try:
+        yield target
+    finally:
+        _CURRENT.target = previous
+
+
+def _as_list(value) -> list:
+    return [value] if isinstance(value, str) else list(value or [])
+
+
+def load_targets(path: Optional[str] = None) -> list:
+    """读取 TARGETS_CONFIG；文件不存在时返回只含 default_target() 的列表。配置有误时抛 ValueError。"""
+    path = TARGETS_CONFIG if path is None else path
+    if not path or not os.path.exists(path):
+        return [default_target()]
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data.get("targets") if isinstance(data, dict) else data
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path}：缺少 targets 列表")
+    base = _global_target_settings()
+    targets, repos = [], {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError(f"{path}：targets 中的每一项都必须是对象")
+        name = str(entry.get("name") or "")
+        if not _TARGET_NAME_RE.match(name):
+            raise ValueError(f"{path}：目标名 {name!r} 无效（字母/数字/_/-，最长 40）")
+        if any(t.name == name for t in targets):
+            raise ValueError(f"{path}：目标名 {name} 重复")
+        unknown = sorted(set(entry) - set(base) - {"name"})
+        if unknown:
+            raise ValueError(f"{path}：目标 {name} 含未知配置项 {', '.join(unknown)}")
+        settings = dict(base, queue_dir=os.path.join(QUEUE_DIR, name),
+                        hash_index=os.path.join(SCRIPT_DIR, f".publish_hashes.{name}.json"))
+        settings.update({k: v for k, v in entry.items() if k != "name"})
+        settings["webhook"] = _as_list(settings["webhook"])
+        settings["match"] = _as_list(settings["match"])
+        if settings["backend"] not in _GIT_BACKENDS:
+            raise ValueError(f"{path}：目标 {name} 的 backend 须为 {' / '.join(_GIT_BACKENDS)}")
+        if not settings["webhook"] or not all(p.startswith("/") for p in settings["webhook"]):
+            raise ValueError(f"{path}：目标 {name} 的 webhook 须为以 / 开头的路径")
+        if not isinstance(settings["classify"], dict) or not settings["categories"]:
+            raise ValueError(f"{path}：目标 {name} 的 classify 须为 分类 → 关键词列表，categories 不能为空")
+        repo = os.path.normcase(os.path.abspath(settings["repo"]))
+        if repo in repos:
+            # 同一仓库两把锁、两个推送线程会互相踩踏
+            raise ValueError(f"{path}：目标 {name} 与 {repos[repo]} 使用同一仓库 {settings['repo']}")
+        repos[repo] = name
+        targets.append(Target(name, settings))
+    return targets
+
+
+def init_targets(path: Optional[str] = None) -> list:
+    global TARGETS
+    TARGETS = load_targets(path)
+    for t in TARGETS:
+        log.info(f"发布目标 {t.name}：{t.repo}（{t.backend}，分支 {t.branch}，webhook {', '.join(t.webhooks)}"
+                 + (f"，match {', '.join(t.match)}" if t.match else "") + "）")
+    return TARGETS
+
+
+def webhook_paths() -> set:
+    return {p for t in TARGETS for p in t.webhooks}
+
+
+def route_target(path: str, content: str) -> Optional[Target]:
+    candidates = [t for t in TARGETS if path in t.webhooks]
+    for t in candidates:
+        if t.match and any(k in content for k in t.match):
+            return t
+    return next((t for t in candidates if not t.match), None)
+
+
+def find_job(job_id: str) -> Optional[dict]:
+    for t in TARGETS:
+        job = t.queue.get(job_id)
+        if job is not None:
+            return job
+    return None
+
+
+def find_job_by_key(idempotency_key: Optional[str]) -> Optional[dict]:
+    for t in TARGETS:
+        job = t.queue.find_by_key(idempotency_key)
+        if job is not None:
+            return job
+    return None
+
+
+METRICS.gauge("dify_publish_queue_depth", "Jobs waiting in the publish queues (all targets)",
+              lambda: sum(t.queue.depth() for t in TARGETS))
+METRICS.gauge("dify_push_commits_ahead", "Local commits not yet on origin (as of the last push attempt, all targets)",
+              lambda: sum(t.pusher.status()["ahead"] or 0 for t in TARGETS))
+METRICS.gauge("dify_push_consecutive_failures", "Consecutive failed background push attempts (worst target)",
+              lambda: max((t.pusher.status()["failures"] for t in TARGETS), default=0))
+METRICS.gauge("dify_render_html_enabled", "1 if DD.html is pre-rendered on publish (0: RENDER_HTML off or markdown not installed)",
+              lambda: int(RENDER_HTML and _markdown is not None))
+
+
+# ===== Webhook Server =====
+class PayloadTooLarge(ValueError):
+    pass
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+_MAX_LINE = 64 * 1024  # chunk 长度行 / trailer 行的长度上限
+
+
 class WebhookHandler(http.server.SimpleHTTPRequestHandler):
-    def _read_body(self) -> bytes:
-        te = (self.headers.get("Transfer-Encoding") or "").lower()
-        if "chunked" in te:
-            body = b""
-            while True:
-                line = self.rfile.readline().strip()
-                if not line: break
-                size = int(line, 16)
-                if size == 0:
-                    self.rfile.readline(); break
-                body += self.rfile.read(size)
-                self.rfile.readline()
+    timeout = HTTP_REQUEST_TIMEOUT
+
+    def _send_json(self, code: int, payload, headers: Optional[dict] = None):
+        msg = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(msg)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(msg)
+
+    def _read_line(self) -> bytes:
+        line = self.rfile.readline(_MAX_LINE + 1)
+        if not line:
+            raise ValueError("请求体提前结束")
+        if len(line) > _MAX_LINE:
+            raise ValueError("chunk 行过长")
+        return line
+
+    def _read_chunked(self, limit: int) -> bytearray:
+        # chunk = size[;ext...] CRLF data CRLF，以 0 长度 chunk 结束，其后可带 trailer 头部直到空行
+        body = bytearray()
+        while True:
+            size_field = self._read_line().split(b";", 1)[0].strip()
+            try:
+                size = int(size_field, 16)
+            except ValueError:
+                raise ValueError(f"非法 chunk 长度：{size_field[:20]!r}")
+            if size < 0:
+                raise ValueError("非法 chunk 长度")
+            if size == 0:
+                break
+            if len(body) + size > limit:
+                raise PayloadTooLarge(f"请求体超过上限 {limit} 字节")
+            chunk = self.rfile.read(size)
+            if len(chunk) != size:
+                raise ValueError("chunk 数据不完整")
+            body += chunk
+            if self._read_line().strip():
+                raise ValueError("chunk 数据后缺少 CRLF")
+        while self._read_line().strip():
+            pass  # trailer 字段不参与处理，读完即可
+        return body
+
+    def _read_sized(self, limit: int) -> bytearray:
+        try:
+            n = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            raise ValueError("非法 Content-Length")
+        if n < 0:
+            raise ValueError("非法 Content-Length")
+        if n > limit:
+            raise PayloadTooLarge(f"请求体超过上限 {limit} 字节")
+        body = bytearray(n)
+        view = memoryview(body)
+        pos = 0
+        while pos < n:
+            got = self.rfile.readinto(view[pos:])
+            if not got:
+                raise ValueError("请求体不完整")
+            pos += got
+        return body
+
+    def _decode_content(self, body: bytearray, limit: int) -> bytearray:
+        enc = (self.headers.get("Content-Encoding") or "").strip().lower()
+        if enc in ("", "identity"):
             return body
-        n = int(self.headers.get("Content-Length", "0"))
-        return self.rfile.read(n)
+        if enc not in ("gzip", "x-gzip", "deflate"):
+            raise UnsupportedEncoding(f"不支持的 Content-Encoding：{enc}")
+        wbits = zlib.MAX_WBITS | 16 if "gzip" in enc else zlib.MAX_WBITS
+        d = zlib.decompressobj(wbits)
+        try:
+            out = bytearray(d.decompress(body, limit + 1))
+            if len(out) <= limit and not d.unconsumed_tail:
+                out += d.flush()
+        except zlib.error as e:
+            raise ValueError(f"{enc} 解压失败：{e}")
+        if len(out) > limit or d.unconsumed_tail:
+            raise PayloadTooLarge(f"解压后的请求体超过上限 {limit} 字节")
+        if not d.eof:
+            raise ValueError(f"{enc} 数据不完整")
+        return out
+
+    def _read_body(self) -> bytearray:
+        """流式读取请求体：写入预分配/追加式缓冲区，超出 MAX_BODY_BYTES 抛 PayloadTooLarge，并按 Content-Encoding 解压。"""
+        te = (self.headers.get("Transfer-Encoding") or "").lower()
+        body = self._read_chunked(MAX_BODY_BYTES) if "chunked" in te else self._read_sized(MAX_BODY_BYTES)
+        return self._decode_content(body, MAX_BODY_BYTES)
+
+    @staticmethod
+    def _parse_json(raw):
+        try:
+            return json.loads(raw)
+        except UnicodeDecodeError:
+            try:
+                return json.loads(raw.decode("utf-8", errors="replace"))
+            except Exception:
+                return None
+        except Exception:
+            return None
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path == "/push/status":
+            if len(TARGETS) == 1:
+                self._send_json(200, dict(TARGETS[0].pusher.status(), background=BACKGROUND_PUSH))
+            else:
+                self._send_json(200, {"background": BACKGROUND_PUSH,
+                                      "targets": {t.name: t.pusher.status() for t in TARGETS}})
+            return
+        if self.path.startswith("/jobs/"):
+            job = find_job(self.path[len("/jobs/"):].strip("/"))
+            if job is None:
+                self._send_json(404, {"error": "job not found"})
+            else:
+                self._send_json(200, job)
+            return
+        # 不回退到 SimpleHTTPRequestHandler 的静态文件服务：工作目录是脚本目录，
+        # 其中有发布队列（含报告正文与 Idempotency-Key）、内容哈希索引与 dify_targets.json
+        self._send_json(404, {"error": "not found"})
+
+    def do_HEAD(self):
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _enqueue(self, target: Target, content: str, idem_key: Optional[str]):
+        # 格式化与校验在请求线程内完成（分类按目标的规则），无效内容不进入队列
+        content, skipped, meta = prepare_report(content)
+        if skipped:
+            self._send_json(200, skipped)
+            return
+        if target.queue.depth() >= MAX_QUEUE_DEPTH:
+            log.warning(f"发布队列已满（{target.name}：{target.queue.depth()}），拒绝请求。")
+            self._send_json(503, {"error": "publish queue is full", "target": target.name}, {"Retry-After": "30"})
+            return
+        # 与已发布内容完全一致：不入队、不写盘、不碰 git（含内嵌图片的报告在提取图片后由发布队列比较）。
+        # 同一篇报告还有未完成的任务时照常入队：排在前面的新内容发布后，这次重发才是最终版本
+        category, yyyy, mm, dd = resolve_report_target(content, meta)
+        date_str = f"{yyyy}-{mm}-{dd}"
+        slot = f"{category}/{date_str}"
+        if not target.queue.has_active(slot) and target.hashes.matches(category, date_str, content_digest(content)):
+            log.info(f"内容未变化（{target.name} {category} {date_str}），直接返回。")
+            self._send_json(200, dict(unchanged_result(category, date_str), target=target.name))
+            return
+        job, created = target.queue.submit(content, idempotency_key=idem_key, slot=slot, prepared=True)
+        payload = {"status": "queued", "job_id": job["id"], "status_url": f"/jobs/{job['id']}", "target": target.name}
+        if not created:
+            payload = dict(job, duplicate=True)
+        self._send_json(202, payload)
 
     def do_POST(self):
-        if self.path != "/webhook":
+        if self.path not in webhook_paths():
             self.send_response(404); self.end_headers(); return
         try:
+            # 同一 Idempotency-Key 的任务仍在排队/执行：直接返回该任务，不再解析请求体；
+            # 已结束（含失败）的任务不拦截，重发会重新入队
+            idem_key = (self.headers.get("Idempotency-Key") or "").strip()[:200] or None
+            existing = find_job_by_key(idem_key)
+            if existing is not None:
+                self.close_connection = True  # 请求体未读
+                self._send_json(202, dict(existing, duplicate=True))
+                return
             raw = self._read_body()
-            body = raw.decode("utf-8", errors="replace").strip()
+            METRICS.observe("dify_request_body_bytes", len(raw))
+            # 只解码前 200 字节用于日志/错误预览，全文直接按 bytes 解析 JSON
+            preview = bytes(raw[:200]).decode("utf-8", errors="ignore").strip()
             try:
-                dbg = (body[:200] + '...') if len(body) > 200 else body
-                log.info(f"请求体预览: {dbg}")
+                log.info(f"请求体预览（{len(raw)} 字节）: {preview}" + ('...' if len(raw) > 200 else ''))
             except Exception: pass
-            content = None; data = None
-            try: data = json.loads(body)
-            except Exception: data = None
+            content = None
+            data = self._parse_json(raw)
             if isinstance(data, dict):
                 content = data.get("content")
                 if not content:
@@ -485,38 +3509,268 @@ class WebhookHandler(http.server.SimpleHTTPRequestHandler):
                                 content = (inner.get("content") or inner.get("text") or inner.get("final_report_markdown"))
                             else: content = candidate
                         except Exception: content = candidate
-            else: content = body
+            else: content = raw.decode("utf-8", errors="replace").strip()
             if not content or not content.strip():
                 raise ValueError("未找到内容（content/text_input/text），或为空。")
-            result = process_dify_report(content)
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.end_headers()
-            msg = json.dumps(result, ensure_ascii=False).encode("utf-8")
-            self.wfile.write(msg)
+            target = route_target(self.path, content)
+            if target is None:
+                raise ValueError(f"没有与 {self.path} 匹配的发布目标（检查各目标的 webhook / match）")
+            with use_target(target):
+                self._enqueue(target, content, idem_key)
+        except PayloadTooLarge as e:
+            count_outcome("error")
+            log.warning(f"拒绝请求：{e}")
+            self.close_connection = True  # 剩余请求体未读，不能复用连接
+            self._send_json(413, {"error": str(e), "limit": MAX_BODY_BYTES})
+        except UnsupportedEncoding as e:
+            count_outcome("error")
+            self.close_connection = True
+            self._send_json(415, {"error": str(e)})
         except ValueError as e:
-            self.send_response(400)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.end_headers()
-            preview = body[:200] if 'body' in locals() else ""
-            msg = json.dumps({"error": str(e), "preview": preview}, ensure_ascii=False).encode("utf-8")
-            self.wfile.write(msg)
+            count_outcome("error")
+            if 'raw' not in locals():
+                self.close_connection = True  # 请求体读取失败，连接状态不可信
+            preview = preview if 'preview' in locals() else ""
+            self._send_json(400, {"error": str(e), "preview": preview})
         except Exception as e:
-            log.exception("Webhook publish failed")
-            self.send_response(500)
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.end_headers()
-            preview = body[:200] if 'body' in locals() else ""
-            msg = json.dumps({"error": str(e), "preview": preview}, ensure_ascii=False).encode("utf-8")
-            self.wfile.write(msg)
+            count_outcome("error")
+            log.exception("Webhook enqueue failed")
+            preview = preview if 'preview' in locals() else ""
+            self._send_json(500, {"error": str(e), "preview": preview})
 
 class ReusableTCPServer(socketserver.TCPServer):
     allow_reuse_address = True
 
 
-if __name__ == "__main__":
+class ThreadPoolTCPServer(ReusableTCPServer):
+    """
+    有界线程池服务器：请求在 workers 个线程中并行处理（解析/格式化/校验互不阻塞），
+    正在处理 + 等待中的连接超过 workers + max_pending 时，直接回 503 并关闭连接。
+    """
+    _BUSY_BODY = json.dumps({"error": "server busy"}).encode("utf-8")
+
+    def __init__(self, server_address, handler_class, workers: int = HTTP_WORKERS, max_pending: int = HTTP_MAX_PENDING,
+                 bind_and_activate: bool = True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            log.warning(f"连接积压已满，拒绝 {client_address[0]}")
+            try:
+                request.sendall(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Content-Type: application/json; charset=utf-8\r\n"
+                    b"Retry-After: 5\r\n"
+                    b"Connection: close\r\n"
+                    + f"Content-Length: {len(self._BUSY_BODY)}\r\n\r\n".encode("ascii")
+                    + self._BUSY_BODY
+                )
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def drain(self):
+        """等待已接收的请求全部处理完（调用前应先 shutdown() 停止 accept）。"""
+        self._pool.shutdown(wait=True)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
+def make_server(address, listen_socket: Optional[socket.socket] = None):
+    """listen_socket 不为空时直接复用这个已在监听的 socket（由守护进程传入），不再自己 bind。"""
+    bind = listen_socket is None
+    if HTTP_WORKERS > 0:
+        server = ThreadPoolTCPServer(address, WebhookHandler, bind_and_activate=bind)
+    else:
+        server = ReusableTCPServer(address, WebhookHandler, bind_and_activate=bind)
+    if listen_socket is not None:
+        server.socket.close()
+        server.socket = listen_socket
+        server.server_address = listen_socket.getsockname()
+    return server
+
+
+def _log_startup():
     log.info(f"--- Dify Publisher (v16) ---  Using TZ: {TZ_LABEL}")
     log.info(f"Listening: http://127.0.0.1:{PORT}/webhook")
     log.info(f"Set Dify Webhook URL to: http://host.docker.internal:{PORT}/webhook")
-    with ReusableTCPServer(("", PORT), WebhookHandler) as httpd:
+    if RENDER_HTML and _markdown is None:
+        log.warning("未安装 markdown（pip install markdown），不生成预渲染正文 DD.html，前端继续渲染 .md"
+                    "（/metrics 的 dify_render_html_enabled 为 0）。")
+    if PRECOMPRESS and _brotli is None:
+        log.info("未安装 brotli，预压缩只生成 .gz。")
+
+
+def _start_background():
+    for target in TARGETS:
+        target.start()
+
+
+def serve():
+    _log_startup()
+    init_targets()
+    _start_background()
+    with make_server(("", PORT)) as httpd:
         httpd.serve_forever()
+
+
+# ===== 平滑重启：与 dify_publisher_service.pyw 的交接协议 =====
+# 守护进程自己监听 PORT 并一直持有该 socket，工作进程以 `serve --handoff` 启动：
+#   1. 导入完成后在 stdout 输出 ready，作为热备进程等待（不接请求、不碰发布队列和仓库）
+#   2. 收到 stdin 上的 {"cmd": "socket", ...} 后接管监听 socket，恢复并启动发布队列，开始服务
+#   3. 收到 {"cmd": "drain"}（或 stdin 被关闭）时停止 accept，等在途请求和发布队列处理完后输出 drained 退出
+# 交接间隙到达的连接停在内核 listen 队列里，由下一个进程 accept，端口始终不会拒绝连接。
+HANDOFF_PREFIX = "@@dify "  # stdout 上协议消息的前缀，其余输出（异常堆栈等）由守护进程原样记日志
+
+
+def _handoff_emit(out, event: str, **fields):
+    out.write(HANDOFF_PREFIX + json.dumps(dict(fields, event=event), ensure_ascii=False) + "\n")
+    out.flush()
+
+
+def _handoff_commands():
+    """逐行读取守护进程发来的 JSON 命令；stdin 关闭（守护进程已退出）时按 drain 处理。"""
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            log.warning(f"忽略无法解析的交接命令：{line[:200]}")
+    yield {"cmd": "drain", "reason": "stdin closed"}
+
+
+def _adopt_socket(cmd: dict) -> socket.socket:
+    if "share" in cmd:
+        # Windows：守护进程用 socket.share(pid) 导出的句柄
+        return socket.fromshare(base64.b64decode(cmd["share"]))
+    # POSIX：通过 pass_fds 继承的文件描述符
+    return socket.socket(fileno=int(cmd["fd"]))
+
+
+def serve_handoff():
+    out = sys.stdout
+    # stdout 留给交接协议：去掉控制台日志，print / 访问日志与 pythonw 下一样改写进日志
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if type(handler) is logging.StreamHandler:
+            root.removeHandler(handler)
+    sys.stdout = _LogWriter(log, logging.INFO)
+    sys.stderr = _LogWriter(log, logging.ERROR)
+
+    # 先载入发布目标：配置有误时热备进程直接退出，守护进程保留旧进程继续服务
+    init_targets()
+    commands = _handoff_commands()
+    _handoff_emit(out, "ready", pid=os.getpid(), port=PORT)
+    cmd = next(commands)
+    if cmd.get("cmd") != "socket":
+        log.info(f"热备进程 {os.getpid()} 未被启用，退出。")
+        return
+    listen_socket = _adopt_socket(cmd)
+    _log_startup()
+    log.info(f"进程 {os.getpid()} 接管守护进程的监听 socket。")
+    _start_background()
+    httpd = make_server(("", PORT), listen_socket)
+    reason = []
+
+    def watch():
+        for cmd in commands:
+            if cmd.get("cmd") == "drain":
+                reason.append(cmd.get("reason") or "drain")
+                httpd.shutdown()
+                return
+
+    threading.Thread(target=watch, name="handoff", daemon=True).start()
+    _handoff_emit(out, "serving", pid=os.getpid())
+    httpd.serve_forever()
+
+    # 已停止 accept：依次等待在途请求 → 发布队列（含批量提交）
+    start = time.monotonic()
+    log.info(f"平滑退出（{reason[0] if reason else 'shutdown'}）：停止接收新连接，等待在途请求与发布任务完成…")
+    if isinstance(httpd, ThreadPoolTCPServer):
+        httpd.drain()
+    deadline = start + DRAIN_TIMEOUT
+    complete = True
+    for target in TARGETS:
+        if not target.queue.drain(timeout=max(0.0, deadline - time.monotonic())):
+            complete = False
+            log.warning(f"等待发布队列超过 {DRAIN_TIMEOUT} 秒，剩余任务留在 {target.queue.queue_dir}，由下一个进程重放。")
+    for target in TARGETS:
+        with target.lock:
+            target.close_store()
+    httpd.server_close()
+    elapsed = time.monotonic() - start
+    log.info(f"平滑退出完成（{elapsed:.2f}s）。")
+    _handoff_emit(out, "drained", pid=os.getpid(), seconds=round(elapsed, 3), complete=complete)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dify 日报发布服务")
+    parser.add_argument("--log-format", choices=("text", "json"), default=LOG_FORMAT, help="日志格式（默认取 LOG_FORMAT）")
+    parser.add_argument("--target", action="append", metavar="NAME",
+                        help="重建类子命令只处理指定的发布目标（可重复；默认全部，见 TARGETS_CONFIG）")
+    sub = parser.add_subparsers(dest="command")
+    p_serve = sub.add_parser("serve", help="启动 Webhook 服务（默认）")
+    p_serve.add_argument("--handoff", action="store_true",
+                         help="由 dify_publisher_service.pyw 启动：从守护进程接管监听 socket，支持平滑重启")
+    p_reindex = sub.add_parser("reindex", help="批量重新规范化归档并从零重建 manifest，最后一次性提交")
+    p_reindex.add_argument("--dry-run", action="store_true", help="只输出将要改动的文件与分片，不写盘、不提交")
+    p_reindex.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    p_reindex.add_argument("--no-commit", action="store_true", help="写盘但不提交/推送")
+    p_search = sub.add_parser("search-index", help="从归档全量重建全文检索分片 search/<分类>/<YYYY-MM>.json")
+    p_search.add_argument("--dry-run", action="store_true", help="只输出将要改动的分片，不写盘、不提交")
+    p_search.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    p_search.add_argument("--no-commit", action="store_true", help="写盘但不提交/推送")
+    p_html = sub.add_parser("render-html", help="为归档补齐/刷新预渲染正文 DD.html（源文未变的跳过）")
+    p_html.add_argument("--dry-run", action="store_true", help="只输出将要改动的文件，不写盘、不提交")
+    p_html.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    p_html.add_argument("--no-commit", action="store_true", help="写盘但不提交/推送")
+    p_html.add_argument("--force", action="store_true", help="忽略缓存，全部重新渲染")
+    p_feeds = sub.add_parser("feeds", help="从归档重建订阅源 feed.json / feed.xml / atom.xml（各分类及全站合并）")
+    p_feeds.add_argument("--dry-run", action="store_true", help="只输出将要改动的订阅源，不写盘、不提交")
+    p_feeds.add_argument("--no-commit", action="store_true", help="写盘但不提交/推送")
+    args = parser.parse_args(argv)
+    configure_log_format(args.log_format)
+
+    if args.command in ("reindex", "search-index", "feeds", "render-html"):
+        targets = init_targets()
+        if args.target:
+            unknown = sorted(set(args.target) - {t.name for t in targets})
+            if unknown:
+                parser.error(f"未知的发布目标：{', '.join(unknown)}")
+            targets = [t for t in targets if t.name in args.target]
+        for target in targets:
+            with use_target(target):
+                if args.command == "reindex":
+                    reindex_archive(dry_run=args.dry_run, workers=args.workers, commit=not args.no_commit)
+                elif args.command == "search-index":
+                    rebuild_search_index(dry_run=args.dry_run, workers=args.workers, commit=not args.no_commit)
+                elif args.command == "feeds":
+                    rebuild_feeds(dry_run=args.dry_run, commit=not args.no_commit)
+                else:
+                    rebuild_report_html(dry_run=args.dry_run, workers=args.workers, commit=not args.no_commit,
+                                        force=args.force)
+    elif getattr(args, "handoff", False):
+        serve_handoff()
+    else:
+        serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+# dify_publisher_bench.py
+# dify_publisher.py 的基准与压测：合成日报生成器 + 纯函数微基准 + /webhook 并发压测（临时仓库 + 本地 bare 远端）
+# 用法：python dify_publisher_bench.py micro [--sizes 1000,10000,100000]
+#       python dify_publisher_bench.py load  [--requests 200 --concurrency 8 --envelope mixed --set GIT_BATCH_WINDOW=0]
+#       python dify_publisher_bench.py all   [--out 结果.json --compare 上次结果.json]
+# 结果（吞吐 + p50/p95/p99 延迟，单位毫秒）写入 JSON（默认 .bench/<时间戳>.json），--compare 与上次结果逐项对比
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(SCRIPT_DIR, ".bench")
+sys.path.insert(0, SCRIPT_DIR)
+
+# 报告规模：(H2 小节数, 每节要点数)。medium 接近线上日报（~20 KB），large 用于观察最坏情况
+REPORT_SIZES = {"small": (2, 3), "medium": (8, 5), "large": (60, 6)}
+CATEGORY_HEADS = {"ai": "🤖 AI行业速递", "game": "🎮 游戏行业速递"}
+
+_PHRASES = (
+    "大模型", "推理成本", "开源社区", "多模态", "智能体", "端侧部署", "算力集群", "训练数据", "产品发布", "商业化",
+    "用户增长", "买量成本", "版号审批", "海外发行", "二次元", "开放世界", "长线运营", "付费转化", "引擎升级", "云游戏",
+    "行业格局", "技术路线", "融资消息", "监管政策", "生态合作", "开发者工具", "代码生成", "评测基准", "上下文窗口", "安全对齐",
+)
+_CONNECTORS = ("正在重塑", "带动了", "意味着", "加速了", "限制了", "推动", "取决于", "改变了", "催生了", "考验着")
+_WORDS = ("GPT-5", "Llama", "Unity", "Unreal", "API", "SDK", "GPU", "token", "benchmark", "agent", "Steam", "RAG")
+_CATEGORIES = ("技术前沿解读", "产品与商业模式", "行业动态", "市场数据", "政策监管")
+_SOURCES = ("机器之心", "量子位", "赛博禅心", "游戏葡萄", "GameLook", "36氪")
+_CODE = ('```python\nfrom openai import OpenAI\nclient = OpenAI()\nresp = client.responses.create(model="gpt-5", input="hi")\n'
+         'print(resp.output_text)\n```', '```bash\nnpm i -g @openai/codex\ncodex --help\n```',
+         '```json\n{"model": "gpt-5", "reasoning": {"effort": "high"}, "max_tokens": 4096}\n```')
+
+
+# ===== 合成日报 =====
+def _sentence(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(2, 4)):
+        part = f"{rng.choice(_PHRASES)}{rng.choice(_CONNECTORS)}{rng.choice(_PHRASES)}"
+        if rng.random() < 0.4:
+            part += f"（{rng.choice(_WORDS)} {rng.randint(2, 99)}.{rng.randint(0, 9)}%）"
+        parts.append(part)
+    return "，".join(parts) + "。"
+
+
+def make_report(day: date, category: str = "ai", size: str = "medium", seed: int = 0, messy: bool = False) -> str:
+    """生成一篇结构与线上一致的日报：H1 日期标题、H2 小节、分类/来源引用、核心洞察、要点列表、偶尔的代码块。"""
+    rng = random.Random(f"{day}-{category}-{size}-{seed}")
+    sections, bullets = REPORT_SIZES[size]
+    gap = "" if messy else "\n"  # messy=True 去掉块之间的空行，让 format_markdown_spacing 有活干
+    out = [f"# {CATEGORY_HEADS[category]} - {day.year}年{day.month:02d}月{day.day:02d}日\n"]
+    for i in range(sections):
+        sources = " 、 ".join(f"[{rng.choice(_SOURCES)}](https://mp.weixin.qq.com/s/{rng.getrandbits(64):016x})"
+                              for _ in range(rng.randint(1, 3)))
+        out += [
+            f"## {rng.choice(_PHRASES)}：{_sentence(rng)[:-1]}\n{gap}",
+            f"> **分类：** {rng.choice(_CATEGORIES)}",
+            f"> **来源：** {sources}\n{gap}",
+            f"**核心洞察：** {''.join(_sentence(rng) for _ in range(rng.randint(3, 6)))}",
+            f"**内容简介：**\n{gap}",
+        ]
+        out += [f"- {rng.choice(_PHRASES)}：{_sentence(rng)}" for _ in range(bullets)]
+        if rng.random() < 0.2:
+            out.append(f"{gap}{rng.choice(_CODE)}")
+        out.append(f"{gap}---\n" if i < sections - 1 else "")
+    return "\n".join(out)
+
+
+def make_payload(md: str, envelope: str) -> bytes:
+    """WebhookHandler.do_POST 接受的两种 JSON 包装：{"content": md} 与 Dify 的 {"text_input": "<JSON 字符串>"}。"""
+    if envelope == "text_input":
+        data = {"text_input": json.dumps({"content": md}, ensure_ascii=False)}
+    else:
+        data = {"content": md}
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+# ===== 统计 =====
+def summarize(samples: list, wall: Optional[float] = None) -> dict:
+    """样本单位为秒；百分位取 nearest-rank。wall 为整体耗时（并发场景），缺省时按样本总和计算吞吐。"""
+    if not samples:
+        return {"n": 0}
+    xs = sorted(samples)
+
+    def pct(p):
+        return round(xs[max(0, math.ceil(p / 100 * len(xs)) - 1)] * 1000, 3)
+
+    total = wall if wall is not None else sum(xs)
+    return {
+        "n": len(xs),
+        "ops_per_sec": round(len(xs) / total, 2) if total > 0 else None,
+        "mean_ms": round(sum(xs) / len(xs) * 1000, 3),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": round(xs[-1] * 1000, 3),
+    }
+
+
+def bench(fn, min_time: float = 0.5, max_repeat: int = 2000, min_repeat: int = 5) -> dict:
+    """反复调用 fn 直到累计 min_time 秒（至少 min_repeat 次、至多 max_repeat 次），返回单次耗时分布。"""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_repeat:
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+        if len(samples) >= min_repeat and time.perf_counter() - started >= min_time:
+            break
+    return summarize(samples)
+
+
+# ===== 微基准 =====
+def synthetic_manifest(n: int, categories=("ai", "game")) -> dict:
+    """n 条归档条目，均分到各分类，从 1900-01-01 起逐日排列（100k 条约覆盖 137 年）。"""
+    months = {c: {} for c in categories}
+    start = date(1900, 1, 1)
+    for i in range(n):
+        cat = categories[i % len(categories)]
+        d = start + timedelta(days=i // len(categories))
+        months[cat].setdefault(f"{d.year:04d}-{d.month:02d}", []).insert(0, {
+            "date": d.isoformat(), "title": f"{CATEGORY_HEADS[cat]} - {d.year}年{d.month:02d}月{d.day:02d}日",
+            "summary": "合成摘要" * 10, "tags": [cat.capitalize(), "Daily"], "url": f"{cat}/{d:%Y/%m/%d}.md",
+        })
+    return {"site": {"title": "bench", "description": "", "baseUrl": ""},
+            "categories": {c: c for c in categories}, "months": months}
+
+
+def run_micro(sizes, min_time: float) -> dict:
+    import dify_publisher as dp
+    dp.log.setLevel(logging.WARNING)
+    results = {"format_markdown_spacing": {}, "analyze_report": {}, "extract_title_summary": {},
+               "parse_date_any": {}, "upsert_manifest": {}, "manifest_dumps": {}, "update_sharded_manifest": {}}
+    day = date(2026, 3, 5)
+    for size in REPORT_SIZES:
+        messy = make_report(day, "ai", size, messy=True)
+        md = dp.format_markdown_spacing(messy)
+        label = f"{size} ({len(md.encode('utf-8')) // 1024} KiB)"
+        print(f"  报告 {label} ...", file=sys.stderr)
+        results["format_markdown_spacing"][label] = bench(lambda: dp.format_markdown_spacing(messy), min_time)
+        results["analyze_report"][label] = bench(lambda: dp.analyze_report(md), min_time)
+        results["extract_title_summary"][label] = bench(lambda: dp.extract_title_summary(md), min_time)
+        results["parse_date_any"][label] = bench(lambda: dp.parse_date_any(md), min_time)
+
+    for n in sizes:
+        print(f"  manifest {n} 条 ...", file=sys.stderr)
+        manifest = synthetic_manifest(n)
+        last = date(1900, 1, 1) + timedelta(days=(n - 1) // 2)
+        counter = iter(range(10 ** 9))
+
+        def upsert():
+            # 交替：替换最新一天的条目 / 追加一个新日期
+            i = next(counter)
+            d = last if i % 2 == 0 else last + timedelta(days=1 + i // 2)
+            dp.upsert_manifest(manifest, "ai", f"{d.year:04d}", f"{d.month:02d}", f"{d.day:02d}", "标题", "摘要")
+
+        results["upsert_manifest"][str(n)] = bench(upsert, min_time)
+        results["manifest_dumps"][str(n)] = bench(lambda: json.dumps(manifest, ensure_ascii=False, indent=2), min_time,
+                                                  max_repeat=50, min_repeat=3)
+        results["update_sharded_manifest"][str(n)] = _bench_sharded(dp, manifest, last, min_time)
+    return results
+
+
+def _bench_sharded(dp, manifest: dict, last: date, min_time: float) -> dict:
+    """分片 manifest 的真实发布路径（含落盘）：先由整份 manifest.json 迁移出分片，再计时单篇更新。"""
+    saved = (dp.GITHUB_REPO_PATH, os.getcwd())
+    tmp = tempfile.mkdtemp(prefix="dify-bench-manifest-")
+    try:
+        dp.GITHUB_REPO_PATH = tmp
+        os.chdir(tmp)
+        dp.MANIFEST_CACHE.invalidate()
+        dp.write_site_file("manifest.json", json.dumps(manifest, ensure_ascii=False))
+        d = last
+        dp.update_sharded_manifest("ai", f"{d.year:04d}", f"{d.month:02d}", f"{d.day:02d}", "标题", "摘要")
+        return bench(lambda: dp.update_sharded_manifest("ai", f"{d.year:04d}", f"{d.month:02d}", f"{d.day:02d}",
+                                                        "标题", "摘要"), min_time)
+    finally:
+        dp.MANIFEST_CACHE.invalidate()
+        dp.GITHUB_REPO_PATH = saved[0]
+        os.chdir(saved[1])
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ===== 压测：临时仓库 + 子进程服务 =====
+def _git(args, cwd):
+    return subprocess.run(["git"] + args, cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def setup_repos(root: str, plumbing: bool) -> dict:
+    """root/remote.git（bare 远端）+ root/work（发布用检出）；plumbing 后端改用 root/publish.git（bare 克隆）。"""
+    remote = os.path.join(root, "remote.git")
+    work = os.path.join(root, "work")
+    _git(["init", "-q", "--bare", "-b", "main", remote], root)
+    _git(["clone", "-q", remote, work], root)
+    for cwd in (work,):
+        _git(["config", "user.name", "bench"], cwd)
+        _git(["config", "user.email", "bench@localhost"], cwd)
+    _git(["checkout", "-q", "-B", "main"], work)
+    with open(os.path.join(work, "README.md"), "w", encoding="utf-8") as f:
+        f.write("# bench\n")
+    _git(["add", "README.md"], work)
+    _git(["commit", "-q", "-m", "init"], work)
+    _git(["push", "-q", "origin", "main"], work)
+    repo = work
+    if plumbing:
+        repo = os.path.join(root, "publish.git")
+        _git(["clone", "-q", "--bare", remote, repo], root)
+        _git(["config", "user.name", "bench"], repo)
+        _git(["config", "user.email", "bench@localhost"], repo)
+    return {"remote": remote, "repo": repo}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _http(method: str, url: str, body: Optional[bytes] = None, timeout: float = 60):
+    req = urllib.request.Request(url, data=body, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def _parse_value(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _serve_child(config_path: str):
+    """压测子进程：改写 dify_publisher 的配置后启动 serve()。日志写到临时目录，不碰 dify_publisher_app.log。"""
+    with open(config_path, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    import dify_publisher as dp
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.FileHandler(cfg["log"], encoding="utf-8"))
+    # 不读取真实的多站点配置：serve() 按改写后的全局配置建出单个 default 目标
+    dp.TARGETS_CONFIG = None
+    for key, value in cfg["settings"].items():
+        setattr(dp, key, value)
+    dp.serve()
+
+
+def _stage_breakdown(metrics_text: str) -> dict:
+    """从 /metrics 中取出各发布阶段的次数与平均耗时。"""
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        if not line.startswith("dify_publish_stage_seconds_"):
+            continue
+        name, _, value = line.rpartition(" ")
+        stage = name.split('stage="', 1)[-1].split('"', 1)[0]
+        if name.startswith("dify_publish_stage_seconds_sum"):
+            sums[stage] = float(value)
+        elif name.startswith("dify_publish_stage_seconds_count"):
+            counts[stage] = int(float(value))
+    return {s: {"count": counts[s], "mean_ms": round(sums.get(s, 0) / counts[s] * 1000, 3)}
+            for s in sorted(counts) if counts[s]}
+
+
+def run_load(requests: int, concurrency: int, envelope: str, size: str, settings: dict,
+             keep: bool = False, timeout: float = 600) -> dict:
+    root = tempfile.mkdtemp(prefix="dify-bench-")
+    proc = None
+    try:
+        repos = setup_repos(root, settings.get("GIT_BACKEND") == "plumbing")
+        port = _free_port()
+        server_settings = {
+            "GITHUB_REPO_PATH": repos["repo"],
+            "PORT": port,
+            "QUEUE_DIR": os.path.join(root, "queue"),
+            "HASH_INDEX_PATH": os.path.join(root, "hashes.json"),
+        }
+        server_settings.update(settings)
+        cfg_path = os.path.join(root, "bench-config.json")
+        with open(cfg_path, "w", encoding="utf-8") as f:
+            json.dump({"log": os.path.join(root, "server.log"), "settings": server_settings}, f, ensure_ascii=False)
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "_serve", cfg_path], cwd=root,
+                                stdout=subprocess.DEVNULL, stderr=open(os.path.join(root, "server.err"), "wb"))
+        base = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if _http("GET", base + "/metrics", timeout=2)[0] == 200:
+                    break
+            except OSError:
+                pass
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"压测服务未能启动，见 {root}/server.err")
+            time.sleep(0.1)
+
+        # 每个请求一篇不同日期的报告（两个分类交替），避免被内容哈希短路
+        first = date(2025, 12, 31)
+        payloads = []
+        for i in range(requests):
+            cat = ("ai", "game")[i % 2]
+            env = envelope if envelope != "mixed" else ("content", "text_input")[(i // 2) % 2]
+            payloads.append(make_payload(make_report(first - timedelta(days=i // 2), cat, size, seed=i), env))
+
+        def one(body: bytes):
+            t0 = time.perf_counter()
+            status, raw = _http("POST", base + "/webhook", body)
+            accepted = time.perf_counter() - t0
+            outcome = f"http_{status}"
+            if status == 202:
+                job_id = json.loads(raw)["job_id"]
+                while True:
+                    job = json.loads(_http("GET", f"{base}/jobs/{job_id}")[1])
+                    if job.get("status") in ("done", "failed"):
+                        outcome = job["status"]
+                        break
+                    if time.perf_counter() - t0 > timeout:
+                        outcome = "timeout"
+                        break
+                    time.sleep(0.02)
+            return accepted, time.perf_counter() - t0, outcome
+
+        print(f"  压测：{requests} 个请求，并发 {concurrency} ...", file=sys.stderr)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            rows = list(pool.map(one, payloads))
+        wall = time.perf_counter() - started
+
+        # 等后台推送把本地提交全部推到远端
+        push_started = time.perf_counter()
+        while time.perf_counter() - push_started < timeout:
+            status = json.loads(_http("GET", base + "/push/status")[1])
+            if not status.get("background") or not status.get("ahead"):
+                break
+            time.sleep(0.1)
+        push_settle = time.perf_counter() - push_started
+        stages = _stage_breakdown(_http("GET", base + "/metrics")[1].decode("utf-8"))
+
+        outcomes = {}
+        for _, _, outcome in rows:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        published = [total for _, total, outcome in rows if outcome == "done"]
+        tree = _git(["ls-tree", "-r", "--name-only", "main"], repos["remote"]).splitlines()
+        return {
+            "requests": requests,
+            "concurrency": concurrency,
+            "envelope": envelope,
+            "size": size,
+            "payload_bytes": sum(len(p) for p in payloads) // max(1, len(payloads)),
+            "settings": settings,
+            "wall_seconds": round(wall, 3),
+            "throughput_rps": round(len(published) / wall, 2) if wall > 0 else None,
+            "accept": summarize([accepted for accepted, _, _ in rows], wall),
+            "publish": summarize(published, wall),
+            "outcomes": outcomes,
+            "push_settle_seconds": round(push_settle, 3),
+            "remote_commits": int(_git(["rev-list", "--count", "main"], repos["remote"])),
+            "remote_reports": sum(1 for p in tree if p.startswith("public/") and p.endswith(".md")),
+            "server_stages": stages,
+        }
+    finally:
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if keep:
+            print(f"  临时目录保留在 {root}", file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+# ===== 结果输出 / 对比 =====
+def _environment() -> dict:
+    def cmd(args):
+        try:
+            return subprocess.run(args, cwd=SCRIPT_DIR, capture_output=True, text=True, timeout=10).stdout.strip()
+        except Exception:
+            return None
+    return {
+        "timestamp": datetime.now().astimezone().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "git": cmd(["git", "--version"]),
+        "commit": cmd(["git", "rev-parse", "--short", "HEAD"]),
+    }
+
+
+def _flatten(data, prefix=""):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from _flatten(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, data
+
+
+def compare(old: dict, new: dict) -> list:
+    """逐项对比延迟百分位与吞吐，返回 (指标, 旧值, 新值, 变化%)。延迟越低越好，吞吐越高越好。"""
+    old_flat = dict(_flatten({k: old.get(k) for k in ("micro", "load")}))
+    rows = []
+    for key, value in _flatten({k: new.get(k) for k in ("micro", "load")}):
+        if not key.endswith(("p50_ms", "p95_ms", "p99_ms", "ops_per_sec", "throughput_rps")):
+            continue
+        before = old_flat.get(key)
+        if before:
+            rows.append((key, before, value, round((value - before) / before * 100, 1)))
+    return rows
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["_serve"]:
+        _serve_child(argv[1])
+        return
+    parser = argparse.ArgumentParser(description="dify_publisher 基准与压测")
+    parser.add_argument("mode", choices=("micro", "load", "all"))
+    parser.add_argument("--sizes", default="1000,10000,100000", help="upsert_manifest 的归档条目规模（逗号分隔）")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每项微基准的最短累计耗时（秒）")
+    parser.add_argument("--requests", type=int, default=200, help="压测请求数")
+    parser.add_argument("--concurrency", type=int, default=8, help="压测并发数")
+    parser.add_argument("--envelope", choices=("content", "text_input", "mixed"), default="mixed",
+                        help="请求体包装：{content} / Dify 的 {text_input: JSON 字符串} / 交替")
+    parser.add_argument("--size", choices=tuple(REPORT_SIZES), default="medium", help="压测报告规模")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="覆盖服务端配置，如 GIT_BACKEND=plumbing、GIT_BATCH_WINDOW=0（值按 JSON 解析）")
+    parser.add_argument("--keep", action="store_true", help="保留压测临时仓库与服务日志")
+    parser.add_argument("--out", default=None, help="结果 JSON 路径（默认 .bench/<时间戳>.json）")
+    parser.add_argument("--compare", default=None, help="与之前的结果 JSON 对比")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    for item in args.set:
+        key, sep, value = item.partition("=")
+        if not sep:
+            parser.error(f"--set 需要 KEY=VALUE：{item}")
+        settings[key.strip()] = _parse_value(value)
+
+    result = {"environment": _environment()}
+    if args.mode in ("micro", "all"):
+        print("微基准 ...", file=sys.stderr)
+        result["micro"] = run_micro([int(n) for n in args.sizes.split(",") if n.strip()], args.min_time)
+    if args.mode in ("load", "all"):
+        print("压测 ...", file=sys.stderr)
+        result["load"] = run_load(args.requests, args.concurrency, args.envelope, args.size, settings, keep=args.keep)
+
+    out = args.out or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"结果已写入 {out}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"\n对比 {args.compare}（延迟为负、吞吐为正表示变好）：", file=sys.stderr)
+        for key, before, after, delta in compare(old, result):
+            print(f"  {key:<70} {before:>12} → {after:<12} {delta:+.1f}%", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
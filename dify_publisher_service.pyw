@@ -1,18 +1,38 @@
 # dify_publisher_service.pyw
 # 守护进程：后台无窗口运行 dify_publisher.py，崩溃自动重启
 # 用法：pythonw dify_publisher_service.pyw  （无黑框）
-#       python  dify_publisher_service.pyw  （有终端，调试用）
+#       python  dify_publisher_service.pyw  （有终端，调试用；可输入 reload / status / stop）
+#
+# 平滑重启（HANDOFF = True）：
+#   - 守护进程自己监听 PORT 并始终持有这个 socket，工作进程（dify_publisher.py serve --handoff）只是借用
+#   - 始终预热一个热备进程（已完成导入，等待接管）；工作进程崩溃时立刻由热备接管，端口不中断
+#   - dify_publisher.py / dify_targets.json 被修改或输入 reload 时：先用新代码启动热备，再让当前进程停止 accept、
+#     处理完在途请求与发布队列后退出，随后热备接管；新代码/配置启动失败则保留旧进程继续服务
+#   - 交接间隙到达的连接停在 listen 队列中，由新进程 accept，不会出现 connection refused
 
+import base64
+import json
+import queue
+import socket
 import subprocess
 import sys
 import os
+import threading
 import time
 import datetime
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 TARGET = os.path.join(SCRIPT_DIR, "dify_publisher.py")
+WATCH_FILES = [TARGET, os.path.join(SCRIPT_DIR, "dify_targets.json")]  # 任一文件变化即平滑重启
 LOG_FILE = os.path.join(SCRIPT_DIR, "dify_publisher.log")
-RESTART_DELAY = 5  # 崩溃后重启等待秒数
+RESTART_DELAY = 5  # 崩溃后重启等待秒数（平滑重启模式下只在崩溃循环时退避）
+HANDOFF = True  # True: 守护进程持有监听 socket 并交接给热备进程；False: 旧模式，退出后等待重启
+LISTEN_BACKLOG = 128  # 交接间隙内可在内核排队的连接数
+READY_TIMEOUT = 120  # 等待新进程完成导入 / 接管 socket 的最长秒数
+DRAIN_TIMEOUT = 330  # 等待旧进程平滑退出的最长秒数（略大于 dify_publisher.DRAIN_TIMEOUT），超时强制结束
+MIN_UPTIME = 10  # 接管后运行不足该秒数就退出视为崩溃循环，按 RESTART_DELAY 退避
+WATCH_INTERVAL = 2  # 检查 WATCH_FILES 是否被修改的间隔（秒）
+HANDOFF_PREFIX = "@@dify "  # 与 dify_publisher.HANDOFF_PREFIX 一致
 
 
 def log(msg: str):
@@ -25,11 +45,252 @@ def log(msg: str):
         pass
 
 
-def main():
-    log("=== DifyPublisher 守护进程启动 ===")
-    log(f"目标脚本: {TARGET}")
-    log(f"Python: {sys.executable}")
+def watch_mtimes() -> tuple:
+    mtimes = []
+    for path in WATCH_FILES:
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except OSError:
+            mtimes.append(0.0)
+    return tuple(mtimes)
+
+
+class Worker:
+    """一个 `dify_publisher.py serve --handoff` 子进程：stdin 发命令，stdout 收 ready / serving / drained。"""
+
+    def __init__(self, listen_socket=None):
+        kwargs = {}
+        if os.name != "nt" and listen_socket is not None:
+            # POSIX 只能在启动时继承 fd；Windows 在接管时用 socket.share(pid) 传递
+            kwargs["pass_fds"] = (listen_socket.fileno(),)
+        self.proc = subprocess.Popen(
+            [sys.executable, TARGET, "serve", "--handoff"],
+            cwd=SCRIPT_DIR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            **kwargs,
+        )
+        self.pid = self.proc.pid
+        self.info = {}
+        self.ready = threading.Event()
+        self.serving = threading.Event()
+        self.activated_at = None
+        threading.Thread(target=self._read, name=f"worker-{self.pid}", daemon=True).start()
+
+    def _read(self):
+        for raw in self.proc.stdout:
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            if not line.startswith(HANDOFF_PREFIX):
+                if line:
+                    log(f"[{self.pid}] {line}")
+                continue
+            try:
+                msg = json.loads(line[len(HANDOFF_PREFIX):])
+            except ValueError:
+                continue
+            event = msg.get("event")
+            if event == "ready":
+                self.info = msg
+                self.ready.set()
+            elif event == "serving":
+                self.serving.set()
+            elif event == "drained":
+                state = "全部完成" if msg.get("complete") else "发布队列未清空，剩余任务由新进程重放"
+                log(f"进程 {self.pid} 已平滑退出：{msg.get('seconds')}s，{state}")
+
+    def send(self, **cmd) -> bool:
+        try:
+            self.proc.stdin.write((json.dumps(cmd) + "\n").encode("utf-8"))
+            self.proc.stdin.flush()
+            return True
+        except OSError:
+            return False
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def wait_for(self, event: threading.Event, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while not event.wait(0.2):
+            if not self.alive() or time.monotonic() > deadline:
+                return event.is_set()
+        return True
+
+    def hand_socket(self, listen_socket) -> bool:
+        if os.name == "nt":
+            data = listen_socket.share(self.pid)
+            sent = self.send(cmd="socket", share=base64.b64encode(data).decode("ascii"))
+        else:
+            sent = self.send(cmd="socket", fd=listen_socket.fileno())
+        if not sent or not self.wait_for(self.serving, READY_TIMEOUT):
+            return False
+        self.activated_at = time.monotonic()
+        return True
+
+    def drain(self, reason: str) -> bool:
+        """让进程停止 accept 并处理完手上的工作后退出；超时强制结束，返回是否平滑退出。"""
+        self.send(cmd="drain", reason=reason)
+        try:
+            self.proc.wait(timeout=DRAIN_TIMEOUT)
+            return True
+        except subprocess.TimeoutExpired:
+            log(f"进程 {self.pid} 超过 {DRAIN_TIMEOUT} 秒未退出，强制结束。")
+            self.proc.kill()
+            self.proc.wait()
+            return False
+
+    def stop(self):
+        # 未接管的热备：关闭 stdin 即退出
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
 
+class Supervisor:
+    def __init__(self):
+        self.listen_socket = None
+        self.port = None
+        self.active = None
+        self.standby = None
+        self.mtimes = watch_mtimes()
+        self.commands = queue.Queue()
+
+    def spawn(self):
+        """启动一个热备进程并等它完成导入；失败返回 None。"""
+        worker = Worker(self.listen_socket)
+        if worker.wait_for(worker.ready, READY_TIMEOUT):
+            return worker
+        log(f"热备进程 {worker.pid} 未能就绪（返回码 {worker.proc.poll()}），{RESTART_DELAY} 秒后重试")
+        if worker.alive():
+            worker.proc.kill()
+        worker.proc.wait()
+        time.sleep(RESTART_DELAY)
+        return None
+
+    def listen(self):
+        worker = None
+        while worker is None:
+            worker = self.spawn()
+        self.port = int(worker.info["port"])
+        while self.listen_socket is None:
+            try:
+                self.listen_socket = socket.create_server(("", self.port), backlog=LISTEN_BACKLOG)
+            except OSError as e:
+                log(f"监听端口 {self.port} 失败: {e}，{RESTART_DELAY} 秒后重试...")
+                time.sleep(RESTART_DELAY)
+        log(f"守护进程监听端口 {self.port}")
+        if os.name != "nt":
+            # POSIX：第一个进程启动时 socket 还不存在，换一个继承了 fd 的
+            worker.stop()
+            worker = None
+            while worker is None:
+                worker = self.spawn()
+        self.standby = worker
+
+    def activate(self) -> bool:
+        worker, self.standby = self.standby, None
+        if worker is None:
+            return False
+        if int(worker.info.get("port", self.port)) != self.port:
+            log(f"警告：PORT 已改为 {worker.info.get('port')}，仍沿用 {self.port}；改端口需重启守护进程")
+        if not worker.hand_socket(self.listen_socket):
+            log(f"进程 {worker.pid} 接管 socket 失败（返回码 {worker.proc.poll()}）")
+            if worker.alive():
+                worker.proc.kill()
+            return False
+        self.active = worker
+        log(f"进程 {worker.pid} 开始服务")
+        return True
+
+    def failover(self):
+        old, self.active = self.active, None
+        if old is not None:
+            uptime = time.monotonic() - (old.activated_at or time.monotonic())
+            log(f"dify_publisher.py 退出，返回码: {old.proc.poll()}（运行 {uptime:.0f} 秒）")
+            if uptime < MIN_UPTIME:
+                log(f"疑似崩溃循环，等待 {RESTART_DELAY} 秒后切换...")
+                time.sleep(RESTART_DELAY)
+        if self.standby is None or not self.standby.alive():
+            self.standby = self.spawn()
+        self.activate()
+
+    def reload(self, reason: str):
+        log(f"平滑重启（{reason}）：启动新进程...")
+        fresh = self.spawn()
+        if fresh is None:
+            log("新代码/配置未能启动，保留当前进程继续服务。")
+            return
+        if self.standby is not None:
+            self.standby.stop()  # 旧代码的热备
+        self.standby = fresh
+        if self.active is not None and self.active.alive():
+            log(f"通知进程 {self.active.pid} 停止接收并处理完在途任务...")
+            self.active.drain(reason)
+        self.active = None
+        self.activate()
+
+    def read_console(self):
+        # 仅 python.exe 运行时有控制台；pythonw 下 sys.stdin 为 None
+        if sys.stdin is None:
+            return
+        for line in sys.stdin:
+            if line.strip():
+                self.commands.put(line.strip().lower())
+
+    def status(self):
+        active = f"{self.active.pid}" if self.active is not None else "无"
+        standby = f"{self.standby.pid}" if self.standby is not None else "无"
+        log(f"状态：端口 {self.port}，服务进程 {active}，热备进程 {standby}")
+
+    def shutdown(self):
+        log("守护进程退出：等待服务进程处理完在途任务...")
+        if self.standby is not None:
+            self.standby.stop()
+        if self.active is not None and self.active.alive():
+            self.active.drain("supervisor exit")
+        if self.listen_socket is not None:
+            self.listen_socket.close()
+
+    def run(self):
+        self.listen()
+        self.activate()
+        threading.Thread(target=self.read_console, name="console", daemon=True).start()
+        last_check = time.monotonic()
+        while True:
+            if self.active is None or not self.active.alive():
+                self.failover()
+                continue
+            if self.standby is None or not self.standby.alive():
+                self.standby = self.spawn()
+            try:
+                command = self.commands.get(timeout=0.5)
+            except queue.Empty:
+                command = None
+            if command == "reload":
+                self.reload("console")
+            elif command == "status":
+                self.status()
+            elif command in ("stop", "exit", "quit"):
+                break
+            elif command:
+                log(f"未知命令：{command}（可用 reload / status / stop）")
+            if time.monotonic() - last_check >= WATCH_INTERVAL:
+                last_check = time.monotonic()
+                mtimes = watch_mtimes()
+                if mtimes != self.mtimes:
+                    changed = [os.path.basename(p) for p, a, b in zip(WATCH_FILES, mtimes, self.mtimes) if a != b]
+                    self.mtimes = mtimes
+                    self.reload(f"{', '.join(changed)} 已修改")
+
+
+def run_legacy():
     while True:
         log(f"启动 dify_publisher.py ...")
         try:
@@ -50,5 +311,25 @@ def main():
         time.sleep(RESTART_DELAY)
 
 
+def main():
+    log("=== DifyPublisher 守护进程启动 ===")
+    log(f"目标脚本: {TARGET}")
+    log(f"Python: {sys.executable}")
+
+    if not HANDOFF:
+        run_legacy()
+        return
+    supervisor = Supervisor()
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        log("收到 Ctrl+C，守护进程退出。")
+    except Exception as e:
+        log(f"异常: {e}")
+        raise
+    finally:
+        supervisor.shutdown()
+
+
 if __name__ == "__main__":
     main()
@@ -1,17 +1,35 @@
 // Build-time manifest generator
-// Scans public/{ai,game}/YYYY/MM/DD.md and emits public/manifest.json
+// Scans public/{ai,game}/YYYY/MM/DD.md and emits the sharded manifest:
+//   public/manifest/index.json            site meta + { category: { 'YYYY-MM': count } }
+//   public/manifest/<category>/YYYY-MM.json entries of one month
+// The legacy monolithic public/manifest.json is only written with LEGACY_MANIFEST=1.
+// Every file is written together with .gz/.br siblings (same layout as the publisher's PRECOMPRESS),
+// so servers that prefer precompressed files never serve variants of a stale publisher-built copy.
 // No external deps; tolerant frontmatter parser.
 
 import { promises as fs } from 'fs';
 import path from 'path';
+import zlib from 'zlib';
 
 const PUB_DIR = path.resolve('public');
 const CATS = ['ai', 'game'];
+const MANIFEST_DIR = path.join(PUB_DIR, 'manifest');
+const WRITE_LEGACY = process.env.LEGACY_MANIFEST === '1';
 
 async function fileExists(p) {
   try { await fs.access(p); return true; } catch { return false; }
 }
 
+async function writeWithVariants(p, text) {
+  const raw = Buffer.from(text, 'utf8');
+  await fs.mkdir(path.dirname(p), { recursive: true });
+  await fs.writeFile(p, raw);
+  await fs.writeFile(p + '.gz', zlib.gzipSync(raw, { level: 9 }));
+  await fs.writeFile(p + '.br', zlib.brotliCompressSync(raw, {
+    params: { [zlib.constants.BROTLI_PARAM_QUALITY]: 11, [zlib.constants.BROTLI_PARAM_SIZE_HINT]: raw.length },
+  }));
+}
+
 function toPosix(p) { return p.split(path.sep).join('/'); }
 
 function parseFrontmatter(text) {
@@ -58,10 +76,11 @@ function firstParagraph(md) {
 }
 
 async function readSiteDefaults() {
-  // prefer root manifest for site meta if exists
-  const rootManifest = path.resolve('manifest.json');
-  if (await fileExists(rootManifest)) {
-    try { return JSON.parse(await fs.readFile(rootManifest, 'utf8')).site || {}; } catch {}
+  // prefer root manifest index / legacy manifest for site meta if exists
+  for (const p of [path.resolve('manifest', 'index.json'), path.resolve('manifest.json')]) {
+    if (await fileExists(p)) {
+      try { return JSON.parse(await fs.readFile(p, 'utf8')).site || {}; } catch {}
+    }
   }
   return { title: 'AI / 游戏 日报', description: '每天 10 分钟，跟上进展', baseUrl: '' };
 }
@@ -118,10 +137,25 @@ async function main() {
     months,
   };
 
-  const out = path.join(PUB_DIR, 'manifest.json');
-  await fs.mkdir(path.dirname(out), { recursive: true });
-  await fs.writeFile(out, JSON.stringify(manifest, null, 2), 'utf8');
-  console.log(`[generate-manifest] wrote ${toPosix(path.relative(process.cwd(), out))}`);
+  const shards = {};
+  for (const cat of Object.keys(months)) {
+    shards[cat] = {};
+    for (const key of Object.keys(months[cat]).sort().reverse()) {
+      const shardPath = path.join(MANIFEST_DIR, cat, `${key}.json`);
+      await writeWithVariants(shardPath, JSON.stringify(months[cat][key], null, 2));
+      shards[cat][key] = months[cat][key].length;
+    }
+  }
+  const index = { site, categories: manifest.categories, shards };
+  const indexPath = path.join(MANIFEST_DIR, 'index.json');
+  await writeWithVariants(indexPath, JSON.stringify(index, null, 2));
+  console.log(`[generate-manifest] wrote ${toPosix(path.relative(process.cwd(), indexPath))} + shards`);
+
+  if (WRITE_LEGACY) {
+    const out = path.join(PUB_DIR, 'manifest.json');
+    await writeWithVariants(out, JSON.stringify(manifest, null, 2));
+    console.log(`[generate-manifest] wrote ${toPosix(path.relative(process.cwd(), out))}`);
+  }
 }
 
 main().catch((e) => { console.error('[generate-manifest] failed', e); process.exit(1); });
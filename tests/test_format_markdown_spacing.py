@@ -0,0 +1,136 @@
+"""format_markdown_spacing 单遍改写的回归测试：与改写前的实现（下方冻结副本）逐字节比较，并固定围栏边界情况的输出。"""
+import os
+import random
+import re
+
+import pytest
+
+from dify_publisher import format_markdown_spacing
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def format_markdown_spacing_v15(md: str) -> str:
+    """改写前的实现（原样冻结，仅用于对照；不认识 ~~~ 围栏）。"""
+    if not md:
+        return ""
+
+    md = md.replace("\r\n", "\n").replace("\ufeff", "")
+    lines = md.split("\n")
+
+    out = []
+    in_code = False
+
+    def is_unordered_list(s: str) -> bool:
+        return bool(re.match(r'^\s*[-*+]\s+', s))
+
+    def is_ordered_list(s: str) -> bool:
+        return bool(re.match(r'^\s*\d+\s*[.)、]\s+', s))
+
+    def is_list(s: str) -> bool:
+        return is_unordered_list(s) or is_ordered_list(s)
+
+    def is_heading(s: str) -> bool:
+        return bool(re.match(r'^\s*#{1,6}\s+', s))
+
+    def is_blockquote(s: str) -> bool:
+        return bool(re.match(r'^\s*>', s))
+
+    def is_hr(s: str) -> bool:
+        return bool(re.match(r'^\s*(?:-{3,}|\*{3,}|_{3,})\s*$', s))
+
+    i = 0
+    prev_line_out = ""
+
+    while i < len(lines):
+        line = lines[i]
+
+        if re.match(r'^\s*```', line):
+            in_code = not in_code
+            out.append(line)
+            prev_line_out = line
+            i += 1
+            continue
+
+        if in_code:
+            out.append(line)
+            prev_line_out = line
+            i += 1
+            continue
+
+        if is_list(line) and prev_line_out.strip() and not (
+            is_list(prev_line_out) or is_blockquote(prev_line_out) or
+            is_heading(prev_line_out) or is_hr(prev_line_out)
+        ):
+            out.append("")
+
+        out.append(line)
+
+        if i < len(lines) - 1:
+            nxt = lines[i + 1]
+            if (is_heading(line) or is_blockquote(line) or is_list(line) or is_hr(line)):
+                same_block_continuation = (
+                    (is_blockquote(line) and is_blockquote(nxt)) or
+                    (is_list(line) and is_list(nxt))
+                )
+                if nxt.strip() and not same_block_continuation:
+                    out.append("")
+
+        prev_line_out = out[-1] if out else ""
+        i += 1
+
+    if out and out[-1] != "":
+        out.append("")
+    return "\n".join(out)
+
+
+def _archive_files():
+    for top in ("ai", "game", os.path.join("public", "ai"), os.path.join("public", "game")):
+        for dirpath, _, filenames in os.walk(os.path.join(REPO_ROOT, top)):
+            for name in filenames:
+                if name.endswith(".md"):
+                    yield os.path.join(dirpath, name)
+
+
+def test_archive_matches_previous_implementation():
+    files = sorted(_archive_files())
+    if not files:
+        pytest.skip("仓库中没有归档日报")
+    mismatched = []
+    for path in files:
+        with open(path, "rb") as f:
+            md = f.read().decode("utf-8", errors="replace")
+        if format_markdown_spacing(md) != format_markdown_spacing_v15(md):
+            mismatched.append(os.path.relpath(path, REPO_ROOT))
+    assert not mismatched, f"{len(mismatched)}/{len(files)} 篇输出不一致：{mismatched[:10]}"
+
+
+# 行池不含 ~~~：这类输入上新旧实现应完全一致
+_LINES = ["", " ", "正文", "text", "# H1", "## H2 标题", "####### 非标题", "#无空格", "> 引用", ">", "  > 缩进引用",
+          "- 项", "* 项", "+ 项", "  - 嵌套", "1. 有序", "2) 有序", "3、有序", "10 . 空格", "-无空格", "---", "***",
+          "___", "- - -", "```", "```py", "   ```", "\t```", "\u200b", "\ufeff正文", "a\r"]
+
+
+def test_random_block_mix_matches_previous_implementation():
+    rng = random.Random(20261016)
+    for _ in range(5000):
+        md = "\n".join(rng.choice(_LINES) for _ in range(rng.randint(0, 12)))
+        assert format_markdown_spacing(md) == format_markdown_spacing_v15(md), repr(md)
+
+
+@pytest.mark.parametrize("md, expected", [
+    # ~~~ 围栏内部原样保留，结束后恢复补空行
+    ("text\n~~~\n# not heading\n- item\ntext\n~~~\n# H\nbody",
+     "text\n~~~\n# not heading\n- item\ntext\n~~~\n# H\n\nbody\n"),
+    # ``` 块内的 ~~~ 不结束代码块，反之亦然
+    ("```\n~~~\n# code\n```\n# H\nbody", "```\n~~~\n# code\n```\n# H\n\nbody\n"),
+    ("~~~md\n```\n- x\n~~~\n- a\nbody", "~~~md\n```\n- x\n~~~\n\n- a\n\nbody\n"),
+    # 缩进围栏
+    ("para\n   ```py\n# comment\n- x\n   ```\n- a\nbody", "para\n   ```py\n# comment\n- x\n   ```\n\n- a\n\nbody\n"),
+    ("para\n  ~~~\n> q\n  ~~~\n> q", "para\n  ~~~\n> q\n  ~~~\n> q\n"),
+    # 未闭合的围栏：之后的内容全部视为代码，不做改动
+    ("para\n```\n# h\n- a\ntext", "para\n```\n# h\n- a\ntext\n"),
+    ("# T\n~~~\n> q\nx", "# T\n\n~~~\n> q\nx\n"),
+])
+def test_fence_edge_cases(md, expected):
+    assert format_markdown_spacing(md) == expected
@@ -0,0 +1,75 @@
+"""plumbing 后端（GitObjectStore）端到端：暂存 → 提交 → 内容不变再提交 → 推送到临时裸仓库。"""
+import shutil
+import subprocess
+
+import pytest
+
+import dify_publisher as dp
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="需要 git")
+
+
+def git(cwd, *args) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def report(extra: str = "") -> str:
+    return "# 2026年10月16日 游戏日报\n\n## 要闻\n\n" + "正文内容很多。" * 40 + extra + "\n"
+
+
+@pytest.fixture
+def target(tmp_path, monkeypatch):
+    remote = tmp_path / "remote.git"
+    repo = tmp_path / "repo"
+    git(tmp_path, "init", "-q", "--bare", str(remote))
+    git(tmp_path, "init", "-q", str(repo))
+    git(repo, "config", "user.name", "tester")
+    git(repo, "config", "user.email", "tester@example.com")
+    git(repo, "commit", "-q", "--allow-empty", "-m", "init")
+    git(repo, "branch", "-M", "main")
+    git(repo, "remote", "add", "origin", str(remote))
+    git(repo, "push", "-q", "origin", "main")
+    for name, value in (("TARGETS_CONFIG", None), ("TARGETS", []), ("GIT_BACKEND", "plumbing"),
+                        ("GITHUB_REPO_PATH", str(repo)), ("QUEUE_DIR", str(tmp_path / "queue")),
+                        ("HASH_INDEX_PATH", str(tmp_path / "hashes.json")), ("BACKGROUND_PUSH", False),
+                        ("RENDER_HTML", False), ("PRECOMPRESS", False)):
+        monkeypatch.setattr(dp, name, value)
+    t = dp.init_targets()[0]
+    yield t
+    with t.lock:
+        t.close_store()
+
+
+def test_stage_commit_recommit_push(target, tmp_path):
+    remote = str(tmp_path / "remote.git")
+    base = git(remote, "rev-parse", "main")
+
+    result = dp.stage_dify_report(report())
+    sha = dp.commit_staged([result])
+    assert result["changed"] is True and result["commit"] == sha
+    assert git(target.repo, "rev-parse", "main") == sha
+    assert git(remote, "rev-parse", "main") == sha
+    assert git(remote, "rev-parse", f"{sha}^") == base
+    files = git(remote, "ls-tree", "-r", "--name-only", "main").splitlines()
+    assert any(f.endswith(result["path"]) for f in files)
+
+    # 内容完全一致的重发：内容哈希直接判定未变化，不写盘
+    again = dp.stage_dify_report(report())
+    assert again["status"] == "unchanged"
+    assert dp.commit_staged([again]) is None
+
+    # 绕过内容哈希、把同样的字节重新写入 overlay：按 blob sha 比对后不产生新提交，分支不动
+    md_path = next(f for f in files if f.endswith(result["path"]))
+    with target.lock:
+        store = target.store()
+        store.write(md_path, store.read(md_path))
+        assert store.commit("no-op") == (False, sha)
+    assert git(target.repo, "rev-parse", "main") == sha
+    assert git(remote, "rev-parse", "main") == sha
+
+    # 内容有变化：新提交快进在上一次之上并推送
+    changed = dp.stage_dify_report(report("补充一段。"))
+    new_sha = dp.commit_staged([changed])
+    assert changed["changed"] is True and new_sha != sha
+    assert git(remote, "rev-parse", "main") == new_sha
+    assert git(remote, "rev-parse", f"{new_sha}^") == sha